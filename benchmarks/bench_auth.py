@@ -0,0 +1,67 @@
+"""
+Per-request authentication overhead of `get_current_user`, with and without the token/user caches.
+
+Resolves the same bearer token repeatedly against a SQLite database and reports the mean
+and p99 cost of each call.
+
+Usage:
+    python benchmarks/bench_auth.py --iterations 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker  # noqa: E402
+
+from utils.auth import create_access_token, get_current_user, clear_auth_caches  # noqa: E402
+from utils.db import Base, User  # noqa: E402
+
+async def measure(session_factory, token: str, iterations: int, cached: bool) -> dict:
+    samples = []
+    clear_auth_caches()
+    for _ in range(iterations):
+        if not cached:
+            clear_auth_caches()
+        started = time.perf_counter()
+        async with session_factory() as db:
+            await get_current_user(token=token, db=db)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {
+        "cached": cached,
+        "iterations": iterations,
+        "mean_us": round(statistics.mean(samples) * 1e6, 1),
+        "p99_us": round(samples[int(0.99 * (len(samples) - 1))] * 1e6, 1),
+    }
+
+async def run(iterations: int) -> list:
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    async with session_factory() as db:
+        db.add(User(id=1, username="benchuser", email="bench@example.com", hashed_password="hashed_password"))
+        await db.commit()
+    token = create_access_token(data={"sub": 1})
+    try:
+        return [
+            await measure(session_factory, token, iterations, cached=False),
+            await measure(session_factory, token, iterations, cached=True),
+        ]
+    finally:
+        await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+    print(json.dumps({"benchmark": "auth", "results": asyncio.run(run(args.iterations))}, indent=2))
+
+if __name__ == "__main__":
+    main()
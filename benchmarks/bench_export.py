@@ -0,0 +1,160 @@
+"""
+Throughput and peak memory of the streaming request-history export.
+
+Builds a SQLite fixture with `--rows` requests (one million by default; pass
+`--database-url` for a local Postgres) and exports it in a child process per format,
+reporting rows/sec, output size and the child's peak RSS. With `--baseline` the same
+rows are also exported by loading them all through the ORM first, which is what the
+streaming path avoids: its peak RSS grows with the history, the streaming one does not.
+
+    python benchmarks/bench_export.py --rows 1000000 --baseline
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.common import write_report  # noqa: E402
+
+FIXTURE_CHUNK = 10000
+
+# Runs in a fresh interpreter so ru_maxrss reflects the export alone
+EXPORT_SCRIPT = """
+import asyncio, json, sys, time
+sys.path.insert(0, {root!r})
+from utils.db import AsyncSessionLocal
+from utils.export import encode_export, iter_request_rows
+
+async def main():
+    rows = written = 0
+    async def counted(batches):
+        nonlocal rows
+        async for batch in batches:
+            rows += len(batch)
+            yield batch
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        async for chunk in encode_export(counted(iter_request_rows(db, batch_size={batch_size})), {export_format!r}, {compress!r}):
+            written += len(chunk)
+    print(json.dumps({{"rows": rows, "bytes": written, "seconds": time.perf_counter() - started}}))
+
+asyncio.run(main())
+"""
+
+BASELINE_SCRIPT = """
+import asyncio, json, sys, time
+sys.path.insert(0, {root!r})
+from sqlalchemy import select
+from utils.db import AsyncSessionLocal, Request
+from utils.export import EXPORT_COLUMNS, encode_ndjson
+
+async def main():
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        requests = (await db.scalars(select(Request).order_by(Request.id))).all()
+        rows = [{{column: getattr(request, column) for column in EXPORT_COLUMNS}} for request in requests]
+        written = len(encode_ndjson(rows).encode())
+    print(json.dumps({{"rows": len(rows), "bytes": written, "seconds": time.perf_counter() - started}}))
+
+asyncio.run(main())
+"""
+
+def build_fixture(database_url: str, rows: int, response_size: int):
+    """Creates the tables and inserts `rows` requests for one user in chunks."""
+    from sqlalchemy import create_engine, insert
+    # utils.db builds its engines from DATABASE_URL at import
+    os.environ["DATABASE_URL"] = database_url
+    from utils.db import Base, Request, User
+
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    response = "x" * response_size
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"id": 1, "username": "exportuser", "email": "export@example.com", "hashed_password": "-"}])
+        for start in range(0, rows, FIXTURE_CHUNK):
+            conn.execute(insert(Request), [
+                {
+                    "model": "gpt-3.5-turbo",
+                    "prompt": f"Export benchmark prompt {i}",
+                    "parameters": {"temperature": 0.7, "max_tokens": 64},
+                    "response": response,
+                    "user_id": 1,
+                }
+                for i in range(start, min(rows, start + FIXTURE_CHUNK))
+            ])
+    engine.dispose()
+
+def run_child(script: str, database_url: str) -> dict:
+    """Runs a script in a child interpreter and returns its JSON result plus its peak RSS."""
+    process = subprocess.Popen(
+        [sys.executable, "-c", script],
+        cwd=ROOT,
+        env={**os.environ, "DATABASE_URL": database_url},
+        stdout=subprocess.PIPE,
+    )
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"Export child exited with code {process.returncode}")
+    result = json.loads(output)
+    return {
+        "rows": result["rows"],
+        "bytes": result["bytes"],
+        "seconds": round(result["seconds"], 3),
+        "rows_per_second": round(result["rows"] / result["seconds"]) if result["seconds"] else 0,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+    }
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--response-size", type=int, default=256, help="Characters per stored response")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows fetched per round trip")
+    parser.add_argument("--formats", default="ndjson,csv,ndjson.gz", help="Formats to export; a .gz suffix gzips")
+    parser.add_argument("--baseline", action="store_true", help="Also export by loading every row through the ORM")
+    parser.add_argument("--database-url", default="", help="Use an existing (empty) database instead of a scratch SQLite file")
+    parser.add_argument("--output", default="")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        database_url = args.database_url or f"sqlite:///{os.path.join(scratch, 'export.db')}"
+        started = time.perf_counter()
+        # Build in a separate process: children inherit the parent's peak RSS, which would mask theirs
+        builder = multiprocessing.get_context("spawn").Process(
+            target=build_fixture, args=(database_url, args.rows, args.response_size)
+        )
+        builder.start()
+        builder.join()
+        if builder.exitcode != 0:
+            raise RuntimeError("Building the fixture failed")
+        print(f"Fixture of {args.rows} rows built in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        results = {}
+        for name in args.formats.split(","):
+            export_format, _, suffix = name.partition(".")
+            script = EXPORT_SCRIPT.format(root=ROOT, batch_size=args.batch_size, export_format=export_format, compress=suffix == "gz")
+            results[name] = run_child(script, database_url)
+            print(f"{name}: {results[name]['rows_per_second']} rows/s, {results[name]['peak_rss_mb']} MB peak", file=sys.stderr)
+        if args.baseline:
+            results["orm_all"] = run_child(BASELINE_SCRIPT.format(root=ROOT), database_url)
+
+    write_report({
+        "benchmark": "export",
+        "rows": args.rows,
+        "response_size": args.response_size,
+        "batch_size": args.batch_size,
+        "results": results,
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
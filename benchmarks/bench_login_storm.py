@@ -0,0 +1,126 @@
+"""
+Impact of a login storm on concurrent `/requests/create` latency.
+
+Starts the service against the mock upstream and drives `/requests/create` at a steady
+concurrency while a second group of clients hammers `/users/login`. Each scenario runs a
+fresh service:
+
+- `baseline`: no logins, just the create traffic
+- `inline`: logins with bcrypt on the event loop (PASSWORD_POOL_SIZE=0)
+- `pooled`: logins with bcrypt on the bounded pool (the default)
+
+Inline bcrypt stalls every request on the worker while it hashes, which shows up as a
+much higher create p99; the pool keeps it near the baseline and sheds excess logins
+with 503s.
+
+    python benchmarks/bench_login_storm.py --requests 1000 --login-concurrency 32 --bcrypt-rounds 12
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Optional
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.common import latency_summary, write_report  # noqa: E402
+from benchmarks.loadtest import LoadTest, ServiceProcess  # noqa: E402
+from benchmarks.mock_upstream import MockUpstream, start_mock_upstream  # noqa: E402
+
+SCENARIOS = {
+    "baseline": {},
+    "inline": {"PASSWORD_POOL_SIZE": "0"},
+    "pooled": {},
+}
+
+async def login_storm(base_url: str, concurrency: int, stop: asyncio.Event) -> dict:
+    """Logs in repeatedly from `concurrency` clients until `stop` is set."""
+    latencies = []
+    statuses: Counter = Counter()
+    credentials = {"username": "stormuser", "email": "storm@example.com", "password": "storm-password"}
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{base_url}/users/register", json=credentials) as response:
+            await response.read()
+
+        async def client():
+            while not stop.is_set():
+                started = time.perf_counter()
+                async with session.post(f"{base_url}/users/login", json=credentials) as response:
+                    await response.read()
+                    statuses[str(response.status)] += 1
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+    return {**latency_summary(latencies), "statuses": dict(statuses)}
+
+async def run_scenario(name: str, args) -> dict:
+    mock = MockUpstream(latency=args.upstream_latency)
+    runner, upstream_url = await start_mock_upstream(mock)
+    service = None
+    with tempfile.TemporaryDirectory() as scratch:
+        try:
+            env = {
+                "DATABASE_URL": f"sqlite:///{os.path.join(scratch, 'storm.db')}",
+                "OPENAI_BASE_URL": upstream_url,
+                "OPENAI_API_KEY": "loadtest",
+                "JWT_SECRET": "loadtest-secret",
+                "CACHE_ENABLED": "false",
+                "RATE_LIMIT_ENABLED": "false",
+                "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+                **SCENARIOS[name],
+            }
+            service = ServiceProcess(args.app, env)
+            await service.start()
+            load = LoadTest(service.url, {"create": 1}, args.model, deterministic=False, unique_prompts=args.requests)
+            stop = asyncio.Event()
+            storm = None
+            if name != "baseline":
+                storm = asyncio.ensure_future(login_storm(service.url, args.login_concurrency, stop))
+                await asyncio.sleep(args.warmup)
+            elapsed = await load.run(args.requests, args.concurrency)
+            stop.set()
+            report = {"create": latency_summary(load.latencies["create"], elapsed)}
+            report["create"]["statuses"] = dict(load.statuses["create"])
+            if storm is not None:
+                report["login"] = await storm
+            return report
+        finally:
+            if service is not None:
+                service.stop()
+            await runner.cleanup()
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="/requests/create calls per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent /requests/create clients")
+    parser.add_argument("--login-concurrency", type=int, default=32, help="Concurrent /users/login clients")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--upstream-latency", type=float, default=0.02)
+    parser.add_argument("--warmup", type=float, default=0.5, help="Seconds the storm runs before measuring")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--model", default="text-davinci-003")
+    parser.add_argument("--app", default="main:app")
+    parser.add_argument("--output", default="")
+    args = parser.parse_args(argv)
+
+    scenarios = {}
+    for name in args.scenarios.split(","):
+        scenarios[name] = asyncio.run(run_scenario(name, args))
+        print(f"{name}: create p99 {scenarios[name]['create'].get('p99_ms')} ms", file=sys.stderr)
+    write_report({
+        "benchmark": "login_storm",
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "login_concurrency": args.login_concurrency,
+        "bcrypt_rounds": args.bcrypt_rounds,
+        "scenarios": scenarios,
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Throughput of the rate limiter itself.
+
+Measures admission checks per second for the in-process token buckets, spread over a
+configurable number of users, and optionally for the Redis Lua buckets.
+
+Usage:
+    python benchmarks/bench_rate_limit.py --checks 200000 --users 1000
+    python benchmarks/bench_rate_limit.py --checks 20000 --redis-url redis://localhost:6379
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.rate_limit import LocalRateLimiter, RedisRateLimiter, RateLimit  # noqa: E402
+
+# Limits high enough that every check is admitted, so only the limiter's own cost is measured
+LIMITS = {"default": RateLimit(requests_per_minute=1e12, tokens_per_minute=1e15)}
+
+async def measure(limiter, checks: int, users: int, concurrency: int) -> dict:
+    async def worker(offset: int):
+        for i in range(offset, checks, concurrency):
+            await limiter.acquire(i % users, "gpt-3.5-turbo", 1, 100)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "backend": type(limiter).__name__,
+        "checks": checks,
+        "checks_per_second": round(checks / elapsed, 1),
+        "mean_us": round(elapsed / checks * 1e6, 2),
+    }
+
+async def run(checks: int, users: int, concurrency: int, redis_url: str) -> list:
+    results = [await measure(LocalRateLimiter(LIMITS), checks, users, concurrency)]
+    if redis_url:
+        limiter = RedisRateLimiter.from_url(redis_url, LIMITS)
+        limiter.prefix = "ratelimit-bench:"
+        results.append(await measure(limiter, checks, users, concurrency))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checks", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50, help="Concurrent tasks issuing checks")
+    parser.add_argument("--redis-url", default="", help="Also benchmark the Redis backend against this server")
+    args = parser.parse_args()
+    results = asyncio.run(run(args.checks, args.users, args.concurrency, args.redis_url))
+    print(json.dumps({"benchmark": "rate_limit", "results": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Interactive latency under a concurrent bulk job, with and without weighted fair queueing.
+
+Simulates upstream calls of fixed latency behind the scheduler's global cap. Closed-loop
+interactive clients (with think time) issue calls while a bulk job pushes `--bulk-requests`
+calls with `--bulk-concurrency` in flight. Each scenario reports interactive latency
+(queue wait plus upstream), the interactive queue wait, rejections and the bulk job's
+throughput:
+
+- `idle`: interactive clients alone.
+- `fifo`: every call in one class, i.e. a first-come-first-served queue behind the cap.
+- `fair`: separate classes of equal weight.
+- `weighted`: the default classes (interactive weight 8, batch weight 1).
+
+    python benchmarks/bench_scheduler.py --slots 16 --latency 0.05 --bulk-requests 3000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.common import latency_summary, write_report  # noqa: E402
+
+async def run_scenario(scheduler, args, bulk: bool, shared_queue: bool = False) -> dict:
+    from fastapi import HTTPException
+
+    rng = random.Random(5)
+    interactive_latencies, interactive_waits, bulk_latencies = [], [], []
+    rejected = {"interactive": 0, "batch": 0}
+    done = asyncio.Event()
+
+    async def call(request_class: str) -> Optional[float]:
+        started = time.perf_counter()
+        try:
+            async with scheduler.slot("batch" if shared_queue else request_class):
+                waited = time.perf_counter() - started
+                await asyncio.sleep(args.latency * rng.uniform(0.8, 1.2))
+        except HTTPException:
+            rejected[request_class] += 1
+            return None
+        if request_class == "interactive":
+            interactive_latencies.append(time.perf_counter() - started)
+            interactive_waits.append(waited)
+        else:
+            bulk_latencies.append(time.perf_counter() - started)
+        return waited
+
+    async def interactive_client():
+        while not done.is_set():
+            await call("interactive")
+            await asyncio.sleep(args.think_time * rng.uniform(0.5, 1.5))
+
+    async def bulk_job():
+        semaphore = asyncio.Semaphore(args.bulk_concurrency)
+
+        async def item():
+            async with semaphore:
+                await call("batch")
+
+        await asyncio.gather(*(item() for _ in range(args.bulk_requests)))
+
+    clients = [asyncio.ensure_future(interactive_client()) for _ in range(args.interactive_clients)]
+    started = time.perf_counter()
+    if bulk:
+        await bulk_job()
+    else:
+        await asyncio.sleep(args.bulk_requests * args.latency / args.slots)
+    elapsed = time.perf_counter() - started
+    done.set()
+    await asyncio.gather(*clients)
+    return {
+        "interactive": latency_summary(interactive_latencies),
+        "interactive_queue_wait": latency_summary(interactive_waits),
+        "bulk": latency_summary(bulk_latencies, elapsed) if bulk else {"count": 0},
+        "rejected": rejected,
+    }
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--slots", type=int, default=16, help="SCHEDULER_MAX_CONCURRENCY")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated upstream latency in seconds")
+    parser.add_argument("--interactive-clients", type=int, default=8)
+    parser.add_argument("--think-time", type=float, default=0.05, help="Mean pause between an interactive client's calls")
+    parser.add_argument("--bulk-requests", type=int, default=3000)
+    parser.add_argument("--bulk-concurrency", type=int, default=256, help="Bulk calls in flight (queued or running)")
+    parser.add_argument("--interactive-deadline", type=float, default=30.0)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # utils.db builds its engines from DATABASE_URL at import
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(scratch, 'unused.db')}")
+        from utils.scheduler import RequestClass, Scheduler
+
+        weights = {"idle": (8, 1), "fifo": (1, 1), "fair": (1, 1), "weighted": (8, 1)}
+        results = {}
+        for name, (interactive_weight, batch_weight) in weights.items():
+            scheduler = Scheduler(args.slots, {
+                "interactive": RequestClass("interactive", interactive_weight, args.interactive_deadline),
+                "batch": RequestClass("batch", batch_weight),
+            }, "interactive")
+            results[name] = asyncio.run(run_scenario(scheduler, args, bulk=name != "idle", shared_queue=name == "fifo"))
+            print(f"{name}: interactive p99 {results[name]['interactive'].get('p99_ms')} ms", file=sys.stderr)
+
+    write_report({
+        "benchmark": "scheduler",
+        "slots": args.slots,
+        "latency_s": args.latency,
+        "interactive_clients": args.interactive_clients,
+        "bulk_requests": args.bulk_requests,
+        "bulk_concurrency": args.bulk_concurrency,
+        "results": results,
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
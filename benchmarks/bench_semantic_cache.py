@@ -0,0 +1,109 @@
+"""
+Lookup latency of the semantic cache against index size.
+
+Fills one model's index with synthetic templated prompts, then times lookups of perturbed
+copies of stored prompts (re-cased, re-spaced, punctuation changed) and of unseen prompts.
+Each size is run with the exact scan (`flat`) and with the IVF-partitioned index (`ivf`);
+for `ivf` the report includes its recall against the exact scan. Latencies cover the full
+lookup (embedding plus search); `search_*` covers the index search alone.
+
+    python benchmarks/bench_semantic_cache.py --sizes 1000,10000,100000 --dim 256
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.common import latency_summary, write_report  # noqa: E402
+
+SUBJECTS = ["invoice", "refund", "password", "shipment", "subscription", "report", "export", "account"]
+ACTIONS = ["cancel", "update", "download", "reset", "track", "share", "delete", "upgrade"]
+PARAMETERS = {"temperature": 0}
+
+def make_prompt(rng: random.Random, i: int) -> str:
+    return (
+        f"How do I {rng.choice(ACTIONS)} my {rng.choice(SUBJECTS)} number {i} "
+        f"from the {rng.choice(['web', 'mobile', 'desktop'])} app before {rng.randint(1, 28)} {rng.choice(['May', 'June', 'July'])}?"
+    )
+
+def perturb(rng: random.Random, prompt: str) -> str:
+    """A copy that embeds identically: different casing, spacing and punctuation."""
+    words = prompt.rstrip("?").split(" ")
+    return "  ".join(word.upper() if rng.random() < 0.3 else word for word in words) + rng.choice(["", "?!", " ..."])
+
+def measure(cache, prompts: list, queries: int, rng: random.Random) -> dict:
+    index = cache.indexes["gpt-3.5-turbo"]
+    group = cache.group("gpt-3.5-turbo", PARAMETERS)
+    lookups, searches, hits = [], [], 0
+    for _ in range(queries):
+        known = rng.random() < 0.5
+        query = perturb(rng, rng.choice(prompts)) if known else make_prompt(rng, rng.randint(10 ** 7, 10 ** 8))
+        started = time.perf_counter()
+        hits += cache.get("gpt-3.5-turbo", query, PARAMETERS) is not None
+        lookups.append(time.perf_counter() - started)
+        vector = cache.embedder.embed(query)
+        started = time.perf_counter()
+        index.search(vector, group)
+        searches.append(time.perf_counter() - started)
+    summary = latency_summary(lookups)
+    search = latency_summary(searches)
+    summary.update({f"search_{key}": value for key, value in search.items() if key != "count"})
+    summary["hit_rate"] = round(hits / queries, 3)
+    return summary
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,50000", help="Comma-separated index sizes")
+    parser.add_argument("--dim", type=int, default=256, help="SEMANTIC_CACHE_DIM")
+    parser.add_argument("--nprobe", type=int, default=8, help="SEMANTIC_CACHE_NPROBE")
+    parser.add_argument("--threshold", type=float, default=0.92, help="SEMANTIC_CACHE_THRESHOLD")
+    parser.add_argument("--queries", type=int, default=1000, help="Lookups per configuration")
+    parser.add_argument("--output", default="")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # utils.db builds its engines from DATABASE_URL at import
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(scratch, 'unused.db')}")
+        from utils.semantic_cache import HashingEmbedder, SemanticCache
+
+        results = {}
+        for size in [int(size) for size in args.sizes.split(",")]:
+            rng = random.Random(size)
+            prompts = [make_prompt(rng, i) for i in range(size)]
+            embedder = HashingEmbedder(args.dim)
+            vectors = [embedder.embed(prompt) for prompt in prompts]
+            results[size] = {"index_bytes": size * args.dim * 4}
+            for name, train_size in (("flat", size + 1), ("ivf", 2048)):
+                cache = SemanticCache(embedder, threshold=args.threshold, max_entries=size, nprobe=args.nprobe, train_size=train_size)
+                index = cache.index("gpt-3.5-turbo")
+                group = cache.group("gpt-3.5-turbo", PARAMETERS)
+                started = time.perf_counter()
+                for position, vector in enumerate(vectors):
+                    index.add(vector, group, position, ttl=3600)
+                if index.needs_training:
+                    index.train()
+                results[size][name] = {"build_s": round(time.perf_counter() - started, 3)}
+                results[size][name].update(measure(cache, prompts, args.queries, random.Random(1)))
+                if name == "ivf" and index.centroids is not None:
+                    samples = random.Random(2).sample(range(size), min(size, 500))
+                    found = sum(index.search(vectors[position], group)[0] == position for position in samples)
+                    results[size][name]["lists"] = len(index.centroids)
+                    results[size][name]["recall"] = round(found / len(samples), 3)
+                print(f"{size} {name}: p50 {results[size][name]['p50_ms']} ms", file=sys.stderr)
+
+    write_report({
+        "benchmark": "semantic_cache",
+        "dim": args.dim,
+        "nprobe": args.nprobe,
+        "threshold": args.threshold,
+        "results": results,
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Thundering-herd benchmark for single-flight coalescing.
+
+Fires bursts of identical requests at a fake upstream with fixed latency and reports
+how many upstream calls were made with and without coalescing.
+
+Usage:
+    python benchmarks/bench_singleflight.py --concurrency 500 --bursts 10 --latency 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.singleflight import SingleFlight  # noqa: E402
+
+class FakeUpstream:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    async def complete(self, prompt: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return f"completion for {prompt}"
+
+async def run(concurrency: int, bursts: int, latency: float, coalesce: bool) -> dict:
+    upstream = FakeUpstream(latency)
+    singleflight = SingleFlight()
+
+    async def call(prompt: str):
+        if not coalesce:
+            return await upstream.complete(prompt)
+        return await singleflight.do(prompt, lambda: upstream.complete(prompt))
+
+    started = time.perf_counter()
+    for burst in range(bursts):
+        prompt = f"prompt-{burst}"
+        await asyncio.gather(*(call(prompt) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    requests = concurrency * bursts
+    return {
+        "coalesce": coalesce,
+        "requests": requests,
+        "upstream_calls": upstream.calls,
+        "coalesced": requests - upstream.calls,
+        "elapsed_seconds": round(elapsed, 4),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=500, help="Identical requests per burst")
+    parser.add_argument("--bursts", type=int, default=10, help="Number of bursts, each with a distinct prompt")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake upstream latency in seconds")
+    args = parser.parse_args()
+
+    results = [
+        asyncio.run(run(args.concurrency, args.bursts, args.latency, coalesce=False)),
+        asyncio.run(run(args.concurrency, args.bursts, args.latency, coalesce=True)),
+    ]
+    print(json.dumps({"benchmark": "singleflight", "results": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
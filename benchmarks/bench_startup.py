@@ -0,0 +1,139 @@
+"""
+Cold-start cost: how long importing the app takes, and what it spends the time on.
+
+Each run starts a fresh interpreter with `python -X importtime -c "import <module>"` and
+parses its import profile. The report gives the median total import time, the median wall
+time of the whole process (interpreter start included) and the packages with the most
+import time (self time summed per top-level package). With `--startup`, a further fresh
+process imports `--app` and runs its lifespan (startup then shutdown) to time startup too.
+
+`--budget-ms` makes it a CI check: the script exits with status 1 when the median import
+time exceeds the budget.
+
+    python benchmarks/bench_startup.py --repeat 5 --startup --budget-ms 1500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.common import write_report  # noqa: E402
+
+# Imports the app in a fresh process, then runs its lifespan and prints the timings as JSON
+STARTUP_SCRIPT = """
+import asyncio, importlib, json, time
+started = time.perf_counter()
+module_name, _, attribute = {app!r}.partition(":")
+app = getattr(importlib.import_module(module_name), attribute or "app")
+imported = time.perf_counter()
+
+async def lifespan():
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+    return ready
+
+ready = asyncio.run(lifespan())
+print(json.dumps({{"import_ms": (imported - started) * 1000, "startup_ms": (ready - imported) * 1000}}))
+"""
+
+def child_env(scratch: str) -> Dict[str, str]:
+    """The environment of the measured processes: a scratch SQLite database, no metrics port, no job workers."""
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(scratch, 'startup.db')}"
+    env["METRICS_PORT"] = "0"
+    env["JOBS_ENABLED"] = "false"
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")]))
+    return env
+
+def parse_importtime(stderr: str) -> List[tuple]:
+    """Parses `-X importtime` lines into (self_us, cumulative_us, depth, module) tuples."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        entries.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return entries
+
+def profile_import(module: str, env: Dict[str, str]) -> dict:
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+    entries = parse_importtime(completed.stderr)
+    packages: Dict[str, int] = defaultdict(int)
+    for self_us, _, _, name in entries:
+        packages[name.split(".")[0]] += self_us
+    return {
+        "import_ms": sum(cumulative for _, cumulative, depth, _ in entries if depth == 0) / 1000,
+        "wall_ms": wall * 1000,
+        "modules": len(entries),
+        "packages": packages,
+    }
+
+def profile_startup(app: str, env: Dict[str, str]) -> dict:
+    completed = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT.format(app=app)], cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise SystemExit(f"Starting {app} failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main", help="Module whose import is profiled")
+    parser.add_argument("--app", default="main:app", help="ASGI app whose lifespan --startup runs")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh processes per measurement; medians are reported")
+    parser.add_argument("--top", type=int, default=15, help="Packages listed by import time")
+    parser.add_argument("--startup", action="store_true", help="Also time the app's lifespan startup")
+    parser.add_argument("--budget-ms", type=float, default=0, help="Fail when the median import time exceeds this")
+    parser.add_argument("--output", default="")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        env = child_env(scratch)
+        imports = [profile_import(args.module, env) for _ in range(args.repeat)]
+        startups = [profile_startup(args.app, env) for _ in range(args.repeat)] if args.startup else []
+
+    packages = {
+        package: round(statistics.median(run["packages"].get(package, 0) for run in imports) / 1000, 2)
+        for package in set().union(*(run["packages"] for run in imports))
+    }
+    import_ms = statistics.median(run["import_ms"] for run in imports)
+    report = {
+        "benchmark": "startup",
+        "module": args.module,
+        "repeat": args.repeat,
+        "import_ms": round(import_ms, 2),
+        "process_wall_ms": round(statistics.median(run["wall_ms"] for run in imports), 2),
+        "modules_imported": imports[0]["modules"],
+        "top_packages_ms": dict(sorted(packages.items(), key=lambda item: -item[1])[:args.top]),
+    }
+    if startups:
+        report["app"] = args.app
+        report["app_import_ms"] = round(statistics.median(run["import_ms"] for run in startups), 2)
+        report["lifespan_startup_ms"] = round(statistics.median(run["startup_ms"] for run in startups), 2)
+    if args.budget_ms:
+        report["budget_ms"] = args.budget_ms
+        report["within_budget"] = import_ms <= args.budget_ms
+    write_report(report, args.output)
+    if args.budget_ms and import_ms > args.budget_ms:
+        print(f"Import time {import_ms:.0f} ms exceeds the {args.budget_ms:.0f} ms budget", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
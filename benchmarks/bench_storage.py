@@ -0,0 +1,182 @@
+"""
+Storage savings and read/write latency of the prompt/response payload codec.
+
+Generates a synthetic request history (templated prompts with a share of exact repeats and
+multi-paragraph responses), then for each configuration encodes every payload, decodes it
+again and writes/reads the rows through a scratch SQLite database. Reports bytes stored
+versus raw, the database file size, per-payload encode/decode latency, per-row insert/select
+latency and, for offloading, the number and size of the distinct blobs written.
+
+Configurations: `none`, `zlib`, `zlib+dict` (dictionary trained on a sample of the corpus),
+`zstd` and `zstd+dict` when the zstandard package is installed, and `zlib+blob` (zlib with
+payloads above `--offload-threshold` going to the blob store).
+
+    python benchmarks/bench_storage.py --rows 20000 --repeat-ratio 0.3
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.common import latency_summary, write_report  # noqa: E402
+
+TOPICS = ["billing", "shipping", "login", "export", "refund", "latency", "upgrade", "invoice"]
+SENTENCES = [
+    "The customer reports that the {topic} page times out after about thirty seconds.",
+    "They have already cleared their cache and tried a different browser.",
+    "Please summarize the issue and suggest the next troubleshooting step.",
+    "Our records show the account was created {days} days ago on the {plan} plan.",
+    "The last successful {topic} request completed at {hour}:00 UTC.",
+    "Escalate to the on-call engineer if the problem affects more than one account.",
+]
+
+def make_corpus(rows: int, repeat_ratio: float, response_paragraphs: int, seed: int = 7) -> list:
+    """Returns `rows` (prompt, response) pairs; `repeat_ratio` of them repeat an earlier pair."""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(rows):
+        if corpus and rng.random() < repeat_ratio:
+            corpus.append(rng.choice(corpus))
+            continue
+        fields = {
+            "topic": rng.choice(TOPICS), "days": rng.randint(1, 900),
+            "plan": rng.choice(["free", "team", "enterprise"]), "hour": rng.randint(0, 23),
+        }
+        prompt = f"Ticket #{i}: " + " ".join(sentence.format(**fields) for sentence in rng.sample(SENTENCES, 4))
+        paragraphs = [
+            " ".join(sentence.format(**fields) for sentence in rng.sample(SENTENCES, 5))
+            for _ in range(rng.randint(1, response_paragraphs))
+        ]
+        corpus.append((prompt, {"choices": [{"text": "\n\n".join(paragraphs), "index": 0}], "model": "gpt-3.5-turbo"}))
+    return corpus
+
+def configurations(args, scratch: str, corpus: list) -> dict:
+    from utils.storage import BlobStore, PayloadCodec, train_dictionary
+
+    samples = []
+    for prompt, response in corpus[:args.dictionary_samples]:
+        samples += [prompt.encode(), response["choices"][0]["text"].encode()]
+    configs = {
+        "none": lambda: PayloadCodec("none"),
+        "zlib": lambda: PayloadCodec("zlib", min_size=args.min_size),
+        "zlib+dict": lambda: PayloadCodec("zlib", train_dictionary(samples, "zlib"), min_size=args.min_size),
+        "zlib+blob": lambda: PayloadCodec(
+            "zlib", min_size=args.min_size, offload_threshold=args.offload_threshold,
+            blob_store=BlobStore(os.path.join(scratch, "blobs")),
+        ),
+    }
+    try:
+        import zstandard  # noqa: F401
+        configs["zstd"] = lambda: PayloadCodec("zstd", min_size=args.min_size)
+        configs["zstd+dict"] = lambda: PayloadCodec("zstd", train_dictionary(samples, "zstd", 65536), min_size=args.min_size)
+    except ImportError:
+        print("zstandard is not installed; skipping the zstd configurations", file=sys.stderr)
+    return configs
+
+def measure_codec(codec, corpus: list) -> dict:
+    import json
+    raw = stored = 0
+    encode_latencies, decode_latencies = [], []
+    for prompt, response in corpus:
+        raw += len(prompt.encode()) + len(json.dumps(response, separators=(",", ":")).encode())
+        started = time.perf_counter()
+        encoded_prompt, encoded_response = codec.encode_text(prompt), codec.encode_json(response)
+        encode_latencies.append(time.perf_counter() - started)
+        stored += len(encoded_prompt.encode()) + len(json.dumps(encoded_response, separators=(",", ":")).encode())
+        started = time.perf_counter()
+        codec.decode_text(encoded_prompt), codec.decode_json(encoded_response)
+        decode_latencies.append(time.perf_counter() - started)
+    return {
+        "raw_bytes": raw,
+        "stored_bytes": stored,
+        "ratio": round(raw / stored, 2) if stored else 0,
+        "encode": latency_summary(encode_latencies),
+        "decode": latency_summary(decode_latencies),
+    }
+
+async def measure_database(database_path: str, corpus: list, batch_size: int) -> dict:
+    from sqlalchemy import select
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from utils.db import Base, Request, User, bulk_create_requests_async
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    async with session_factory() as db:
+        db.add(User(id=1, username="storageuser", email="storage@example.com", hashed_password="-"))
+        await db.commit()
+        started = time.perf_counter()
+        for start in range(0, len(corpus), batch_size):
+            await bulk_create_requests_async(db, [
+                {"model": "gpt-3.5-turbo", "prompt": prompt, "parameters": {}, "response": response, "user_id": 1}
+                for prompt, response in corpus[start:start + batch_size]
+            ])
+        write_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        rows = (await db.execute(select(Request.prompt, Request.response))).all()
+        read_seconds = time.perf_counter() - started
+    await engine.dispose()
+    assert len(rows) == len(corpus)
+    return {
+        "file_bytes": os.path.getsize(database_path),
+        "write_us_per_row": round(write_seconds / len(corpus) * 1e6, 1),
+        "read_us_per_row": round(read_seconds / len(corpus) * 1e6, 1),
+    }
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="Share of rows repeating an earlier prompt and response")
+    parser.add_argument("--response-paragraphs", type=int, default=12, help="Maximum paragraphs per response")
+    parser.add_argument("--min-size", type=int, default=256, help="STORAGE_MIN_SIZE")
+    parser.add_argument("--offload-threshold", type=int, default=4096, help="BLOB_OFFLOAD_THRESHOLD for zlib+blob")
+    parser.add_argument("--dictionary-samples", type=int, default=1000, help="Rows the dictionaries are trained on")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows per insert")
+    parser.add_argument("--configs", default="", help="Comma-separated configurations to run (default: all)")
+    parser.add_argument("--output", default="")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # utils.db builds its engines from DATABASE_URL at import
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(scratch, 'unused.db')}")
+        from utils import storage
+
+        corpus = make_corpus(args.rows, args.repeat_ratio, args.response_paragraphs)
+        configs = configurations(args, scratch, corpus)
+        selected = args.configs.split(",") if args.configs else list(configs)
+        results = {}
+        for name in selected:
+            codec = configs[name]()
+            storage.set_payload_codec(codec)
+            results[name] = measure_codec(codec, corpus)
+            results[name]["database"] = asyncio.run(
+                measure_database(os.path.join(scratch, f"{name}.db"), corpus, args.batch_size)
+            )
+            if codec.blob_store is not None:
+                blob_bytes = sum(
+                    os.path.getsize(os.path.join(directory, filename))
+                    for directory, _, files in os.walk(codec.blob_store.root) for filename in files
+                )
+                blobs = sum(len(files) for _, _, files in os.walk(codec.blob_store.root))
+                results[name]["blob_store"] = {"blobs": blobs, "bytes": blob_bytes}
+            print(f"{name}: ratio {results[name]['ratio']}, db {results[name]['database']['file_bytes']} bytes", file=sys.stderr)
+
+    write_report({
+        "benchmark": "storage",
+        "rows": args.rows,
+        "repeat_ratio": args.repeat_ratio,
+        "min_size": args.min_size,
+        "offload_threshold": args.offload_threshold,
+        "results": results,
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
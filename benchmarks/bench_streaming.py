@@ -0,0 +1,71 @@
+"""
+Time-to-first-byte of streamed versus buffered completions against the local mock upstream.
+
+The buffered path waits for the whole completion (what `/requests/create` does); the
+streamed path relays the first fragment as soon as upstream emits it (what
+`/requests/stream` does).
+
+Usage:
+    python benchmarks/bench_streaming.py --requests 50 --latency 0.05 --token-latency 0.02 --words 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_upstream import MockUpstream, start_mock_upstream  # noqa: E402
+from utils.upstream import UpstreamClient  # noqa: E402
+
+async def measure_buffered(client: UpstreamClient, payload: dict) -> tuple:
+    started = time.perf_counter()
+    await client.post_json("/completions", payload)
+    elapsed = time.perf_counter() - started
+    return elapsed, elapsed
+
+async def measure_streamed(client: UpstreamClient, payload: dict) -> tuple:
+    started = time.perf_counter()
+    first = None
+    async for _ in client.stream_events("/completions", payload):
+        if first is None:
+            first = time.perf_counter() - started
+    return first, time.perf_counter() - started
+
+def summarize(samples: list) -> dict:
+    ttfb = [sample[0] for sample in samples]
+    total = [sample[1] for sample in samples]
+    return {
+        "ttfb_p50_ms": round(statistics.median(ttfb) * 1000, 2),
+        "ttfb_max_ms": round(max(ttfb) * 1000, 2),
+        "total_p50_ms": round(statistics.median(total) * 1000, 2),
+    }
+
+async def run(requests: int, latency: float, token_latency: float, words: int) -> dict:
+    runner, base_url = await start_mock_upstream(MockUpstream(latency, token_latency))
+    client = UpstreamClient(base_url, api_key="mock")
+    await client.start()
+    payload = {"model": "text-davinci-003", "prompt": " ".join(["word"] * words)}
+    try:
+        buffered = [await measure_buffered(client, payload) for _ in range(requests)]
+        streamed = [await measure_streamed(client, payload) for _ in range(requests)]
+    finally:
+        await client.close()
+        await runner.cleanup()
+    return {"buffered": summarize(buffered), "streamed": summarize(streamed)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock upstream time to first token in seconds")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="Mock upstream delay between tokens in seconds")
+    parser.add_argument("--words", type=int, default=40, help="Words in the prompt, echoed back as tokens")
+    args = parser.parse_args()
+    results = asyncio.run(run(args.requests, args.latency, args.token_latency, args.words))
+    print(json.dumps({"benchmark": "streaming", **results}, indent=2))
+
+if __name__ == "__main__":
+    main()
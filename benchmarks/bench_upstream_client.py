@@ -0,0 +1,79 @@
+"""
+Latency and throughput of the pooled upstream client against the local mock upstream.
+
+Compares the long-lived, keep-alive `UpstreamClient` with opening a new HTTP session
+(and connection) per call, which is what the legacy SDK path amounted to.
+
+Usage:
+    python benchmarks/bench_upstream_client.py --requests 2000 --concurrency 100 --latency 0.01
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import percentile  # noqa: E402
+from benchmarks.mock_upstream import MockUpstream, start_mock_upstream  # noqa: E402
+from utils.upstream import UpstreamClient  # noqa: E402
+
+async def drive(call, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await call({"model": "text-davinci-003", "prompt": f"prompt {i}"})
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+    }
+
+async def run(requests: int, concurrency: int, latency: float, pool_size: int) -> dict:
+    runner, base_url = await start_mock_upstream(MockUpstream(latency))
+    try:
+        client = UpstreamClient(base_url, api_key="mock", pool_size=pool_size)
+        await client.start()
+        try:
+            pooled = await drive(lambda payload: client.post_json("/completions", payload), requests, concurrency)
+        finally:
+            await client.close()
+
+        async def per_call_session(payload):
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"{base_url}/completions", json=payload) as response:
+                    return await response.json()
+
+        unpooled = await drive(per_call_session, requests, concurrency)
+    finally:
+        await runner.cleanup()
+    return {"pooled": pooled, "session_per_call": unpooled}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.01, help="Mock upstream latency in seconds")
+    parser.add_argument("--pool-size", type=int, default=100)
+    args = parser.parse_args()
+    results = asyncio.run(run(args.requests, args.concurrency, args.latency, args.pool_size))
+    print(json.dumps({"benchmark": "upstream_client", **results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Validation and serialization cost per request, before and after the pydantic v2 schemas.
+
+Times the work FastAPI does around a `/requests/create` call outside the handler itself:
+decoding the JSON body, validating it into the request schema and rendering the response
+body. `before` uses the previous v1-style schema (`@validator`s, allowlist rebuilt on every
+call) and a stdlib `JSONResponse`; `after` uses `models.RequestSchema` and `FastJSONResponse`
+with a typed response model, with orjson and with the pydantic-core fallback. A batch body with
+`--batch-items` items and a history page with `--page-size` rows are timed the same way.
+
+    python benchmarks/bench_validation.py --iterations 20000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from pydantic import BaseModel, Field, TypeAdapter  # noqa: E402
+
+from benchmarks.common import write_report  # noqa: E402
+from models import CreateRequestResponse, RequestSchema  # noqa: E402
+from utils import responses  # noqa: E402
+from utils.responses import FastJSONResponse  # noqa: E402
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    from pydantic import validator
+
+    class LegacyRequestSchema(BaseModel):
+        """The request schema as it was before the move to v2-native validators."""
+        model: str = Field(...)
+        prompt: str = Field(...)
+        parameters: Dict[str, Any] = Field(default={})
+
+        @validator("model", pre=True)
+        def validate_model(cls, value):
+            allowed_models = ["gpt-3.5-turbo", "text-davinci-003", "text-curie-001", "text-babbage-001", "text-ada-001"]
+            if value.lower() not in allowed_models:
+                raise ValueError(f"Invalid OpenAI model. Allowed models are: {', '.join(allowed_models)}")
+            return value.lower()
+
+        @validator("prompt", pre=True)
+        def validate_prompt(cls, value):
+            if not isinstance(value, str) or len(value) > 1000:
+                raise ValueError("Prompt must be a string and not exceed 1000 characters.")
+            return value
+
+        @validator("parameters", pre=True)
+        def validate_parameters(cls, value):
+            if not isinstance(value, dict):
+                raise ValueError("Parameters must be a dictionary.")
+            return value
+
+BODY = {"model": "gpt-3.5-turbo", "prompt": "Write a haiku about connection pools.", "parameters": {"temperature": 0.7, "max_tokens": 64}}
+
+def history_page(size: int) -> dict:
+    from datetime import datetime
+    return {
+        "items": [
+            {"id": i, "model": "gpt-3.5-turbo", "prompt": f"prompt {i}", "created_at": datetime(2024, 1, 1, 12, 0, i % 60)}
+            for i in range(size)
+        ],
+        "next_cursor": "WyIyMDI0LTAxLTAxVDEyOjAwOjAwIiwgNV0",
+    }
+
+def legacy_history_page(size: int) -> dict:
+    page = history_page(size)
+    for row in page["items"]:
+        row["created_at"] = row["created_at"].isoformat()
+    return page
+
+def timed(function, iterations: int, repeats: int = 3) -> float:
+    """Returns the mean microseconds per call of the fastest of `repeats` runs."""
+    for _ in range(min(iterations, 1000)):
+        function()
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        best = min(best, time.perf_counter() - started)
+    return round(best / iterations * 1e6, 2)
+
+def scenarios(batch_items: int, page_size: int) -> Dict[str, Dict[str, Any]]:
+    body = json.dumps(BODY).encode()
+    batch_body = json.dumps([BODY] * batch_items).encode()
+    legacy_batch = TypeAdapter(List[LegacyRequestSchema])
+    batch = TypeAdapter(List[RequestSchema])
+    results = [{"index": i, "response": "A pooled connection waits", "request_id": i} for i in range(batch_items)]
+    return {
+        "before": {
+            "create": lambda: (LegacyRequestSchema(**json.loads(body)), JSONResponse({"message": "Request created successfully!", "request_id": 1}).body),
+            "batch": lambda: (legacy_batch.validate_python(json.loads(batch_body)), JSONResponse({"results": results}).body),
+            "history": lambda: JSONResponse(legacy_history_page(page_size)).body,
+        },
+        "after": {
+            "create": lambda: (RequestSchema(**json.loads(body)), FastJSONResponse(CreateRequestResponse(request_id=1)).body),
+            "batch": lambda: (batch.validate_python(json.loads(batch_body)), FastJSONResponse({"results": results}).body),
+            "history": lambda: FastJSONResponse(history_page(page_size)).body,
+        },
+    }
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--batch-items", type=int, default=50)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args(argv)
+
+    report = {}
+    cases = scenarios(args.batch_items, args.page_size)
+    for name in ("before", "after"):
+        # Batches and pages are larger, so fewer iterations keep run times comparable
+        report[name] = {
+            case: timed(function, args.iterations if case == "create" else max(1, args.iterations // 20))
+            for case, function in cases[name].items()
+        }
+    if responses.orjson is not None:
+        orjson_module, responses.orjson = responses.orjson, None
+        try:
+            report["after_without_orjson"] = {
+                case: timed(function, args.iterations if case == "create" else max(1, args.iterations // 20))
+                for case, function in cases["after"].items()
+            }
+        finally:
+            responses.orjson = orjson_module
+    for name, timings in report.items():
+        print(f"{name}: " + ", ".join(f"{case} {us} us" for case, us in timings.items()), file=sys.stderr)
+
+    write_report({
+        "benchmark": "validation",
+        "iterations": args.iterations,
+        "batch_items": args.batch_items,
+        "page_size": args.page_size,
+        "orjson": responses.orjson is not None,
+        "microseconds_per_request": report,
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Throughput scaling with the number of worker processes.
+
+Runs the load test (see loadtest.py) once per worker count, each time against a fresh
+service in multi-process metrics mode, and reports throughput, latency percentiles and
+the speedup over the first count. A few workers should scale close to linearly on a
+CPU-bound mix until the cores or the database saturate:
+
+    python benchmarks/bench_workers.py --worker-counts 1,2,4 --requests 4000 --concurrency 64
+
+The default mix (`me=1`) avoids SQLite write contention between processes; pass
+`--database-url` for a local Postgres to include `/requests/create`.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.common import write_report  # noqa: E402
+from benchmarks.loadtest import build_parser, run  # noqa: E402
+
+def main(argv: Optional[list] = None):
+    parser = build_parser()
+    parser.description = __doc__
+    parser.add_argument("--worker-counts", default="1,2,4", help="Comma-separated worker counts to compare")
+    parser.set_defaults(mix="me=1", requests=4000, concurrency=64)
+    args = parser.parse_args(argv)
+
+    runs = []
+    base_env = list(args.env)
+    for workers in [int(count) for count in args.worker_counts.split(",")]:
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            args.workers = workers
+            args.env = base_env + [f"WORKERS={workers}", f"PROMETHEUS_MULTIPROC_DIR={metrics_dir}"]
+            report = asyncio.run(run(args))
+        endpoints = report["endpoints"]
+        runs.append({
+            "workers": workers,
+            "throughput_rps": report["throughput_rps"],
+            "errors": report["errors"],
+            "latency": {name: {key: summary.get(key) for key in ("p50_ms", "p95_ms", "p99_ms")} for name, summary in endpoints.items()},
+        })
+        print(f"{workers} worker(s): {report['throughput_rps']} req/s", file=sys.stderr)
+
+    baseline = runs[0]["throughput_rps"] or 1
+    for result in runs:
+        result["speedup"] = round(result["throughput_rps"] / baseline, 2)
+    write_report({
+        "benchmark": "workers",
+        "server": args.server,
+        "mix": args.mix,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "cpu_count": os.cpu_count(),
+        "runs": runs,
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""Helpers shared by the benchmark scripts."""
+import json
+from typing import Iterable, Optional
+
+def percentile(samples: list, pct: float) -> float:
+    """Nearest-rank percentile of `samples` (which need not be sorted)."""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def latency_summary(samples: Iterable[float], elapsed: Optional[float] = None) -> dict:
+    """Summarizes latencies given in seconds as milliseconds, plus throughput when `elapsed` is known."""
+    samples = list(samples)
+    if not samples:
+        return {"count": 0}
+    summary = {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2),
+    }
+    if elapsed:
+        summary["throughput_rps"] = round(len(samples) / elapsed, 1)
+    return summary
+
+def write_report(report: dict, output: Optional[str] = None):
+    """Prints the JSON report and, if `output` is given, also writes it to that file."""
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        with open(output, "w", encoding="utf-8") as report_file:
+            report_file.write(text + "\n")
@@ -0,0 +1,276 @@
+"""
+Load test for the service against the local mock OpenAI upstream.
+
+Starts the mock upstream in-process and the FastAPI app (`main:app`) under uvicorn in a
+subprocess, pointed at the mock and at a scratch SQLite database (or any `--database-url`,
+e.g. a local Postgres). It then registers a user and drives `/requests/create`,
+`/users/login` and `/users/me` at the configured concurrency. The report is
+machine-readable JSON: p50/p95/p99 latency and throughput per endpoint, status codes,
+and the number of calls that reached upstream.
+
+Service settings can be overridden with repeated `--env KEY=VALUE`, which is how modes are
+compared, for example:
+
+    python benchmarks/loadtest.py --requests 2000 --concurrency 50 --env CACHE_ENABLED=false --output baseline.json
+    python benchmarks/loadtest.py --requests 2000 --concurrency 50 --env CACHE_ENABLED=true --output cached.json
+
+Use `--app-url` to drive an already running service instead of starting one; upstream
+call counts are then only reported if that service uses this script's mock upstream.
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.common import latency_summary, write_report  # noqa: E402
+from benchmarks.mock_upstream import MockUpstream, start_mock_upstream  # noqa: E402
+
+DEFAULT_MIX = "create=8,login=1,me=1"
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def parse_mix(raw: str) -> Dict[str, int]:
+    """Parses an endpoint mix such as "create=8,login=1,me=1" into weights."""
+    mix = {}
+    for part in raw.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = int(weight or 1)
+    unknown = set(mix) - {"create", "login", "me"}
+    if unknown:
+        raise ValueError(f"Unknown endpoints in mix: {', '.join(sorted(unknown))}")
+    return mix
+
+def parse_env(pairs: List[str]) -> Dict[str, str]:
+    env = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        env[key] = value
+    return env
+
+class ServiceProcess:
+    """Runs the service under uvicorn (or gunicorn) in a subprocess with the given environment."""
+    def __init__(self, app: str, env: Dict[str, str], workers: int = 1, server: str = "uvicorn"):
+        self.app = app
+        self.env = env
+        self.workers = workers
+        self.server = server
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.process: Optional[subprocess.Popen] = None
+
+    def initialize_database(self):
+        subprocess.run(
+            [sys.executable, "-c", "from utils.db import initialize_db; initialize_db()"],
+            cwd=ROOT, env={**os.environ, **self.env}, check=True,
+        )
+
+    def command(self) -> List[str]:
+        if self.server == "gunicorn":
+            return [
+                sys.executable, "-m", "gunicorn", self.app, "-c", "gunicorn_conf.py",
+                "--bind", f"127.0.0.1:{self.port}", "--workers", str(self.workers), "--log-level", "warning",
+            ]
+        return [
+            sys.executable, "-m", "uvicorn", self.app,
+            "--host", "127.0.0.1", "--port", str(self.port),
+            "--workers", str(self.workers), "--log-level", "warning",
+        ]
+
+    async def start(self, timeout: float = 30.0):
+        self.initialize_database()
+        self.process = subprocess.Popen(self.command(), cwd=ROOT, env={**os.environ, **self.env})
+        deadline = time.monotonic() + timeout
+        async with aiohttp.ClientSession() as session:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"Service exited with code {self.process.returncode}")
+                try:
+                    async with session.get(f"{self.url}/health") as response:
+                        if response.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError("Service did not become healthy in time")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+class LoadTest:
+    """Drives the service endpoints and records per-endpoint latencies and statuses."""
+    def __init__(self, base_url: str, mix: Dict[str, int], model: str, deterministic: bool, unique_prompts: int):
+        self.base_url = base_url
+        self.mix = mix
+        self.model = model
+        self.deterministic = deterministic
+        self.unique_prompts = unique_prompts
+        self.latencies: Dict[str, List[float]] = {name: [] for name in mix}
+        self.statuses: Dict[str, Counter] = {name: Counter() for name in mix}
+        self.credentials: Dict[str, str] = {}
+        self.token: Optional[str] = None
+
+    async def setup(self, session: aiohttp.ClientSession):
+        suffix = uuid.uuid4().hex[:8]
+        self.credentials = {"username": f"load{suffix}", "email": f"load{suffix}@example.com", "password": "loadtest-password"}
+        async with session.post(f"{self.base_url}/users/register", json=self.credentials) as response:
+            if response.status >= 400:
+                raise RuntimeError(f"Registration failed: {response.status} {await response.text()}")
+        self.token = await self.login(session)
+
+    async def login(self, session: aiohttp.ClientSession) -> Optional[str]:
+        async with session.post(f"{self.base_url}/users/login", json=self.credentials) as response:
+            body = await response.json(content_type=None)
+            return body.get("access_token") if response.status == 200 else None
+
+    async def call(self, session: aiohttp.ClientSession, name: str, index: int) -> int:
+        headers = {"Authorization": f"Bearer {self.token}"}
+        if name == "create":
+            parameters = {"max_tokens": 16, "temperature": 0 if self.deterministic else 0.7}
+            payload = {"model": self.model, "prompt": f"Load test prompt {index % self.unique_prompts}", "parameters": parameters}
+            async with session.post(f"{self.base_url}/requests/create", json=payload, headers=headers) as response:
+                await response.read()
+                return response.status
+        if name == "login":
+            async with session.post(f"{self.base_url}/users/login", json=self.credentials) as response:
+                await response.read()
+                return response.status
+        async with session.get(f"{self.base_url}/users/me", headers=headers) as response:
+            await response.read()
+            return response.status
+
+    async def run(self, requests: int, concurrency: int) -> float:
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        schedule = random.choices(names, weights=weights, k=requests)
+        queue: asyncio.Queue = asyncio.Queue()
+        for index, name in enumerate(schedule):
+            queue.put_nowait((index, name))
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await self.setup(session)
+
+            async def worker():
+                while True:
+                    try:
+                        index, name = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    started = time.perf_counter()
+                    try:
+                        status = await self.call(session, name, index)
+                    except aiohttp.ClientError as e:
+                        status = type(e).__name__
+                    self.latencies[name].append(time.perf_counter() - started)
+                    self.statuses[name][str(status)] += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        for name, samples in self.latencies.items():
+            endpoints[name] = {**latency_summary(samples, elapsed), "statuses": dict(self.statuses[name])}
+        total = sum(len(samples) for samples in self.latencies.values())
+        errors = sum(
+            count for statuses in self.statuses.values() for status, count in statuses.items()
+            if not status.isdigit() or int(status) >= 400
+        )
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "requests": total,
+            "errors": errors,
+            "throughput_rps": round(total / elapsed, 1) if elapsed else 0,
+            "endpoints": endpoints,
+        }
+
+async def run(args) -> dict:
+    mock = MockUpstream(latency=args.upstream_latency, error_rate=args.upstream_error_rate)
+    runner, upstream_url = await start_mock_upstream(mock)
+    service = None
+    scratch = tempfile.TemporaryDirectory()
+    try:
+        base_url = args.app_url
+        env = {
+            "DATABASE_URL": args.database_url or f"sqlite:///{os.path.join(scratch.name, 'loadtest.db')}",
+            "OPENAI_BASE_URL": upstream_url,
+            "OPENAI_API_KEY": "loadtest",
+            "JWT_SECRET": "loadtest-secret",
+            "CACHE_REDIS_ENABLED": "false",
+            "RATE_LIMIT_ENABLED": "false",
+            **parse_env(args.env),
+        }
+        if not base_url:
+            service = ServiceProcess(args.app, env, args.workers, args.server)
+            await service.start()
+            base_url = service.url
+        load = LoadTest(base_url, parse_mix(args.mix), args.model, args.deterministic, args.unique_prompts)
+        elapsed = await load.run(args.requests, args.concurrency)
+        report = load.report(elapsed)
+        report["upstream"] = {"calls": mock.calls, "errors": mock.errors}
+        report["config"] = {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+            "workers": args.workers,
+            "server": args.server,
+            "upstream_latency": args.upstream_latency,
+            "upstream_error_rate": args.upstream_error_rate,
+            "deterministic": args.deterministic,
+            "unique_prompts": args.unique_prompts,
+            "env": parse_env(args.env),
+        }
+        return report
+    finally:
+        if service is not None:
+            service.stop()
+        await runner.cleanup()
+        scratch.cleanup()
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="Total requests to send")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent client connections")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Endpoint weights, e.g. create=8,login=1,me=1")
+    parser.add_argument("--model", default="text-davinci-003")
+    parser.add_argument("--deterministic", action="store_true", help="Send temperature 0 so responses are cacheable")
+    parser.add_argument("--unique-prompts", type=int, default=100, help="Distinct prompts cycled through")
+    parser.add_argument("--upstream-latency", type=float, default=0.05, help="Mock upstream latency in seconds")
+    parser.add_argument("--upstream-error-rate", type=float, default=0.0, help="Fraction of mock upstream calls that fail")
+    parser.add_argument("--database-url", default="", help="Database for the service (defaults to a scratch SQLite file)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes")
+    parser.add_argument("--server", choices=("uvicorn", "gunicorn"), default="uvicorn")
+    parser.add_argument("--app", default="main:app", help="ASGI app import path")
+    parser.add_argument("--app-url", default="", help="Drive an already running service instead of starting one")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE setting passed to the service (repeatable)")
+    parser.add_argument("--output", default="", help="Also write the JSON report to this file")
+    return parser
+
+def main(argv: Optional[list] = None):
+    args = build_parser().parse_args(argv)
+    report = asyncio.run(run(args))
+    write_report({"benchmark": "loadtest", **report}, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+A local fake of the OpenAI completions API for offline benchmarks and tests.
+
+Serves `/v1/completions` and `/v1/chat/completions` with configurable latency and
+counts every call it receives. Faults can be injected: `--error-rate` fails that fraction
+of calls with `--error-status` (and a `Retry-After` header when `--retry-after` is set),
+and `fail_first` fails the first N calls. Completions requested with `"stream": true` are sent as
+Server-Sent Events, one word per event, `--token-latency` seconds apart. Point `OPENAI_BASE_URL` at it to run the service
+without network access.
+
+Usage:
+    python benchmarks/mock_upstream.py --port 8081 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import random
+from typing import Optional
+
+from aiohttp import web
+
+class MockUpstream:
+    """Request handlers and counters for the fake upstream."""
+    def __init__(
+        self,
+        latency: float = 0.05,
+        token_latency: float = 0.01,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        retry_after: float = None,
+        fail_first: int = 0,
+    ):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.fail_first = fail_first
+        self.calls = 0
+        self.errors = 0
+
+    def injected_fault(self):
+        """Returns an error response if this call should fail, otherwise None."""
+        if self.calls <= self.fail_first or (self.error_rate and random.random() < self.error_rate):
+            self.errors += 1
+            headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else None
+            return web.json_response(
+                {"error": {"message": "Injected upstream fault", "type": "server_error"}},
+                status=self.error_status,
+                headers=headers,
+            )
+        return None
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        self.calls += 1
+        body = await request.json()
+        await asyncio.sleep(self.latency)
+        fault = self.injected_fault()
+        if fault is not None:
+            return fault
+        text = f"Echo: {body.get('prompt', '')}"
+        if body.get("stream"):
+            return await self.stream_completion(request, body, text)
+        # A buffered completion arrives only after every token has been generated
+        await asyncio.sleep(self.token_latency * (len(text.split(" ")) - 1))
+        return web.json_response({
+            "id": f"cmpl-mock-{self.calls}",
+            "object": "text_completion",
+            "model": body.get("model"),
+            "choices": [{"index": 0, "text": text, "finish_reason": "stop"}],
+        })
+
+    async def stream_completion(self, request: web.Request, body: dict, text: str) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        words = text.split(" ")
+        for index, word in enumerate(words):
+            if index:
+                await asyncio.sleep(self.token_latency)
+            chunk = {
+                "id": f"cmpl-mock-{self.calls}",
+                "object": "text_completion",
+                "model": body.get("model"),
+                "choices": [{"index": 0, "text": word if index == 0 else f" {word}", "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        self.calls += 1
+        body = await request.json()
+        await asyncio.sleep(self.latency)
+        fault = self.injected_fault()
+        if fault is not None:
+            return fault
+        last_message = (body.get("messages") or [{}])[-1].get("content", "")
+        if body.get("stream"):
+            return await self.stream_chat_completion(request, body, f"Echo: {last_message}")
+        return web.json_response({
+            "id": f"chatcmpl-mock-{self.calls}",
+            "object": "chat.completion",
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": f"Echo: {last_message}"}, "finish_reason": "stop"}],
+        })
+
+    async def stream_chat_completion(self, request: web.Request, body: dict, text: str) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for index, word in enumerate(text.split(" ")):
+            if index:
+                await asyncio.sleep(self.token_latency)
+            chunk = {
+                "id": f"chatcmpl-mock-{self.calls}",
+                "object": "chat.completion.chunk",
+                "model": body.get("model"),
+                "choices": [{"index": 0, "delta": {"content": word if index == 0 else f" {word}"}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def models(self, request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [{"id": "gpt-3.5-turbo", "object": "model"}]})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"calls": self.calls, "errors": self.errors})
+
+def create_mock_app(mock: MockUpstream) -> web.Application:
+    app = web.Application()
+    app.router.add_post("/v1/completions", mock.completions)
+    app.router.add_post("/v1/chat/completions", mock.chat_completions)
+    app.router.add_get("/v1/models", mock.models)
+    app.router.add_get("/stats", mock.stats)
+    return app
+
+async def start_mock_upstream(mock: MockUpstream, host: str = "127.0.0.1", port: int = 0) -> tuple:
+    """
+    Starts the fake upstream on the running event loop.
+
+    Returns:
+        tuple: The `web.AppRunner` (call `cleanup()` to stop it) and the base URL to use as `OPENAI_BASE_URL`.
+    """
+    runner = web.AppRunner(create_mock_app(mock))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}/v1"
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds to wait before responding")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Seconds between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls to fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of injected failures")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds sent with injected failures")
+    args = parser.parse_args(argv)
+    mock = MockUpstream(args.latency, args.token_latency, args.error_rate, args.error_status, args.retry_after)
+    web.run_app(create_mock_app(mock), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
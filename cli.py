@@ -0,0 +1,111 @@
+"""
+Command-line tools for the OpenAI Request Wrapper Service.
+
+    python cli.py init-db
+    python cli.py migrate
+    python cli.py export --format csv --gzip --output requests.csv.gz
+    python cli.py train-dictionary --output storage.dict
+"""
+import asyncio
+import json
+import sys
+from datetime import datetime
+from typing import Optional
+
+import typer
+
+from config.config import settings
+from utils.db import AsyncSessionLocal, initialize_db, migrate_db
+from utils.export import EXPORT_FORMATS, encode_export, iter_request_rows
+from utils.storage import CODECS, train_dictionary
+
+app = typer.Typer(help="OpenAI Request Wrapper Service tools.")
+
+@app.command("init-db")
+def init_db():
+    """Creates the database tables and indexes."""
+    initialize_db()
+    typer.echo("Database initialized.")
+
+@app.command()
+def migrate():
+    """Adds the columns and indexes newer versions need to an existing database and relaxes NOT NULL where they allow nulls. Safe to run repeatedly."""
+    applied = migrate_db()
+    for ddl in applied:
+        typer.echo(ddl)
+    typer.echo(f"Database migrated ({len(applied)} changes)." if applied else "Database schema is up to date.")
+
+async def _export(output, export_format, compress, user_id, model, since, until, batch_size) -> int:
+    written = 0
+    async with AsyncSessionLocal() as db:
+        async for chunk in encode_export(
+            iter_request_rows(db, user_id, model, since, until, batch_size), export_format, compress
+        ):
+            output.write(chunk)
+            written += len(chunk)
+    output.flush()
+    return written
+
+@app.command()
+def export(
+    format: str = typer.Option("ndjson", help=f"Output format: {', '.join(EXPORT_FORMATS)}."),
+    output: Optional[str] = typer.Option(None, "--output", "-o", help="Output file. Defaults to stdout."),
+    gzip: bool = typer.Option(False, "--gzip", help="Gzip the output."),
+    user_id: Optional[int] = typer.Option(None, help="Only export this user's requests."),
+    model: Optional[str] = typer.Option(None, help="Only export requests for this model."),
+    since: Optional[datetime] = typer.Option(None, help="Only export requests created at or after this time."),
+    until: Optional[datetime] = typer.Option(None, help="Only export requests created before this time."),
+    batch_size: int = typer.Option(settings.EXPORT_BATCH_SIZE, help="Rows fetched per round trip."),
+):
+    """Streams the request history as NDJSON or CSV with constant memory use."""
+    if format not in EXPORT_FORMATS:
+        raise typer.BadParameter(f"Allowed formats are: {', '.join(EXPORT_FORMATS)}", param_hint="--format")
+    if output is None:
+        asyncio.run(_export(sys.stdout.buffer, format, gzip, user_id, model, since, until, batch_size))
+        return
+    with open(output, "wb") as output_file:
+        written = asyncio.run(_export(output_file, format, gzip, user_id, model, since, until, batch_size))
+    typer.echo(f"Wrote {written} bytes to {output}", err=True)
+
+async def _samples(limit: int) -> list:
+    samples = []
+    async with AsyncSessionLocal() as db:
+        async for rows in iter_request_rows(db, batch_size=min(limit, settings.EXPORT_BATCH_SIZE)):
+            for row in rows:
+                samples.append(row["prompt"].encode())
+                response = row["response"]
+                if response is not None:
+                    samples.append((response if isinstance(response, str) else json.dumps(response)).encode())
+                if len(samples) >= limit:
+                    return samples[:limit]
+    return samples
+
+@app.command("train-dictionary")
+def train_dictionary_command(
+    output: str = typer.Option(..., "--output", "-o", help="Dictionary file to write (set STORAGE_DICTIONARY_PATH to it)."),
+    codec: Optional[str] = typer.Option(
+        None, help="zlib or zstd. Defaults to STORAGE_CODEC; a dictionary is only used with the codec it was trained for.",
+    ),
+    samples: int = typer.Option(10000, help="Stored prompts and responses to sample."),
+    size: int = typer.Option(32768, help="Maximum dictionary size in bytes (zlib uses at most 32768)."),
+):
+    """Trains a compression dictionary for the prompt/response storage codec from stored requests."""
+    if codec is None:
+        if settings.STORAGE_CODEC == "none":
+            raise typer.BadParameter(
+                "Storage compression is off (STORAGE_CODEC=none), so no dictionary would be used. "
+                "Set STORAGE_CODEC, or pass --codec to train one for later.",
+                param_hint="--codec",
+            )
+        codec = settings.STORAGE_CODEC
+    if codec not in CODECS or codec == "none":
+        raise typer.BadParameter("Allowed codecs are: zlib, zstd", param_hint="--codec")
+    if codec != settings.STORAGE_CODEC:
+        typer.echo(f"Note: STORAGE_CODEC is {settings.STORAGE_CODEC}; this {codec} dictionary is unused until it is {codec}.", err=True)
+    dictionary = train_dictionary(asyncio.run(_samples(samples)), codec, size)
+    with open(output, "wb") as output_file:
+        output_file.write(dictionary)
+    typer.echo(f"Wrote a {len(dictionary)} byte {codec} dictionary to {output}", err=True)
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,26 @@
+"""
+Gunicorn settings for running the service with several worker processes:
+
+    PROMETHEUS_MULTIPROC_DIR=/tmp/openai_wrapper_metrics WORKERS=4 gunicorn main:app -c gunicorn_conf.py
+
+The app is imported in each worker after fork (no preload), and its lifespan opens that
+worker's own database pool and upstream HTTP session. Metrics from every worker are
+aggregated and served from `/metrics`.
+"""
+from config.config import settings
+from utils.metrics import clear_multiprocess_dir, mark_worker_dead
+
+bind = settings.BIND
+workers = settings.WORKERS
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = False
+graceful_timeout = 30
+keepalive = 5
+
+def on_starting(server):
+    if workers > 1 and settings.PROMETHEUS_MULTIPROC_DIR is None:
+        server.log.warning("Running %s workers without PROMETHEUS_MULTIPROC_DIR; /metrics will only show one worker", workers)
+    clear_multiprocess_dir()
+
+def child_exit(server, worker):
+    mark_worker_dead(worker.pid)
@@ -1,72 +1,149 @@
 from fastapi import FastAPI, HTTPException, Depends, Request
-from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime, timedelta
+import contextlib
 import jwt
 from .routers import request_router, user_router
 from .config import settings
-from .utils.db import engine, SessionLocal, get_db
+from .utils.db import get_db, start_db, close_db
 from .utils.auth import create_access_token, get_current_user, oauth2_scheme
-from .utils.openai import openai_request
-from prometheus_client import Counter, start_http_server, Gauge, Histogram
-
-app = FastAPI(
-    title="AI Powered OpenAI Request Wrapper Service",
-    description="A Python API for simplifying OpenAI requests",
-    version="1.0.0",
-    docs_url="/docs",
-    redoc_url="/redocs"
-)
-
-# Set up CORS middleware for cross-origin requests
-origins = ["*"]  # Replace with your actual allowed origins
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+from .utils.openai import openai_request, OpenAIUtils
+from .utils.persistence import start_write_behind, stop_write_behind
+from .utils.jobs import start_job_workers, stop_job_workers
+from .utils.timing import begin_request, end_request
+from .utils.metrics import metrics_response, start_metrics_server, stop_metrics_server
+from .utils.passwords import shutdown_password_pool
+from .utils.responses import FastJSONResponse
+from .utils.model_registry import model_registry
+from .utils.readiness import build_readiness_probe
+from prometheus_client import Counter, Histogram
 
 # Prometheus metrics setup
-REQUEST_COUNT = Counter("requests_total", "Total number of requests")
+REQUEST_COUNT = Counter("requests_total", "Total number of requests", ["route", "model", "status"])
 REQUEST_LATENCY = Histogram(
-    "request_latency_seconds", "Request latency in seconds"
+    "request_latency_seconds", "Request latency in seconds", ["route", "model", "status"]
 )
 
-# Prometheus endpoint for scraping metrics
-start_http_server(9100)
-
-@app.on_event("startup")
-async def startup_event():
+# Per-process resources are created here rather than at import, so each worker gets its own
+# after fork and importing the app opens no ports, connections or sessions
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
     print("Startup event")
-    REQUEST_COUNT.inc()
+    start_metrics_server()
+    await start_db()
+    await OpenAIUtils.get_instance().startup()
+    await start_write_behind()
+    await start_job_workers()
+    model_registry.start_watcher(settings.MODEL_REGISTRY_RELOAD_INTERVAL)
+    app.state.readiness.started = True
+    try:
+        yield
+    finally:
+        # Report not ready first, so load balancers stop routing here while the worker drains
+        app.state.readiness.started = False
+        print("Shutdown event")
+        await model_registry.stop_watcher()
+        await stop_job_workers()
+        await stop_write_behind()
+        await OpenAIUtils.get_instance().shutdown()
+        shutdown_password_pool()
+        await close_db()
+        stop_metrics_server()
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    print("Shutdown event")
+def record_request(request: Request, timings, status_code: int):
+    """Observes the request-level metrics and the per-stage histograms of a finished request."""
+    route = request.scope.get("route")
+    if timings.route == "unmatched" and route is not None:
+        timings.route = getattr(route, "path_format", getattr(route, "path", "unmatched"))
+    labels = {"route": timings.route, "model": timings.model, "status": str(status_code)}
+    REQUEST_COUNT.labels(**labels).inc()
+    REQUEST_LATENCY.labels(**labels).observe(timings.elapsed())
+    timings.finish(status_code)
 
-@app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
-    start_time = datetime.utcnow()
-    response = await call_next(request)
-    process_time = (datetime.utcnow() - start_time).total_seconds()
-    response.headers["X-Process-Time"] = str(process_time)
-    return response
+    timings, token = begin_request()
+    try:
+        response = await call_next(request)
+    except Exception:
+        record_request(request, timings, 500)
+        raise
+    finally:
+        end_request(token)
+    response.headers["X-Process-Time"] = str(timings.elapsed())
+    response.headers["Server-Timing"] = timings.server_timing()
+
+    # Observe once the body is sent, so streamed responses include their upstream and db stages
+    body_iterator = response.body_iterator
+
+    async def observed_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            record_request(request, timings, response.status_code)
 
-app.include_router(user_router)
-app.include_router(request_router)
+    response.body_iterator = observed_body()
+    return response
 
-@app.get("/")
 async def root():
-    return JSONResponse({"message": "Welcome to the OpenAI Request Wrapper Service!"})
+    return FastJSONResponse({"message": "Welcome to the OpenAI Request Wrapper Service!"})
 
-@app.get("/health")
 async def healthcheck():
-    return JSONResponse({"status": "OK"})
+    return FastJSONResponse({"status": "OK"})
+
+async def readiness(request: Request):
+    """
+    Reports whether this worker can serve requests: startup has finished and the database
+    and upstream answer. Returns 503 with the failing checks otherwise.
+    """
+    ready, checks = await request.app.state.readiness.check()
+    return FastJSONResponse(
+        {"status": "ready" if ready else "not ready", "checks": checks}, status_code=200 if ready else 503
+    )
+
+def metrics():
+    # Sync so the multi-process file scan runs in the threadpool, off the event loop
+    return metrics_response()
+
+def create_app() -> FastAPI:
+    """
+    Builds the application. Nothing is started until its lifespan runs, so tests can create
+    an app without binding ports or connecting to the database.
+    """
+    app = FastAPI(
+        title="AI Powered OpenAI Request Wrapper Service",
+        description="A Python API for simplifying OpenAI requests",
+        version="1.0.0",
+        docs_url="/docs",
+        redoc_url="/redocs",
+        default_response_class=FastJSONResponse,
+        lifespan=lifespan,
+    )
+    app.state.readiness = build_readiness_probe()
+
+    # Set up CORS middleware for cross-origin requests
+    origins = ["*"]  # Replace with your actual allowed origins
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.middleware("http")(add_process_time_header)
+
+    app.include_router(user_router)
+    app.include_router(request_router)
+    app.get("/")(root)
+    app.get("/health")(healthcheck)
+    app.get("/ready")(readiness)
+    app.get("/metrics", include_in_schema=False)(metrics)
+    return app
+
+app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,5 @@
+from .request_schema import (
+    RequestSchema, CreateRequestResponse, RequestHistoryItem, RequestHistoryPage,
+    BatchItemResult, BatchResponse, JobSchema, JobResponse,
+)
+from .user_schema import UserSchema, MessageResponse, TokenResponse, UserResponse
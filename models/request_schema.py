@@ -1,26 +1,85 @@
-from pydantic import BaseModel, Field, validator
-from typing import Optional, Dict, Any
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import Optional, Dict, Any, List
+from datetime import datetime
+from urllib.parse import urlparse
+from ..utils.model_registry import model_registry
+
+# Upper bound on any prompt; each model's registry entry may set a lower one, and the
+# token preflight checks it against the model's context window
+MAX_PROMPT_LENGTH = 100000
 
 class RequestSchema(BaseModel):
     model: str = Field(..., description="The OpenAI model to use (e.g., gpt-3.5-turbo, text-davinci-003)")
-    prompt: str = Field(..., description="The input prompt for the OpenAI model")
-    parameters: Dict[str, Any] = Field(default={}, description="Optional parameters for the OpenAI API call")
+    # Type and dict checks run inside pydantic-core; the registry lookups are single dict accesses
+    prompt: str = Field(..., max_length=MAX_PROMPT_LENGTH, strict=True, description="The input prompt for the OpenAI model")
+    parameters: Dict[str, Any] = Field(default_factory=dict, description="Optional parameters for the OpenAI API call")
 
-    @validator("model", pre=True)
+    @field_validator("model", mode="before")
+    @classmethod
     def validate_model(cls, value):
-        allowed_models = ["gpt-3.5-turbo", "text-davinci-003", "text-curie-001", "text-babbage-001", "text-ada-001"]
-        if value.lower() not in allowed_models:
-            raise ValueError(f"Invalid OpenAI model. Allowed models are: {', '.join(allowed_models)}")
-        return value.lower()
-
-    @validator("prompt", pre=True)
-    def validate_prompt(cls, value):
-        if not isinstance(value, str) or len(value) > 1000:
-            raise ValueError("Prompt must be a string and not exceed 1000 characters.")
+        if not isinstance(value, str):
+            raise ValueError("Model must be a string.")
+        model = value.lower()
+        if model not in model_registry.names:
+            raise ValueError(f"Invalid OpenAI model. Allowed models are: {', '.join(sorted(model_registry.names))}")
+        return model
+
+    @model_validator(mode="after")
+    def validate_prompt_length(self):
+        spec = model_registry.get(self.model)
+        if spec is not None and spec.max_prompt_length is not None and len(self.prompt) > spec.max_prompt_length:
+            raise ValueError(f"Prompt must not exceed {spec.max_prompt_length} characters for {self.model}.")
+        return self
+
+class CreateRequestResponse(BaseModel):
+    message: str = "Request created successfully!"
+    request_id: Optional[int] = Field(None, description="The stored request id; null when persistence is queued")
+
+class RequestHistoryItem(BaseModel):
+    id: int
+    model: str
+    prompt: str
+    created_at: Optional[datetime] = None
+    parameters: Optional[Dict[str, Any]] = Field(None, description="Only present when requested with `include`")
+    response: Optional[Any] = Field(None, description="Only present when requested with `include`")
+    prompt_tokens: Optional[int] = Field(None, description="Only present when requested with `include`")
+    completion_tokens: Optional[int] = Field(None, description="Only present when requested with `include`")
+    cost: Optional[float] = Field(None, description="Upstream cost in USD; only present when requested with `include`")
+
+class RequestHistoryPage(BaseModel):
+    items: List[RequestHistoryItem]
+    next_cursor: Optional[str] = Field(None, description="Cursor for the next page; null on the last page")
+
+class BatchItemResult(BaseModel):
+    index: int
+    response: Optional[Any] = None
+    error: Optional[Any] = None
+    request_id: Optional[int] = None
+
+class BatchResponse(BaseModel):
+    results: List[BatchItemResult]
+
+class JobSchema(RequestSchema):
+    callback_url: Optional[str] = Field(
+        None, max_length=2048, description="An http(s) URL that receives a POST with the job once it finishes"
+    )
+
+    @field_validator("callback_url")
+    @classmethod
+    def validate_callback_url(cls, value):
+        if value is not None:
+            parsed = urlparse(value)
+            if parsed.scheme not in ("http", "https") or not parsed.netloc:
+                raise ValueError("Callback URL must be an absolute http or https URL.")
         return value
 
-    @validator("parameters", pre=True)
-    def validate_parameters(cls, value):
-        if not isinstance(value, dict):
-            raise ValueError("Parameters must be a dictionary.")
-        return value
\ No newline at end of file
+class JobResponse(BaseModel):
+    id: int
+    status: str = Field(..., description="queued, running, completed or failed")
+    model: str
+    created_at: Optional[datetime] = None
+    response: Optional[Any] = Field(None, description="The completion once the job has completed")
+    error: Optional[str] = Field(None, description="Why the job failed")
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    cost: Optional[float] = Field(None, description="Upstream cost in USD")
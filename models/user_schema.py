@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, field_validator
 from typing import Optional, Dict, Any
 
 class UserSchema(BaseModel):
@@ -6,7 +6,8 @@ class UserSchema(BaseModel):
     email: str = Field(..., description="The email address of the user")
     password: str = Field(..., description="The password of the user")
 
-    @validator("username")
+    @field_validator("username")
+    @classmethod
     def validate_username(cls, value):
         if not value:
             raise ValueError("Username cannot be empty.")
@@ -15,7 +16,8 @@ class UserSchema(BaseModel):
         # Additional validation logic if required 
         return value
 
-    @validator("email")
+    @field_validator("email")
+    @classmethod
     def validate_email(cls, value):
         if not value:
             raise ValueError("Email address cannot be empty.")
@@ -25,7 +27,8 @@ class UserSchema(BaseModel):
         # Additional validation logic if required 
         return value
 
-    @validator("password")
+    @field_validator("password")
+    @classmethod
     def validate_password(cls, value):
         if not value:
             raise ValueError("Password cannot be empty.")
@@ -33,4 +36,15 @@ class UserSchema(BaseModel):
             raise ValueError("Password must be at least 8 characters long.")
         # Implement more complex password strength validation if required 
         # Use a library like 'password_strength' for comprehensive password validation
-        return value
\ No newline at end of file
+        return value
+
+class MessageResponse(BaseModel):
+    message: str
+
+class TokenResponse(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
+
+class UserResponse(BaseModel):
+    username: str
+    email: str
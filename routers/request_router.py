@@ -1,9 +1,24 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import JSONResponse
-from typing import Optional, Dict, Any
-from .models import RequestSchema
-from .utils.openai import openai_request
-from .utils.db import get_db
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, Dict, Any, List
+from datetime import datetime
+from .models import RequestSchema, CreateRequestResponse, RequestHistoryPage, BatchResponse, JobSchema, JobResponse
+from .utils.openai import openai_request, openai_stream
+from .utils.auth import get_current_user, AuthenticatedUser
+from .utils.db import (
+    get_db, create_request_async, get_request_history_async, AsyncSessionLocal,
+    create_job_async, finish_job_async, get_user_request_async,
+)
+from .utils.export import EXPORT_FORMATS, encode_export, iter_request_rows
+from .utils.persistence import get_write_behind_queue, persist_requests
+from .utils.rate_limit import enforce_rate_limit
+from .utils.scheduler import request_class_for, set_request_class
+from .utils.tokens import preflight_async, settle_usage, track_usage
+from .utils.batch import iter_batch, run_batch
+from .utils.jobs import get_job_workers
+from .utils.timing import TimedRoute, set_model, stage
+from .utils.responses import FastJSONResponse, dumps
 from .config import settings
 import logging
 
@@ -11,38 +26,403 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(
     prefix="/requests",
-    tags=["Requests"]
+    tags=["Requests"],
+    route_class=TimedRoute,
 )
 
-@router.post("/create")
-async def create_request(request: RequestSchema, db: Session = Depends(get_db)):
+@router.get("", response_model=RequestHistoryPage)
+async def list_requests(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    model: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    include: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+):
+    """
+    Lists the current user's requests, newest first, one page at a time.
+
+    Args:
+        limit (int, optional): The page size, at most 200. Defaults to 50.
+        cursor (str, optional): The `next_cursor` from the previous page.
+        model (str, optional): Only return requests for this model.
+        since (datetime, optional): Only return requests created at or after this time.
+        until (datetime, optional): Only return requests created before this time.
+        include (str, optional): Comma-separated extra columns: `parameters`, `response`,
+            `prompt_tokens`, `completion_tokens`, `cost`.
+        db (AsyncSession): The database session object.
+        current_user (AuthenticatedUser): The authenticated user.
+
+    Returns:
+        FastJSONResponse: `{"items": [...], "next_cursor": ...}`; `next_cursor` is null on the last page.
+    """
+    columns = [column.strip() for column in include.split(",") if column.strip()] if include else []
+    try:
+        with stage("db"):
+            rows, next_cursor = await get_request_history_async(
+                db, current_user.id, limit, cursor, model, since, until, columns
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    # Rows are built by the query itself, so they are encoded as they are rather than re-validated
+    return FastJSONResponse({"items": rows, "next_cursor": next_cursor})
+
+@router.get("/export")
+async def export_requests(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    compress: bool = False,
+    model: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+):
+    """
+    Streams the current user's full request history as NDJSON or CSV.
+
+    Rows are read through a server-side cursor and encoded batch by batch, so memory use
+    stays flat however long the history is.
+
+    Args:
+        format (str, optional): "ndjson" or "csv". Defaults to "ndjson".
+        compress (bool, optional): Gzip the stream on the fly (`Content-Encoding: gzip`). Defaults to False.
+        model (str, optional): Only export requests for this model.
+        since (datetime, optional): Only export requests created at or after this time.
+        until (datetime, optional): Only export requests created before this time.
+        current_user (AuthenticatedUser): The authenticated user.
+
+    Returns:
+        StreamingResponse: The encoded rows in id order.
+    """
+    user_id = current_user.id
+
+    async def export_stream():
+        # The dependency-managed session is closed before the body streams, so read in a fresh one
+        async with AsyncSessionLocal() as db:
+            batches = iter_request_rows(db, user_id, model, since, until, settings.EXPORT_BATCH_SIZE)
+            async for chunk in encode_export(batches, format, compress):
+                yield chunk
+
+    headers = {"Content-Disposition": f'attachment; filename="requests.{format}"'}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(export_stream(), media_type=EXPORT_FORMATS[format], headers=headers)
+
+@router.post("/create", response_model=CreateRequestResponse)
+async def create_request(
+    request: RequestSchema,
+    db: AsyncSession = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+    cache_control: Optional[str] = Header(None),
+    x_request_deadline: Optional[float] = Header(None, gt=0),
+):
     """
     Handles POST requests to create new OpenAI requests.
 
+    The prompt is tokenized first; a request that cannot fit the model's context window is
+    rejected with a 400 before it is sent upstream. The prompt and completion tokens and the
+    upstream cost are stored with the request.
+
     Args:
         request (RequestSchema): The validated request data from the client.
-        db (Session): The database session object.
+        db (AsyncSession): The database session object.
+        current_user (AuthenticatedUser): The authenticated user.
+        cache_control (str, optional): The Cache-Control header; `no-cache` or `no-store` opts out of the response cache.
+        x_request_deadline (float, optional): Seconds the request may wait for an upstream slot, if
+            tighter than its class deadline; past it the request fails with a 503.
 
     Returns:
-        JSONResponse: A JSON response containing the formatted OpenAI API response.
+        FastJSONResponse: The created request's id (null when persistence is queued).
     """
+    set_model(request.model)
+    set_request_class(request_class_for("interactive", current_user.username), x_request_deadline)
+    with stage("tokenize"):
+        prompt_tokens = await preflight_async([request])
+    await enforce_rate_limit(current_user.id, [request], prompt_tokens=prompt_tokens)
     try:
         # Make OpenAI API call
-        response = await openai_request(request.model, request.prompt, request.parameters)
-
-        # Store request and response in the database
-        new_request = OpenAIRequest(
-            model=request.model,
-            prompt=request.prompt,
-            parameters=request.parameters,
-            response=response,
-            user_id=current_user.id  # Assuming you have user authentication in place
-        )
-        db.add(new_request)
-        db.commit()
-        db.refresh(new_request)
+        usage = track_usage()
+        response = await openai_request(request.model, request.prompt, request.parameters, cache_control)
+        accounting = settle_usage(usage, request.model, prompt_tokens[0], response)
+
+        # Store request and response in the database, or queue them in write-behind mode
+        write_behind_queue = get_write_behind_queue()
+        if write_behind_queue is not None:
+            with stage("db"):
+                await write_behind_queue.put({
+                    "model": request.model,
+                    "prompt": request.prompt,
+                    "parameters": request.parameters,
+                    "response": response,
+                    "user_id": current_user.id,
+                    **accounting,
+                })
+            return FastJSONResponse(CreateRequestResponse(request_id=None))
 
-        return JSONResponse({"message": "Request created successfully!", "request_id": new_request.id})
+        with stage("db"):
+            new_request = await create_request_async(
+                db, request.model, request.prompt, request.parameters, response, current_user.id, **accounting
+            )
+
+        return FastJSONResponse(CreateRequestResponse(request_id=new_request.id))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error creating OpenAI request: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+def job_response(job) -> JobResponse:
+    return JobResponse(
+        id=job.id, status=job.status, model=job.model, created_at=job.created_at, response=job.response, error=job.error,
+        prompt_tokens=job.prompt_tokens, completion_tokens=job.completion_tokens, cost=job.cost,
+    )
+
+@router.post("/jobs", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_job(
+    request: JobSchema,
+    db: AsyncSession = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+):
+    """
+    Handles POST requests that queue an OpenAI request to run in the background.
+
+    The request is stored with status "queued" and the call returns at once; a job worker
+    later runs it and stores the response. Poll `GET /requests/jobs/{id}` (the `Location`
+    header) or pass a `callback_url` to be notified when it finishes.
+
+    Args:
+        request (JobSchema): The validated request data, with an optional callback URL.
+        db (AsyncSession): The database session object.
+        current_user (AuthenticatedUser): The authenticated user.
+
+    Returns:
+        FastJSONResponse: The queued job (202).
+    """
+    set_model(request.model)
+    # Checked first so a request that cannot be queued is not charged against the rate limit
+    job_workers = get_job_workers()
+    if job_workers is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Async jobs are not enabled.")
+    with stage("tokenize"):
+        prompt_tokens = await preflight_async([request])
+    await enforce_rate_limit(current_user.id, [request], prompt_tokens=prompt_tokens)
+    with stage("db"):
+        job = await create_job_async(
+            db, request.model, request.prompt, request.parameters, current_user.id, request.callback_url
+        )
+    try:
+        await job_workers.submit(job.id)
+    except Exception as e:
+        logger.error(f"Error queueing job {job.id}: {e}")
+        await finish_job_async(db, job.id, error="Could not queue the job")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Could not queue the job.")
+    return FastJSONResponse(
+        job_response(job), status_code=status.HTTP_202_ACCEPTED, headers={"Location": f"{router.prefix}/jobs/{job.id}"}
+    )
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+):
+    """
+    Returns the status of one of the current user's jobs, with its response once completed.
+
+    Args:
+        job_id (int): The id returned when the job was submitted.
+        db (AsyncSession): The database session object.
+        current_user (AuthenticatedUser): The authenticated user.
+
+    Returns:
+        FastJSONResponse: The job.
+    """
+    with stage("db"):
+        job = await get_user_request_async(db, job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found.")
+    return FastJSONResponse(job_response(job))
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    """Formats a single Server-Sent Event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {dumps(data).decode()}\n\n"
+
+async def save_request(
+    model: str, prompt: str, parameters: dict, response: str, user_id: int, accounting: Optional[Dict[str, Any]] = None
+) -> Optional[int]:
+    """Persists a completed request, with its token accounting, in its own session and returns its id (None when queued)."""
+    with stage("db"):
+        request_ids = await persist_requests([{
+            "model": model,
+            "prompt": prompt,
+            "parameters": parameters,
+            "response": response,
+            "user_id": user_id,
+            **(accounting or {}),
+        }])
+    return request_ids[0] if request_ids else None
+
+@router.post("/stream")
+async def stream_request(
+    request: RequestSchema,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+    x_request_deadline: Optional[float] = Header(None, gt=0),
+):
+    """
+    Handles POST requests that stream the OpenAI completion back as Server-Sent Events.
+
+    Each upstream text fragment is relayed as a `data: {"text": ...}` event as soon as it
+    arrives. Once upstream finishes, the assembled response is stored once and a final
+    `done` event carries the request id; upstream failures end the stream with an
+    `error` event.
+
+    Args:
+        request (RequestSchema): The validated request data from the client.
+        current_user (AuthenticatedUser): The authenticated user.
+        x_request_deadline (float, optional): Seconds the request may wait for an upstream slot.
+
+    Returns:
+        StreamingResponse: A `text/event-stream` response.
+    """
+    set_model(request.model)
+    set_request_class(request_class_for("interactive", current_user.username), x_request_deadline)
+    with stage("tokenize"):
+        prompt_tokens = await preflight_async([request])
+    await enforce_rate_limit(current_user.id, [request], prompt_tokens=prompt_tokens)
+    user_id = current_user.id
+    usage = track_usage()
+
+    async def event_stream():
+        fragments = []
+        try:
+            async for text in openai_stream(request.model, request.prompt, request.parameters):
+                fragments.append(text)
+                yield sse_event({"text": text})
+        except HTTPException as e:
+            yield sse_event({"detail": e.detail}, event="error")
+            return
+        except Exception as e:
+            logger.error(f"Error streaming OpenAI request: {e}")
+            yield sse_event({"detail": "Internal server error"}, event="error")
+            return
+
+        # The dependency-managed session is already closed once the body streams, so persist in a fresh one
+        try:
+            response = "".join(fragments)
+            accounting = settle_usage(usage, request.model, prompt_tokens[0], response)
+            request_id = await save_request(request.model, request.prompt, request.parameters, response, user_id, accounting)
+        except Exception as e:
+            logger.error(f"Error storing streamed OpenAI request: {e}")
+            yield sse_event({"detail": "Error storing request"}, event="error")
+            return
+        yield sse_event({"request_id": request_id}, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def save_batch(
+    requests: List[RequestSchema], results: List[Dict[str, Any]], user_id: int, accounting: Dict[int, Dict[str, Any]]
+) -> Dict[int, int]:
+    """
+    Bulk-inserts the successful batch items, with the token accounting of each item index, in one
+    statement and maps item index to request id.
+    """
+    succeeded = [result for result in results if "response" in result]
+    rows = [
+        {
+            "model": requests[result["index"]].model,
+            "prompt": requests[result["index"]].prompt,
+            "parameters": requests[result["index"]].parameters,
+            "response": result["response"],
+            "user_id": user_id,
+            **accounting[result["index"]],
+        }
+        for result in succeeded
+    ]
+    with stage("db"):
+        request_ids = await persist_requests(rows)
+    if request_ids is None:
+        return {}
+    return {result["index"]: request_id for result, request_id in zip(succeeded, request_ids)}
+
+@router.post("/batch", response_model=BatchResponse)
+async def batch_request(
+    requests: List[RequestSchema],
+    stream: bool = False,
+    accept: Optional[str] = Header(None),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+):
+    """
+    Handles POST requests carrying a list of OpenAI requests.
+
+    Items run concurrently, at most `BATCH_CONCURRENCY` at a time and each bounded by
+    `BATCH_ITEM_TIMEOUT`. Every item is checked against its model's context window before any
+    runs. Their upstream calls are scheduled in the "batch" class, so a
+    large batch yields slots to interactive requests. Successful items are stored with a
+    single bulk insert.
+
+    Args:
+        requests (List[RequestSchema]): The validated batch items.
+        stream (bool, optional): Stream results as NDJSON as they complete. Defaults to False.
+        accept (str, optional): An `application/x-ndjson` Accept header also selects streaming.
+        current_user (AuthenticatedUser): The authenticated user.
+
+    Returns:
+        FastJSONResponse | StreamingResponse: Per-item results in request order, or an NDJSON
+        stream of results in completion order followed by a summary line with the request ids.
+    """
+    if len(requests) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"A batch may contain at most {settings.BATCH_MAX_ITEMS} requests."
+        )
+    models = {item.model for item in requests}
+    set_model(models.pop() if len(models) == 1 else "mixed")
+    set_request_class(request_class_for("batch", current_user.username))
+    with stage("tokenize"):
+        prompt_tokens = await preflight_async(requests)
+    await enforce_rate_limit(current_user.id, requests, prompt_tokens=prompt_tokens)
+    user_id = current_user.id
+    accounting: Dict[int, Dict[str, Any]] = {}
+
+    async def call(indexed_item):
+        index, item = indexed_item
+        # Each item runs in its own task, so each tracks its own upstream usage
+        usage = track_usage()
+        response = await openai_request(item.model, item.prompt, item.parameters)
+        accounting[index] = settle_usage(usage, item.model, prompt_tokens[index], response)
+        return response
+
+    items = list(enumerate(requests))
+
+    if stream or (accept and "application/x-ndjson" in accept):
+        async def ndjson_stream():
+            results = []
+            async for result in iter_batch(items, call, settings.BATCH_CONCURRENCY, settings.BATCH_ITEM_TIMEOUT):
+                results.append(result)
+                yield dumps(result) + b"\n"
+            try:
+                request_ids = await save_batch(requests, results, user_id, accounting)
+            except Exception as e:
+                logger.error(f"Error storing batch: {e}")
+                yield dumps({"done": True, "error": "Error storing requests"}) + b"\n"
+                return
+            yield dumps({"done": True, "request_ids": {str(index): request_id for index, request_id in request_ids.items()}}) + b"\n"
+
+        return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+    results = await run_batch(items, call, settings.BATCH_CONCURRENCY, settings.BATCH_ITEM_TIMEOUT)
+    try:
+        request_ids = await save_batch(requests, results, user_id, accounting)
+    except Exception as e:
+        logger.error(f"Error storing batch: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+    for result in results:
+        if result["index"] in request_ids:
+            result["request_id"] = request_ids[result["index"]]
+    return FastJSONResponse({"results": results})
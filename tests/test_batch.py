@@ -0,0 +1,49 @@
+import asyncio
+from fastapi import HTTPException
+from utils.batch import iter_batch, run_batch
+
+def test_run_batch_returns_results_in_input_order():
+    async def call(delay):
+        await asyncio.sleep(delay)
+        return f"done after {delay}"
+
+    results = asyncio.run(run_batch([0.03, 0.01, 0.02], call, concurrency=3))
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert results[0]["response"] == "done after 0.03"
+
+def test_run_batch_respects_concurrency_limit():
+    in_flight = []
+    peak = []
+
+    async def call(item):
+        in_flight.append(item)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(item)
+        return item
+
+    asyncio.run(run_batch(list(range(20)), call, concurrency=4))
+    assert max(peak) == 4
+
+def test_run_batch_reports_per_item_errors_and_timeouts():
+    async def call(item):
+        if item == "slow":
+            await asyncio.sleep(1)
+        if item == "bad":
+            raise HTTPException(status_code=500, detail="OpenAI API Error: boom")
+        return item
+
+    results = asyncio.run(run_batch(["ok", "slow", "bad"], call, concurrency=3, timeout=0.05))
+    assert results[0] == {"index": 0, "response": "ok"}
+    assert results[1] == {"index": 1, "error": "Request timed out"}
+    assert results[2] == {"index": 2, "error": "OpenAI API Error: boom"}
+
+def test_iter_batch_yields_in_completion_order():
+    async def call(delay):
+        await asyncio.sleep(delay)
+        return delay
+
+    async def collect():
+        return [result["index"] async for result in iter_batch([0.03, 0.0, 0.015], call, concurrency=3)]
+
+    assert asyncio.run(collect()) == [1, 2, 0]
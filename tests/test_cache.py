@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from utils.cache import CACHE_EVICTIONS, RESPONSE_CACHE_EVICTIONS, LRUCache, RedisCache, ResponseCache, make_cache_key, bypass_reason, parse_cache_control
+from utils.openai import OpenAIUtils
+from unittest.mock import AsyncMock, MagicMock
+
+class FakeRedis:
+    """An in-memory stand-in for the async Redis client."""
+    def __init__(self):
+        self.store = {}
+
+    async def get(self, key):
+        return self.store.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.store[key] = value
+
+@pytest.fixture
+def response_cache():
+    return ResponseCache(LRUCache(max_entries=2, ttl=60), RedisCache(FakeRedis()))
+
+@pytest.fixture
+def openai_utils(response_cache):
+    utils = MagicMock(spec=OpenAIUtils)
+    utils.cache = response_cache
+    utils.semantic_cache = None
+    utils.singleflight = None
+    utils.make_request = AsyncMock(return_value="Hello, world!")
+    utils.fetch = OpenAIUtils.fetch.__get__(utils)
+    utils.get_response = OpenAIUtils.get_response.__get__(utils)
+    return utils
+
+def test_cache_key_is_canonical():
+    """Tests that parameter order, model casing and ignored parameters do not change the key."""
+    key = make_cache_key("gpt-3.5-turbo", "Hello world", {"temperature": 0, "max_tokens": 5})
+    assert key == make_cache_key("GPT-3.5-turbo ", "Hello world", {"max_tokens": 5, "temperature": 0, "user": "abc"})
+    assert key != make_cache_key("gpt-3.5-turbo", "Hello world!", {"temperature": 0, "max_tokens": 5})
+
+@pytest.mark.parametrize(
+    "parameters, expected_reason",
+    [
+        ({"temperature": 0}, None),
+        ({}, "temperature"),
+        ({"temperature": 0.7}, "temperature"),
+        ({"temperature": 0, "n": 3}, "multiple_choices"),
+        ({"temperature": 0, "stream": True}, "stream"),
+    ],
+)
+def test_bypass_reason(parameters, expected_reason):
+    assert bypass_reason(parameters) == expected_reason
+
+def test_parse_cache_control():
+    assert parse_cache_control("No-Cache, max-age=0") == {"no-cache", "max-age"}
+    assert parse_cache_control(None) == set()
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+def test_response_cache_evictions_keep_their_original_metric():
+    before = RESPONSE_CACHE_EVICTIONS.labels(reason="capacity")._value.get()
+    shared = CACHE_EVICTIONS.labels(cache="response", reason="capacity")._value.get()
+    cache = LRUCache(max_entries=1, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    other = LRUCache(max_entries=1, ttl=60, name="other")
+    other.set("a", 1)
+    other.set("b", 2)
+    assert RESPONSE_CACHE_EVICTIONS.labels(reason="capacity")._value.get() == before + 1
+    assert CACHE_EVICTIONS.labels(cache="response", reason="capacity")._value.get() == shared + 1
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(max_entries=2, ttl=60)
+    cache.set("a", 1, ttl=-1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+def test_redis_hit_is_promoted_to_local_tier(response_cache):
+    asyncio.run(response_cache.shared.set("key", "cached"))
+    assert asyncio.run(response_cache.get("key")) == "cached"
+    assert response_cache.local.get("key") == "cached"
+
+def test_get_response_serves_repeated_deterministic_prompts_from_cache(openai_utils):
+    for _ in range(3):
+        response = asyncio.run(openai_utils.get_response("gpt-3.5-turbo", "Hello world", {"temperature": 0}))
+        assert response == "Hello, world!"
+    openai_utils.make_request.assert_awaited_once()
+
+def test_get_response_bypasses_cache_for_sampled_requests(openai_utils):
+    for _ in range(2):
+        asyncio.run(openai_utils.get_response("gpt-3.5-turbo", "Hello world", {"temperature": 0.7}))
+    assert openai_utils.make_request.await_count == 2
+
+@pytest.mark.parametrize(
+    "cache_control, expected_cached",
+    [
+        ("no-cache", True),
+        ("no-store", False),
+    ],
+)
+def test_get_response_honors_cache_control(openai_utils, cache_control, expected_cached):
+    parameters = {"temperature": 0}
+    asyncio.run(openai_utils.get_response("gpt-3.5-turbo", "Hello world", parameters, cache_control))
+    asyncio.run(openai_utils.get_response("gpt-3.5-turbo", "Hello world", parameters, cache_control))
+    assert openai_utils.make_request.await_count == 2
+    key = make_cache_key("gpt-3.5-turbo", "Hello world", parameters)
+    assert (openai_utils.cache.local.get(key) is not None) == expected_cached
@@ -0,0 +1,79 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from utils.db import Base, User, bulk_create_requests_async
+from utils.export import EXPORT_COLUMNS, encode_export, iter_request_rows
+
+@pytest.fixture
+def session_factory():
+    engine = create_async_engine("sqlite+aiosqlite://")
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with async_sessionmaker(engine)() as db:
+            db.add_all([
+                User(id=1, username="testuser", email="test@example.com", hashed_password="hashed_password"),
+                User(id=2, username="otheruser", email="other@example.com", hashed_password="hashed_password"),
+            ])
+            await db.commit()
+            await bulk_create_requests_async(db, [
+                {
+                    "model": "gpt-3.5-turbo" if i % 2 else "text-davinci-003",
+                    "prompt": f"prompt, \"{i}\"\n",
+                    "parameters": {"temperature": 0},
+                    "response": f"response {i}",
+                    "user_id": 1 if i < 25 else 2,
+                }
+                for i in range(30)
+            ])
+
+    asyncio.run(setup())
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+def _export(session_factory, export_format="ndjson", compress=False, **filters):
+    async def run():
+        chunks, batch_sizes = [], []
+
+        async def counted(batches):
+            async for rows in batches:
+                batch_sizes.append(len(rows))
+                yield rows
+
+        async with session_factory() as db:
+            batches = counted(iter_request_rows(db, batch_size=10, **filters))
+            async for chunk in encode_export(batches, export_format, compress):
+                chunks.append(chunk)
+        return b"".join(chunks), batch_sizes
+
+    return asyncio.run(run())
+
+def test_ndjson_export_streams_in_batches(session_factory):
+    data, batch_sizes = _export(session_factory, user_id=1)
+    rows = [json.loads(line) for line in data.decode().splitlines()]
+    assert batch_sizes == [10, 10, 5]
+    assert [row["id"] for row in rows] == list(range(1, 26))
+    assert set(rows[0]) == set(EXPORT_COLUMNS)
+    assert rows[0]["parameters"] == {"temperature": 0}
+    assert rows[0]["created_at"]
+
+def test_csv_export_round_trips(session_factory):
+    data, _ = _export(session_factory, "csv", model="gpt-3.5-turbo")
+    rows = list(csv.DictReader(io.StringIO(data.decode())))
+    assert len(rows) == 15
+    assert rows[0]["prompt"] == 'prompt, "1"\n'
+    assert json.loads(rows[0]["parameters"]) == {"temperature": 0}
+    assert json.loads(rows[0]["response"]) == "response 1"
+
+def test_gzip_export(session_factory):
+    data, _ = _export(session_factory, compress=True)
+    lines = gzip.decompress(data).decode().splitlines()
+    assert len(lines) == 30
+
+def test_invalid_format(session_factory):
+    with pytest.raises(ValueError):
+        _export(session_factory, "xml")
@@ -0,0 +1,276 @@
+import asyncio
+import json
+import fakeredis.aioredis
+import pytest
+from aiohttp import web
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from utils.db import Base, Request, User, claim_job_async, create_job_async
+from utils.jobs import JobWorkerPool, LocalJobQueue, RedisJobQueue, is_public_address, webhook_signature
+
+@pytest.fixture
+def session_factory(tmp_path):
+    # A file database: workers and the polling test hold sessions at the same time, and an
+    # in-memory database shares one connection between them
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'jobs.db'}")
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with factory() as db:
+            db.add(User(id=1, username="testuser", email="test@example.com", hashed_password="hashed_password"))
+            await db.commit()
+
+    asyncio.run(setup())
+    return factory
+
+async def _submit(factory, prompt="Hello", callback_url=None) -> int:
+    async with factory() as db:
+        return (await create_job_async(db, "gpt-3.5-turbo", prompt, {}, 1, callback_url)).id
+
+async def _job(factory, job_id):
+    async with factory() as db:
+        return await db.get(Request, job_id)
+
+async def _wait_for(factory, job_id, statuses=("completed", "failed")):
+    for _ in range(200):
+        job = await _job(factory, job_id)
+        if job.status in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Job {job_id} is still {job.status}")
+
+async def echo(model, prompt, parameters):
+    if prompt == "fail":
+        raise HTTPException(status_code=500, detail="OpenAI API Error: boom")
+    return f"Echo: {prompt}"
+
+def test_jobs_run_in_the_background_and_store_their_outcome(session_factory):
+    async def scenario():
+        pool = JobWorkerPool(LocalJobQueue(), call=echo, session_factory=session_factory, workers=2)
+        await pool.start()
+        try:
+            ok, failed = await _submit(session_factory), await _submit(session_factory, "fail")
+            assert (await _job(session_factory, ok)).status == "queued"
+            await pool.submit(ok)
+            await pool.submit(failed)
+            return await _wait_for(session_factory, ok), await _wait_for(session_factory, failed)
+        finally:
+            await pool.stop()
+
+    ok, failed = asyncio.run(scenario())
+    assert (ok.status, ok.response, ok.error) == ("completed", "Echo: Hello", None)
+    assert (failed.status, failed.response, failed.error) == ("failed", None, "OpenAI API Error: boom")
+
+def test_a_job_runs_once_and_unfinished_jobs_are_recovered(session_factory):
+    calls = []
+
+    async def counting(model, prompt, parameters):
+        calls.append(prompt)
+        return prompt
+
+    async def scenario():
+        pool = JobWorkerPool(LocalJobQueue(), call=counting, session_factory=session_factory, workers=0)
+        job_id = await _submit(session_factory)
+        assert await pool.run(job_id) is True
+        assert await pool.run(job_id) is False
+        # Queued but never handed to a worker, e.g. the process restarted
+        pending = await _submit(session_factory, "pending")
+        pool.workers = 1
+        await pool.start()
+        try:
+            return await _wait_for(session_factory, pending)
+        finally:
+            await pool.stop()
+
+    assert asyncio.run(scenario()).status == "completed"
+    assert calls == ["Hello", "pending"]
+
+def test_jobs_left_running_are_released_and_recovered(session_factory):
+    async def scenario():
+        pool = JobWorkerPool(LocalJobQueue(), call=echo, session_factory=session_factory, workers=1)
+        stuck, attempted = await _submit(session_factory), asyncio.get_running_loop().create_future()
+
+        async def failing_finish(job_id, redelivered=False):
+            async with session_factory() as db:
+                await claim_job_async(db, job_id)
+            if not attempted.done():
+                attempted.set_result(job_id)
+            raise ConnectionError("database is gone")
+
+        # A local error after the claim puts the job back to "queued" instead of leaving it "running"
+        pool.run = failing_finish
+        await pool.start()
+        try:
+            await pool.submit(stuck)
+            await asyncio.wait_for(attempted, 5)
+            released = await _wait_for(session_factory, stuck, ("queued",))
+        finally:
+            await pool.stop()
+
+        # A job a dead process left "running" is picked up again at startup once its lease expired
+        async with session_factory() as db:
+            await claim_job_async(db, stuck, lease=-1)
+        pool = JobWorkerPool(LocalJobQueue(), call=echo, session_factory=session_factory, workers=1)
+        await pool.start()
+        try:
+            return released, await _wait_for(session_factory, stuck)
+        finally:
+            await pool.stop()
+
+    released, recovered = asyncio.run(scenario())
+    assert released.status == "queued"
+    assert (recovered.status, recovered.response) == ("completed", "Echo: Hello")
+
+def test_a_job_running_in_another_process_is_left_alone(session_factory):
+    calls = []
+
+    async def slow(model, prompt, parameters):
+        calls.append(prompt)
+        await asyncio.sleep(0.5)
+        return prompt
+
+    async def scenario():
+        # Two processes sharing the database, each with its own local queue
+        first = JobWorkerPool(LocalJobQueue(), call=slow, session_factory=session_factory, workers=1, lease=0.1)
+        second = JobWorkerPool(LocalJobQueue(), call=slow, session_factory=session_factory, workers=1, lease=0.1)
+        await first.start()
+        try:
+            job_id = await _submit(session_factory)
+            await first.submit(job_id)
+            await _wait_for(session_factory, job_id, ("running",))
+            # Starting or restarting the second one, and its periodic check, outlasts the lease several times
+            await second.start()
+            await asyncio.sleep(0.3)
+            return await _wait_for(session_factory, job_id)
+        finally:
+            await first.stop()
+            await second.stop()
+
+    assert asyncio.run(scenario()).status == "completed"
+    assert calls == ["Hello"]
+
+def test_a_job_whose_worker_died_is_recovered_by_another_process(session_factory):
+    async def scenario():
+        job_id = await _submit(session_factory)
+        async with session_factory() as db:
+            # Claimed by a process that then died, so nothing renews the lease
+            await claim_job_async(db, job_id, lease=0.5)
+        pool = JobWorkerPool(LocalJobQueue(), call=echo, session_factory=session_factory, workers=1, lease=0.1)
+        await pool.start()
+        try:
+            assert (await _job(session_factory, job_id)).status == "running"
+            return await _wait_for(session_factory, job_id)
+        finally:
+            await pool.stop()
+
+    job = asyncio.run(scenario())
+    assert (job.status, job.response) == ("completed", "Echo: Hello")
+
+def test_interrupted_job_goes_back_to_queued(session_factory):
+    async def hang(model, prompt, parameters):
+        await asyncio.sleep(10)
+
+    async def scenario():
+        pool = JobWorkerPool(LocalJobQueue(), call=hang, session_factory=session_factory, workers=1)
+        await pool.start()
+        job_id = await _submit(session_factory)
+        await pool.submit(job_id)
+        await _wait_for(session_factory, job_id, ("running",))
+        await pool.stop()
+        return await _job(session_factory, job_id)
+
+    assert asyncio.run(scenario()).status == "queued"
+
+def test_webhook_receives_signed_outcome(session_factory):
+    async def scenario():
+        received, attempts = asyncio.get_running_loop().create_future(), []
+
+        async def hook(request):
+            attempts.append(1)
+            if len(attempts) == 1:
+                return web.Response(status=503)
+            received.set_result((await request.read(), request.headers.get("X-Webhook-Signature")))
+            return web.Response(status=204)
+
+        app = web.Application()
+        app.router.add_post("/hook", hook)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        pool = JobWorkerPool(
+            LocalJobQueue(), call=echo, session_factory=session_factory, workers=1, webhook_secret="s3cret",
+            callback_allowed_hosts=["127.0.0.1"],
+        )
+        await pool.start()
+        try:
+            job_id = await _submit(session_factory, callback_url=f"http://127.0.0.1:{port}/hook")
+            await pool.submit(job_id)
+            return job_id, await asyncio.wait_for(received, 5), len(attempts)
+        finally:
+            await pool.stop()
+            await runner.cleanup()
+
+    job_id, (body, signature), attempts = asyncio.run(scenario())
+    assert json.loads(body) == {"id": job_id, "status": "completed", "model": "gpt-3.5-turbo", "response": "Echo: Hello", "error": None}
+    assert signature == webhook_signature("s3cret", body)
+    assert attempts == 2
+
+def test_webhooks_to_internal_addresses_are_refused(session_factory):
+    async def scenario():
+        received = []
+
+        async def hook(request):
+            received.append(request.path)
+            return web.Response(status=302, headers={"Location": "/internal"})
+
+        app = web.Application()
+        app.router.add_post("/hook", hook)
+        app.router.add_post("/internal", hook)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        open_pool = JobWorkerPool(LocalJobQueue(), call=echo, session_factory=session_factory, workers=1)
+        allowlisted = JobWorkerPool(
+            LocalJobQueue(), call=echo, session_factory=session_factory, workers=1, callback_allowed_hosts=["127.0.0.1"],
+        )
+        await open_pool.start()
+        await allowlisted.start()
+        try:
+            payload = {"id": 1, "status": "completed"}
+            loopback = await open_pool.notify(f"http://127.0.0.1:{port}/hook", payload)
+            named = await open_pool.notify(f"http://localhost:{port}/hook", payload)
+            not_listed = await allowlisted.notify("http://example.com/hook", payload)
+            redirected = await allowlisted.notify(f"http://127.0.0.1:{port}/hook", payload)
+            return loopback, named, not_listed, redirected, received
+        finally:
+            await open_pool.stop()
+            await allowlisted.stop()
+            await runner.cleanup()
+
+    assert asyncio.run(scenario()) == (False, False, False, False, ["/hook"])
+    assert is_public_address("93.184.216.34")
+    assert not any(map(is_public_address, ["10.0.0.1", "169.254.169.254", "::1", "::ffff:127.0.0.1", "100.64.0.1", "240.0.0.1"]))
+
+def test_redis_queue_redelivers_unacknowledged_jobs():
+    async def scenario():
+        redis = fakeredis.aioredis.FakeRedis()
+        first = RedisJobQueue(redis, "jobs", "workers", "consumer-1", claim_timeout=0, block=0.01)
+        second = RedisJobQueue(redis, "jobs", "workers", "consumer-2", claim_timeout=0, block=0.01)
+        await first.start()
+        await second.start()
+        await first.put(7)
+        job_id, token, redelivered = await first.get()
+        assert (job_id, redelivered) == (7, False)
+        # consumer-1 dies without acknowledging; consumer-2 takes the job over
+        job_id, token, redelivered = await second.get()
+        assert (job_id, redelivered) == (7, True)
+        await second.ack(token)
+        return await redis.xlen("jobs"), (await redis.xpending("jobs", "workers"))["pending"]
+
+    assert asyncio.run(scenario()) == (0, 0)
@@ -0,0 +1,58 @@
+import subprocess
+import sys
+import pytest
+from prometheus_client import REGISTRY
+from utils import metrics
+from utils.metrics import clear_multiprocess_dir, mark_worker_dead, metrics_registry, metrics_response
+
+WORKER_SCRIPT = """
+from prometheus_client import Counter, Gauge
+Counter("worker_jobs_total", "Jobs handled").inc({jobs})
+Gauge("worker_queue_depth", "Queued jobs", multiprocess_mode="livesum").set({jobs})
+"""
+
+@pytest.fixture
+def multiproc_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics.settings, "PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    return tmp_path
+
+def _run_worker(path, jobs):
+    """Runs a short-lived process that records metrics into `path` and returns its pid."""
+    process = subprocess.Popen(
+        [sys.executable, "-c", WORKER_SCRIPT.format(jobs=jobs)],
+        env={"PROMETHEUS_MULTIPROC_DIR": str(path)},
+    )
+    assert process.wait() == 0
+    return process.pid
+
+def _value(registry, name, sample_name):
+    for metric in registry.collect():
+        if metric.name == name:
+            return sum(sample.value for sample in metric.samples if sample.name == sample_name)
+    return None
+
+def test_single_process_uses_default_registry(monkeypatch):
+    monkeypatch.setattr(metrics.settings, "PROMETHEUS_MULTIPROC_DIR", None)
+    assert metrics_registry() is REGISTRY
+
+def test_multiprocess_registry_aggregates_workers(multiproc_dir):
+    _run_worker(multiproc_dir, 2)
+    _run_worker(multiproc_dir, 3)
+
+    registry = metrics_registry()
+    assert _value(registry, "worker_jobs", "worker_jobs_total") == 5
+    response = metrics_response()
+    assert response.media_type.startswith("text/plain")
+    assert b"worker_jobs_total 5.0" in response.body
+
+def test_clear_multiprocess_dir_removes_stale_files(multiproc_dir):
+    _run_worker(multiproc_dir, 1)
+    assert any(path.suffix == ".db" for path in multiproc_dir.iterdir())
+    clear_multiprocess_dir()
+    assert not list(multiproc_dir.iterdir())
+
+def test_dead_worker_live_gauges_are_dropped(multiproc_dir):
+    pid = _run_worker(multiproc_dir, 4)
+    assert _value(metrics_registry(), "worker_queue_depth", "worker_queue_depth") == 4
+    mark_worker_dead(pid)
+    assert not _value(metrics_registry(), "worker_queue_depth", "worker_queue_depth")
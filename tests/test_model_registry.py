@@ -0,0 +1,106 @@
+import asyncio
+import json
+import os
+import pytest
+from fastapi import HTTPException
+from benchmarks.mock_upstream import MockUpstream, start_mock_upstream
+from models import RequestSchema
+from utils import openai as openai_module
+from utils.model_registry import ModelRegistry, parse_model_registry
+
+def test_parse_model_registry():
+    models = parse_model_registry(json.dumps({
+        "GPT-4o": {"endpoint": "chat", "max_prompt_length": 8000, "default_parameters": {"temperature": 0}},
+        "fast": {"upstream_model": "gpt-4o-mini", "prompt_price": 0.15, "completion_price": 0.6},
+    }))
+    assert models["gpt-4o"].endpoint == "chat" and models["gpt-4o"].upstream_model == "gpt-4o"
+    assert models["fast"].upstream_model == "gpt-4o-mini"
+    assert models["gpt-4o"].with_defaults({"max_tokens": 5}) == {"temperature": 0, "max_tokens": 5}
+    assert models["fast"].cost(1000, 2000) == pytest.approx(1.35)
+    with pytest.raises(ValueError):
+        parse_model_registry('{"bad": {"endpoint": "embeddings"}}')
+    with pytest.raises(ValueError):
+        parse_model_registry('{"bad": {"unknown_field": 1}}')
+
+def test_registry_reloads_changed_file_and_keeps_last_good(tmp_path):
+    path = tmp_path / "models.json"
+    path.write_text(json.dumps({"model-a": {}}))
+    registry = ModelRegistry(path=str(path))
+    assert registry.names == {"model-a"}
+    assert registry.reload() is False
+
+    path.write_text(json.dumps({"model-b": {"endpoint": "chat"}}))
+    os.utime(path, (registry.loaded_mtime + 1, registry.loaded_mtime + 1))
+    assert registry.reload() is True
+    assert "model-b" in registry and registry.get("model-a") is None
+
+    path.write_text("{not json")
+    os.utime(path, (registry.loaded_mtime + 2, registry.loaded_mtime + 2))
+    assert registry.reload() is False
+    assert registry.names == {"model-b"}
+
+def test_request_schema_uses_registry(monkeypatch):
+    registry = ModelRegistry(json.dumps({"short": {"max_prompt_length": 5}}))
+    monkeypatch.setattr("models.request_schema.model_registry", registry)
+    assert RequestSchema(model="SHORT", prompt="hi").model == "short"
+    with pytest.raises(ValueError):
+        RequestSchema(model="short", prompt="too long")
+    with pytest.raises(ValueError):
+        RequestSchema(model="gpt-3.5-turbo", prompt="hi")
+
+def test_requests_are_routed_by_endpoint_with_concurrency_limits(monkeypatch):
+    async def scenario():
+        mock = MockUpstream(latency=0.05, token_latency=0)
+        runner, base_url = await start_mock_upstream(mock)
+        registry = ModelRegistry(json.dumps({
+            "chatty": {"endpoint": "chat", "base_url": base_url, "upstream_model": "gpt-4o-mini", "max_concurrency": 1},
+            "legacy": {"endpoint": "completion", "base_url": base_url},
+        }))
+        monkeypatch.setattr(openai_module, "model_registry", registry)
+        utils = openai_module.OpenAIUtils.get_instance()
+        try:
+            started = asyncio.get_running_loop().time()
+            chat = await asyncio.gather(*(utils.make_request("chatty", "Hello") for _ in range(3)))
+            serialized = asyncio.get_running_loop().time() - started
+            completion = await utils.make_request("legacy", "Hello")
+            streamed = [text async for text in utils.stream_response("chatty", "Hello there")]
+            with pytest.raises(HTTPException) as e:
+                await utils.make_request("missing", "Hello")
+            return chat, serialized, completion, streamed, e.value.status_code
+        finally:
+            for key in [key for key in utils.clients if key[0] == base_url]:
+                await utils.clients.pop(key).close()
+            await runner.cleanup()
+
+    chat, serialized, completion, streamed, missing_status = asyncio.run(scenario())
+    assert chat == ["Echo: Hello"] * 3
+    # max_concurrency 1 runs the three 50 ms calls one after another
+    assert serialized >= 0.15
+    assert completion == "Echo: Hello"
+    assert "".join(streamed) == "Echo: Hello there"
+    assert missing_status == 400
+
+def test_abandoned_stream_releases_the_half_open_trial(monkeypatch):
+    async def scenario():
+        runner, base_url = await start_mock_upstream(MockUpstream(latency=0, token_latency=0.01))
+        monkeypatch.setattr(openai_module, "model_registry", ModelRegistry(json.dumps({"legacy": {"base_url": base_url}})))
+        utils = openai_module.OpenAIUtils.get_instance()
+        breaker = utils.breakers.get("legacy")
+        breaker.record_failure()
+        breaker.state, breaker.opened_at = "open", 0.0
+        try:
+            # The client disconnects after the first fragment of the half-open trial
+            stream = utils.stream_response("legacy", "Hello there world")
+            await stream.__anext__()
+            await stream.aclose()
+            trial_released = breaker.half_open_calls == 0
+            streamed = [text async for text in utils.stream_response("legacy", "Hello")]
+            return trial_released, streamed, breaker.state
+        finally:
+            for key in [key for key in utils.clients if key[0] == base_url]:
+                await utils.clients.pop(key).close()
+            await runner.cleanup()
+
+    trial_released, streamed, state = asyncio.run(scenario())
+    assert trial_released
+    assert "".join(streamed) == "Echo: Hello" and state == "closed"
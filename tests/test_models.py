@@ -67,4 +67,25 @@ def test_model_serialization():
         "username": "testuser",
         "email": "test@example.com",
         "password": "password123"
-    }
\ No newline at end of file
+    }
+
+
+def test_request_schema_normalizes_model_and_keeps_parameters_separate():
+    """Models are matched case-insensitively and each instance gets its own parameters dict."""
+    first = RequestSchema(model="GPT-3.5-Turbo", prompt="Hello world")
+    second = RequestSchema(model="gpt-3.5-turbo", prompt="Hello world")
+    first.parameters["temperature"] = 0.5
+    assert first.model == "gpt-3.5-turbo"
+    assert second.parameters == {}
+
+
+def test_request_schema_rejects_a_non_string_model():
+    """A model that is not a string is a validation error, not a server error."""
+    for model in (["gpt-3.5-turbo"], {"name": "gpt-3.5-turbo"}, 3):
+        with pytest.raises(ValueError):
+            RequestSchema(model=model, prompt="Hello world")
+
+
+def test_request_schema_leaves_long_prompts_to_the_context_window_check():
+    """Without a per-model cap, a prompt is only limited by MAX_PROMPT_LENGTH and the token preflight."""
+    assert len(RequestSchema(model="gpt-3.5-turbo", prompt="word " * 600).prompt) == 3000
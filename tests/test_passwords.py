@@ -0,0 +1,67 @@
+import asyncio
+import time
+import pytest
+from fastapi import HTTPException
+from utils.passwords import PasswordHasher, check_password
+
+def test_hash_and_verify_round_trip():
+    hasher = PasswordHasher(pool_size=2, rounds=4)
+
+    async def run():
+        hashed = await hasher.hash("password123")
+        return hashed, await hasher.verify("password123", hashed), await hasher.verify("wrong-password", hashed)
+
+    try:
+        hashed, valid, invalid = asyncio.run(run())
+    finally:
+        hasher.shutdown()
+    assert hashed.startswith("$2b$04$")
+    assert valid is True
+    assert invalid is False
+
+def test_non_bcrypt_hash_never_matches():
+    assert check_password("password123", "password123") is False
+
+def test_full_pool_rejects_with_503():
+    hasher = PasswordHasher(pool_size=1, max_queue=1, rounds=10)
+
+    async def run():
+        return await asyncio.gather(*(hasher.hash("password123") for _ in range(3)), return_exceptions=True)
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        hasher.shutdown()
+    rejected = [result for result in results if isinstance(result, HTTPException)]
+    assert len(rejected) == 1
+    assert rejected[0].status_code == 503
+    assert rejected[0].headers["Retry-After"] == "1"
+    assert hasher.pending == 0
+
+def test_pooled_hashing_does_not_block_the_event_loop():
+    hasher = PasswordHasher(pool_size=2, rounds=12)
+    ticks = []
+
+    async def ticker(stop):
+        while not stop.is_set():
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.005)
+
+    async def run():
+        stop = asyncio.Event()
+        task = asyncio.create_task(ticker(stop))
+        await hasher.hash("password123")
+        stop.set()
+        await task
+
+    try:
+        asyncio.run(run())
+    finally:
+        hasher.shutdown()
+    gaps = [later - earlier for earlier, later in zip(ticks, ticks[1:])]
+    assert len(ticks) > 3
+    assert max(gaps) < 0.05
+
+def test_invalid_mode():
+    with pytest.raises(ValueError):
+        PasswordHasher(mode="fork")
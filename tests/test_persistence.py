@@ -0,0 +1,129 @@
+import asyncio
+import json
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from utils.db import Base, Request, User
+from utils.persistence import WriteBehindQueue
+
+@pytest.fixture
+def session_factory():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with factory() as db:
+            db.add(User(id=1, username="testuser", email="test@example.com", hashed_password="hashed_password"))
+            await db.commit()
+
+    asyncio.run(setup())
+    return factory
+
+def _row(i):
+    return {"model": "gpt-3.5-turbo", "prompt": f"prompt {i}", "parameters": {}, "response": f"response {i}", "user_id": 1}
+
+async def _count(factory):
+    async with factory() as db:
+        return await db.scalar(select(func.count()).select_from(Request))
+
+def test_flushes_when_batch_is_full(session_factory):
+    async def scenario():
+        queue = WriteBehindQueue(session_factory, batch_size=5, flush_interval=10)
+        await queue.start()
+        for i in range(5):
+            await queue.put(_row(i))
+        await asyncio.sleep(0.1)
+        written = await _count(session_factory)
+        await queue.stop()
+        return written
+
+    assert asyncio.run(scenario()) == 5
+
+def test_flushes_after_interval(session_factory):
+    async def scenario():
+        queue = WriteBehindQueue(session_factory, batch_size=100, flush_interval=0.05)
+        await queue.start()
+        await queue.put(_row(0))
+        await asyncio.sleep(0.2)
+        written = await _count(session_factory)
+        await queue.stop()
+        return written
+
+    assert asyncio.run(scenario()) == 1
+
+def test_stop_flushes_everything_queued(session_factory):
+    async def scenario():
+        queue = WriteBehindQueue(session_factory, batch_size=3, flush_interval=10)
+        for i in range(10):
+            await queue.put(_row(i))
+        await queue.stop()
+        return await _count(session_factory)
+
+    assert asyncio.run(scenario()) == 10
+
+def test_drop_policy_discards_overflow(session_factory):
+    async def scenario():
+        queue = WriteBehindQueue(session_factory, max_size=2, overflow="drop")
+        accepted = [await queue.put(_row(i)) for i in range(3)]
+        await queue.stop()
+        return accepted, await _count(session_factory)
+
+    assert asyncio.run(scenario()) == ([True, True, False], 2)
+
+def test_spill_policy_replays_overflow_from_disk(session_factory, tmp_path):
+    spill_path = str(tmp_path / "spill.jsonl")
+
+    async def scenario():
+        queue = WriteBehindQueue(session_factory, max_size=2, overflow="spill", spill_path=spill_path)
+        for i in range(5):
+            await queue.put(_row(i))
+        await queue.stop()
+        return await _count(session_factory)
+
+    assert asyncio.run(scenario()) == 5
+    assert not (tmp_path / "spill.jsonl").exists()
+
+def test_replay_keeps_an_interrupted_replay_and_skips_corrupt_lines(session_factory, tmp_path):
+    spill_path = tmp_path / "spill.jsonl"
+    # A replay a crash interrupted, with a torn last line, and records spilled since
+    (tmp_path / "spill.jsonl.replay").write_text(json.dumps(_row(0)) + "\n" + '{"model": "gpt-3.5')
+    spill_path.write_text("".join(json.dumps(_row(i)) + "\n" for i in (1, 2)))
+
+    async def scenario():
+        queue = WriteBehindQueue(session_factory, overflow="spill", spill_path=str(spill_path))
+        await queue.stop()
+        return await _count(session_factory)
+
+    assert asyncio.run(scenario()) == 3
+    assert list(tmp_path.iterdir()) == []
+
+def test_flush_loop_survives_errors(session_factory):
+    async def scenario():
+        queue = WriteBehindQueue(session_factory, batch_size=1, flush_interval=0.01)
+        flush, flushed = queue._flush, []
+
+        async def flaky_flush(rows):
+            flushed.append(rows)
+            if len(flushed) == 1:
+                raise RuntimeError("boom")
+            await flush(rows)
+
+        queue._flush = flaky_flush
+        await queue.start()
+        await queue.put(_row(0))
+        await queue.put(_row(1))
+        for _ in range(100):
+            if len(flushed) == 2:
+                break
+            await asyncio.sleep(0.01)
+        running = not queue._task.done()
+        await queue.stop()
+        return running, await _count(session_factory)
+
+    assert asyncio.run(scenario()) == (True, 1)
+
+def test_invalid_overflow_policy():
+    with pytest.raises(ValueError):
+        WriteBehindQueue(overflow="ignore")
@@ -0,0 +1,162 @@
+import asyncio
+import math
+import pytest
+from fastapi import HTTPException
+from types import SimpleNamespace
+from utils import rate_limit
+from utils.rate_limit import (
+    LocalRateLimiter, RedisRateLimiter, RateLimit, TokenBucket, enforce_rate_limit, estimate_tokens, parse_rate_limits,
+)
+
+LIMITS = {
+    "default": RateLimit(requests_per_minute=3, tokens_per_minute=1000),
+    "text-davinci-003": RateLimit(requests_per_minute=1, tokens_per_minute=1000),
+}
+
+def _item(model="gpt-3.5-turbo", prompt="Hello world", parameters=None):
+    return SimpleNamespace(model=model, prompt=prompt, parameters=parameters or {"max_tokens": 10})
+
+def test_estimate_tokens():
+    assert estimate_tokens("x" * 40, {"max_tokens": 100}) == 110
+    assert estimate_tokens("x" * 41, {}) == 11 + 16
+
+def test_parse_rate_limits():
+    limits = parse_rate_limits('{"default": {"requests_per_minute": 60, "tokens_per_minute": 40000}}')
+    assert limits["default"].requests_per_minute == 60
+    assert limits["default"].tokens_per_minute == 40000
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(capacity=10, rate=1)
+    bucket.tokens = 0
+    bucket.refill(bucket.updated_at + 4)
+    assert bucket.tokens == 4
+    assert bucket.wait_time(6) == 2
+    assert math.isinf(bucket.wait_time(11))
+
+def test_local_limiter_rejects_after_burst_and_tracks_spend():
+    limiter = LocalRateLimiter(LIMITS)
+
+    async def scenario():
+        results = [await limiter.acquire(1, "gpt-3.5-turbo", 1, 10) for _ in range(4)]
+        return results, await limiter.get_spend(1)
+
+    results, spend = asyncio.run(scenario())
+    assert [exhausted for exhausted, _ in results] == [None, None, None, "requests"]
+    assert 0 < results[3][1] <= 20
+    assert spend == 30
+
+def test_local_limiter_keys_by_user_and_model():
+    limiter = LocalRateLimiter(LIMITS)
+
+    async def scenario():
+        return [
+            await limiter.acquire(1, "text-davinci-003", 1, 10),
+            await limiter.acquire(1, "text-davinci-003", 1, 10),
+            await limiter.acquire(2, "text-davinci-003", 1, 10),
+            await limiter.acquire(1, "gpt-3.5-turbo", 1, 10),
+        ]
+
+    assert [exhausted for exhausted, _ in asyncio.run(scenario())] == [None, "requests", None, None]
+
+def test_enforce_rate_limit_raises_429_with_retry_after():
+    limiter = LocalRateLimiter(LIMITS)
+
+    async def scenario():
+        await enforce_rate_limit(1, [_item("text-davinci-003")], limiter)
+        await enforce_rate_limit(1, [_item("text-davinci-003")], limiter)
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(scenario())
+    assert e.value.status_code == 429
+    assert int(e.value.headers["Retry-After"]) >= 1
+
+def test_enforce_rate_limit_rejects_requests_larger_than_the_token_limit():
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(enforce_rate_limit(1, [_item(parameters={"max_tokens": 5000})], LocalRateLimiter(LIMITS)))
+    assert e.value.status_code == 429
+    assert e.value.headers is None
+
+def test_rejected_batch_charges_no_model():
+    limiter = LocalRateLimiter(LIMITS)
+
+    async def scenario():
+        with pytest.raises(HTTPException):
+            await enforce_rate_limit(1, [_item("gpt-3.5-turbo"), _item("text-davinci-003"), _item("text-davinci-003")], limiter)
+        return [await limiter.acquire(1, "gpt-3.5-turbo", 3, 10), await limiter.get_spend(1)]
+
+    (exhausted, _), spend = asyncio.run(scenario())
+    assert exhausted is None and spend == 10
+
+@pytest.mark.parametrize("fail_open", [True, False])
+def test_limiter_outage_is_handled_as_configured(monkeypatch, fail_open):
+    class Unavailable:
+        async def acquire_all(self, user_id, costs):
+            raise ConnectionError("Error 111 connecting to localhost:6379")
+
+    monkeypatch.setattr(rate_limit.settings, "RATE_LIMIT_FAIL_OPEN", fail_open)
+    if fail_open:
+        assert asyncio.run(enforce_rate_limit(1, [_item()], Unavailable())) is None
+    else:
+        with pytest.raises(HTTPException) as e:
+            asyncio.run(enforce_rate_limit(1, [_item()], Unavailable()))
+        assert e.value.status_code == 503
+
+def test_local_limiter_keeps_spend_for_a_bounded_number_of_users():
+    limiter = LocalRateLimiter(LIMITS, max_keys=2)
+
+    async def scenario():
+        for user_id in (1, 2, 3):
+            await limiter.acquire(user_id, "gpt-3.5-turbo", 1, 10)
+        return [await limiter.get_spend(user_id) for user_id in (1, 2, 3)]
+
+    assert asyncio.run(scenario()) == [0, 10, 10]
+    assert len(limiter.spend) == 2
+
+def test_redis_limiter_shares_buckets_across_instances():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    client = fakeredis.FakeAsyncRedis()
+
+    async def scenario():
+        first, second = RedisRateLimiter(client, LIMITS), RedisRateLimiter(client, LIMITS)
+        results = [
+            await first.acquire(1, "gpt-3.5-turbo", 1, 10),
+            await second.acquire(1, "gpt-3.5-turbo", 1, 10),
+            await first.acquire(1, "gpt-3.5-turbo", 1, 10),
+            await second.acquire(1, "gpt-3.5-turbo", 1, 10),
+        ]
+        return results, await first.get_spend(1)
+
+    results, spend = asyncio.run(scenario())
+    assert [exhausted for exhausted, _ in results] == [None, None, None, "requests"]
+    assert results[3][1] > 0
+    assert spend == 30
+
+def test_redis_limiter_checks_every_model_before_charging():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    limiter = RedisRateLimiter(fakeredis.FakeAsyncRedis(), LIMITS)
+
+    async def scenario():
+        rejected = await limiter.acquire_all(1, {"gpt-3.5-turbo": (1, 10), "text-davinci-003": (2, 20)})
+        return rejected, await limiter.acquire(1, "gpt-3.5-turbo", 3, 10), await limiter.get_spend(1)
+
+    rejected, (exhausted, _), spend = asyncio.run(scenario())
+    assert rejected[:2] == ("text-davinci-003", "requests")
+    assert exhausted is None and spend == 10
+
+def test_redis_limiter_records_spend_in_the_same_call():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    client = fakeredis.FakeAsyncRedis()
+
+    async def unreachable(*args, **kwargs):
+        raise ConnectionError("no second round trip expected")
+
+    async def scenario():
+        limiter = RedisRateLimiter(client, LIMITS)
+        client.incrby = unreachable
+        return await limiter.acquire(1, "gpt-3.5-turbo", 1, 10), await limiter.get_spend(1)
+
+    (exhausted, _), spend = asyncio.run(scenario())
+    assert exhausted is None and spend == 10
@@ -0,0 +1,55 @@
+import asyncio
+from benchmarks.mock_upstream import MockUpstream, start_mock_upstream
+from utils.readiness import ReadinessProbe
+from utils.upstream import UpstreamClient, UpstreamError
+
+def test_probe_is_not_ready_until_started():
+    async def ok():
+        pass
+
+    async def scenario():
+        probe = ReadinessProbe({"database": ok})
+        before = await probe.check()
+        probe.started = True
+        return before, await probe.check()
+
+    before, after = asyncio.run(scenario())
+    assert before == (False, {"startup": "not finished"})
+    assert after == (True, {"database": "ok"})
+
+def test_probe_reports_failures_and_timeouts_and_reuses_results():
+    calls = []
+
+    async def failing():
+        calls.append("database")
+        raise ConnectionError("connection refused")
+
+    async def hanging():
+        await asyncio.sleep(10)
+
+    async def scenario():
+        probe = ReadinessProbe({"database": failing, "upstream": hanging}, timeout=0.05, cache_ttl=60)
+        probe.started = True
+        return await asyncio.gather(*(probe.check() for _ in range(3)))
+
+    results = asyncio.run(scenario())
+    assert results[0] == (False, {"database": "connection refused", "upstream": "timed out after 0.05s"})
+    assert all(result == results[0] for result in results)
+    assert calls == ["database"]
+
+def test_upstream_ping():
+    async def scenario():
+        runner, base_url = await start_mock_upstream(MockUpstream(latency=0))
+        client, missing = UpstreamClient(base_url), UpstreamClient(base_url.replace("/v1", "/v2"))
+        try:
+            await client.ping()
+            try:
+                await missing.ping()
+            except UpstreamError as e:
+                return e.status
+        finally:
+            await client.close()
+            await missing.close()
+            await runner.cleanup()
+
+    assert asyncio.run(scenario()) == 404
@@ -3,6 +3,7 @@ from fastapi.testclient import TestClient
 from routers import request_router  # Import the request router
 from models import RequestSchema  # Import the request schema model
 from utils.openai import openai_request  # Import for mocking
+from utils.upstream import UpstreamError
 from utils.db import Session  # Import for database mocking
 from utils.db import get_db  # Import for database dependency injection
 from unittest.mock import MagicMock, patch
@@ -71,7 +72,7 @@ def test_create_request_openai_error(client, monkeypatch):
     """Tests the 'create_request' endpoint when the OpenAI API call fails."""
 
     def mock_openai_request(*args, **kwargs):
-        raise openai.error.APIError("Error while making OpenAI request.")
+        raise UpstreamError("Error while making OpenAI request.", status=500)
 
     monkeypatch.setattr(openai_request, "openai_request", mock_openai_request)
 
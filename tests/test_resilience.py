@@ -0,0 +1,150 @@
+import asyncio
+import contextlib
+import pytest
+from benchmarks.mock_upstream import MockUpstream, start_mock_upstream
+from utils.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, call_with_resilience, CLOSED, HALF_OPEN, OPEN
+from utils.upstream import UpstreamClient, UpstreamError
+
+async def _no_sleep(delay):
+    return None
+
+async def _against_mock(mock, scenario):
+    runner, base_url = await start_mock_upstream(mock)
+    client = UpstreamClient(base_url, api_key="test-key")
+    await client.start()
+    try:
+        return await scenario(lambda: client.post_json("/completions", {"model": "text-davinci-003", "prompt": "Hello"}))
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+@pytest.mark.parametrize("retry", [0, 1, 2, 5])
+def test_full_jitter_delay_is_bounded(retry):
+    policy = RetryPolicy(base_delay=0.5, max_delay=4)
+    for _ in range(50):
+        assert 0 <= policy.delay(retry) <= min(4, 0.5 * 2 ** retry)
+
+def test_retry_after_overrides_jitter_and_is_capped():
+    policy = RetryPolicy(max_retry_after=10)
+    assert policy.delay(0, retry_after=3) == 3
+    assert policy.delay(0, retry_after=60) == 10
+
+def test_breaker_opens_after_threshold_and_recovers_through_half_open():
+    breaker = CircuitBreaker("test-model", failure_threshold=2, recovery_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    asyncio.run(asyncio.sleep(0.06))
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+def test_half_open_failure_reopens_breaker():
+    breaker = CircuitBreaker("test-model", failure_threshold=1, recovery_timeout=0)
+    breaker.record_failure()
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+def test_transient_failures_are_retried_against_fault_injecting_upstream():
+    mock = MockUpstream(latency=0, error_status=503, fail_first=2)
+    breaker = CircuitBreaker("text-davinci-003", failure_threshold=5)
+
+    response = asyncio.run(_against_mock(mock, lambda call: call_with_resilience(call, breaker, RetryPolicy(max_retries=3), _no_sleep)))
+    assert response["choices"][0]["text"] == "Echo: Hello"
+    assert mock.calls == 3
+    assert breaker.state == CLOSED
+
+def test_retries_honor_upstream_retry_after():
+    delays = []
+
+    async def record_sleep(delay):
+        delays.append(delay)
+
+    mock = MockUpstream(latency=0, error_status=429, retry_after=1.5, fail_first=1)
+    breaker = CircuitBreaker("text-davinci-003")
+    asyncio.run(_against_mock(mock, lambda call: call_with_resilience(call, breaker, RetryPolicy(), record_sleep)))
+    assert delays == [1.5]
+
+def test_non_retryable_errors_fail_immediately():
+    mock = MockUpstream(latency=0, error_status=400, fail_first=1)
+    breaker = CircuitBreaker("text-davinci-003")
+
+    with pytest.raises(UpstreamError) as e:
+        asyncio.run(_against_mock(mock, lambda call: call_with_resilience(call, breaker, RetryPolicy(), _no_sleep)))
+    assert e.value.status == 400
+    assert mock.calls == 1
+
+def test_brownout_opens_breaker_and_fails_fast():
+    mock = MockUpstream(latency=0, error_status=503, error_rate=1.0)
+    breaker = CircuitBreaker("text-davinci-003", failure_threshold=3, recovery_timeout=60)
+    policy = RetryPolicy(max_retries=1)
+
+    async def scenario(call):
+        outcomes = []
+        for _ in range(4):
+            try:
+                await call_with_resilience(call, breaker, policy, _no_sleep)
+            except (UpstreamError, CircuitOpenError) as e:
+                outcomes.append(type(e).__name__)
+        return outcomes
+
+    outcomes = asyncio.run(_against_mock(mock, scenario))
+    assert outcomes == ["UpstreamError", "CircuitOpenError", "CircuitOpenError", "CircuitOpenError"]
+    assert mock.calls == 3
+
+def test_cancelled_half_open_trial_releases_its_slot():
+    breaker = CircuitBreaker("test-model", failure_threshold=1, recovery_timeout=0)
+    breaker.record_failure()
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(call_with_resilience(hang, breaker, RetryPolicy(max_retries=0), _no_sleep), 0.01)
+        assert breaker.state == HALF_OPEN and breaker.half_open_calls == 0
+
+        async def local_error():
+            raise RuntimeError("not an upstream failure")
+
+        with pytest.raises(RuntimeError):
+            await call_with_resilience(local_error, breaker, RetryPolicy(max_retries=0), _no_sleep)
+
+        async def ok():
+            return "ok"
+
+        return await call_with_resilience(ok, breaker, RetryPolicy(max_retries=0), _no_sleep)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert breaker.state == CLOSED
+
+def test_slots_are_given_up_while_backing_off():
+    mock = MockUpstream(latency=0, error_status=429, fail_first=2)
+    breaker = CircuitBreaker("text-davinci-003", failure_threshold=5)
+    held, during_sleep = [], []
+
+    @contextlib.asynccontextmanager
+    async def slot():
+        held.append(1)
+        try:
+            yield
+        finally:
+            held.pop()
+
+    async def record_sleep(delay):
+        during_sleep.append(len(held))
+
+    response = asyncio.run(_against_mock(
+        mock, lambda call: call_with_resilience(call, breaker, RetryPolicy(max_retries=3), record_sleep, slot=slot)
+    ))
+    assert response["choices"][0]["text"]
+    assert during_sleep == [0, 0] and held == []
@@ -0,0 +1,25 @@
+import json
+from datetime import datetime
+import pytest
+from models import CreateRequestResponse
+from utils import responses
+from utils.responses import FastJSONResponse, dumps
+
+@pytest.fixture(params=["orjson", "fallback"])
+def encoder(request, monkeypatch):
+    if request.param == "fallback":
+        monkeypatch.setattr(responses, "orjson", None)
+    elif responses.orjson is None:
+        pytest.skip("orjson is not installed")
+    return request.param
+
+def test_dumps_encodes_models_and_datetimes(encoder):
+    body = {"items": [{"id": 1, "created_at": datetime(2024, 1, 1, 12, 0)}], "next_cursor": None, "note": "café"}
+    assert json.loads(dumps(body)) == {"items": [{"id": 1, "created_at": "2024-01-01T12:00:00"}], "next_cursor": None, "note": "café"}
+    assert json.loads(dumps(CreateRequestResponse(request_id=3))) == {"message": "Request created successfully!", "request_id": 3}
+
+def test_fast_json_response_renders_compact_json(encoder):
+    response = FastJSONResponse(CreateRequestResponse(request_id=None), status_code=201)
+    assert response.status_code == 201
+    assert response.body == b'{"message":"Request created successfully!","request_id":null}'
+    assert response.headers["content-type"] == "application/json"
@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from utils.scheduler import RequestClass, Scheduler, parse_request_classes, set_request_class
+
+CLASSES = {
+    "interactive": RequestClass("interactive", weight=8, deadline=5),
+    "batch": RequestClass("batch", weight=1),
+}
+
+def test_parse_request_classes():
+    classes = parse_request_classes('{"interactive": {"weight": 4, "deadline": 10}, "batch": {}}')
+    assert classes["interactive"] == RequestClass("interactive", 4.0, 10.0)
+    assert classes["batch"] == RequestClass("batch", 1.0, 0.0)
+    with pytest.raises(ValueError):
+        parse_request_classes('{"batch": {"weight": 0}}')
+    with pytest.raises(ValueError):
+        parse_request_classes("[1, 2]")
+
+def test_global_cap_limits_concurrent_calls():
+    async def scenario():
+        scheduler = Scheduler(2, CLASSES, "interactive")
+        peak = 0
+
+        async def call():
+            nonlocal peak
+            async with scheduler.slot("batch"):
+                peak = max(peak, scheduler.inflight)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(call() for _ in range(6)))
+        return peak, scheduler.inflight, scheduler.queued()
+
+    assert asyncio.run(scenario()) == (2, 0, 0)
+
+def test_interactive_calls_overtake_a_batch_backlog():
+    async def scenario():
+        scheduler = Scheduler(1, CLASSES, "interactive")
+        order = []
+
+        async def call(name, label):
+            async with scheduler.slot(name):
+                order.append(label)
+                await asyncio.sleep(0.001)
+
+        tasks = [asyncio.ensure_future(call("batch", f"b{i}")) for i in range(6)]
+        await asyncio.sleep(0)
+        # Arriving after the whole batch backlog, in the context of an interactive request
+        set_request_class("interactive")
+        tasks += [asyncio.ensure_future(call(None, f"i{i}")) for i in range(2)]
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(scenario())
+    # b0 took the free slot; both interactive calls run before the rest of the batch
+    assert order[:3] == ["b0", "i0", "i1"]
+
+def test_projected_wait_beyond_deadline_is_rejected_with_queue_position():
+    async def scenario():
+        scheduler = Scheduler(1, CLASSES, "interactive")
+        scheduler.service_time = 2.0
+        async with scheduler.slot("batch"):
+            queued = asyncio.ensure_future(scheduler.acquire(CLASSES["batch"], None))
+            await asyncio.sleep(0)
+            with pytest.raises(HTTPException) as rejected:
+                await scheduler.acquire(CLASSES["batch"], 3.0)
+            queued.cancel()
+            await asyncio.gather(queued, return_exceptions=True)
+        return rejected.value, scheduler.queued(), scheduler.inflight
+
+    error, queued, inflight = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert error.detail["queue_position"] == 2 and error.detail["projected_wait"] == 4.0
+    assert error.headers["Retry-After"] == "4"
+    assert queued == 0 and inflight == 0
+
+def test_call_still_queued_at_its_deadline_is_rejected():
+    async def scenario():
+        scheduler = Scheduler(1, CLASSES, "interactive")
+        async with scheduler.slot("batch"):
+            with pytest.raises(HTTPException) as rejected:
+                async with scheduler.slot("interactive", deadline=0.02):
+                    pass
+            queued = scheduler.queued()
+        return rejected.value.status_code, queued, scheduler.inflight
+
+    assert asyncio.run(scenario()) == (503, 0, 0)
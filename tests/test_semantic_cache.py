@@ -0,0 +1,119 @@
+import asyncio
+import numpy as np
+import pytest
+from utils.cache import LRUCache, ResponseCache
+from utils.openai import OpenAIUtils
+from utils.semantic_cache import HashingEmbedder, SemanticCache, VectorIndex, load_embedder
+from unittest.mock import AsyncMock, MagicMock
+
+PARAMETERS = {"temperature": 0}
+
+@pytest.fixture
+def semantic_cache():
+    return SemanticCache(HashingEmbedder(64), threshold=0.9, max_entries=3)
+
+def test_hashing_embedder_is_deterministic_and_normalized():
+    embedder = HashingEmbedder(128)
+    vector = embedder.embed("What is the capital of France?")
+    assert vector.shape == (128,) and np.linalg.norm(vector) == pytest.approx(1.0, abs=1e-6)
+    assert np.array_equal(vector, embedder.embed("what is the capital of   france"))
+    assert vector @ embedder.embed("Write a poem about dogs") < 0.5
+    assert isinstance(load_embedder("hashing", 32), HashingEmbedder)
+    with pytest.raises(ValueError):
+        load_embedder("not-a-factory", 32)
+
+def test_similar_prompts_hit_within_model_and_parameters(semantic_cache):
+    semantic_cache.set("gpt-3.5-turbo", "What is the capital of France?", PARAMETERS, "Paris")
+    assert semantic_cache.get("gpt-3.5-turbo", "what is the capital of france", PARAMETERS) == "Paris"
+    assert semantic_cache.get("gpt-3.5-turbo", "What is the capital of Spain?", PARAMETERS) is None
+    assert semantic_cache.get("gpt-3.5-turbo", "What is the capital of France?", {"temperature": 0, "max_tokens": 5}) is None
+    assert semantic_cache.get("text-davinci-003", "What is the capital of France?", PARAMETERS) is None
+
+def test_index_is_bounded_and_evicts_least_recently_used(semantic_cache):
+    for prompt in ["alpha one", "bravo two", "charlie three"]:
+        semantic_cache.set("gpt-3.5-turbo", prompt, PARAMETERS, prompt.upper())
+    assert semantic_cache.get("gpt-3.5-turbo", "alpha one", PARAMETERS) == "ALPHA ONE"
+    semantic_cache.set("gpt-3.5-turbo", "delta four", PARAMETERS, "DELTA FOUR")
+    index = semantic_cache.indexes["gpt-3.5-turbo"]
+    assert len(index) == 3 and index.vectors.shape == (3, 64)
+    assert semantic_cache.get("gpt-3.5-turbo", "bravo two", PARAMETERS) is None
+    assert semantic_cache.get("gpt-3.5-turbo", "alpha one", PARAMETERS) == "ALPHA ONE"
+
+def test_ivf_search_finds_the_nearest_neighbour():
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(3000, 32)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = VectorIndex(32, capacity=3000, nprobe=8, train_size=1000)
+    for position, vector in enumerate(vectors):
+        index.add(vector, 0, position, ttl=60)
+    assert index.centroids is None and index.needs_training
+    index.train()
+    assert index.centroids is not None and index.trained_size == 3000 and not index.needs_training
+    found = [index.search(vectors[position], 0)[0] for position in range(0, 3000, 100)]
+    assert found == list(range(0, 3000, 100))
+
+def test_a_full_index_is_retrained_as_its_rows_are_recycled():
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(1600, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = VectorIndex(16, capacity=1000, train_size=500)
+    for position, vector in enumerate(vectors[:1000]):
+        index.add(vector, 0, position, ttl=60)
+    index.train()
+    # The index cannot grow any more; replacing half of it still calls for new centroids
+    for position, vector in enumerate(vectors[1000:1499]):
+        index.add(vector, 0, position, ttl=60)
+    assert not index.needs_training
+    index.add(vectors[1499], 0, 1499, ttl=60)
+    assert index.needs_training
+
+def test_async_lookups_and_retraining_run_off_the_event_loop():
+    import threading
+
+    class RecordingEmbedder(HashingEmbedder):
+        def embed(self, text):
+            threads.add(threading.current_thread().name)
+            return super().embed(text)
+
+    threads = set()
+    cache = SemanticCache(RecordingEmbedder(64), threshold=0.9, max_entries=64, train_size=16)
+
+    async def scenario():
+        for position in range(16):
+            await cache.set_async("gpt-3.5-turbo", f"question number {position}", PARAMETERS, position)
+        hit = await cache.get_async("gpt-3.5-turbo", "Question number 3?", PARAMETERS)
+        await asyncio.gather(*cache._tasks)
+        return hit
+
+    assert asyncio.run(scenario()) == 3
+    assert threads == {"semantic-cache_0"}
+    index = cache.indexes["gpt-3.5-turbo"]
+    assert index.centroids is not None and index.trained_size == 16 and not index.needs_training
+
+def test_snapshot_round_trip(semantic_cache, tmp_path):
+    semantic_cache.set("gpt-3.5-turbo", "What is the capital of France?", PARAMETERS, "Paris")
+    semantic_cache.set("text-davinci-003", "Say hello", PARAMETERS, {"text": "Hello"})
+    path = str(tmp_path / "semantic.npz")
+    semantic_cache.save(path)
+
+    restored = SemanticCache(HashingEmbedder(64), threshold=0.9, max_entries=3)
+    assert restored.load(path) == 2
+    assert restored.get("gpt-3.5-turbo", "what is the capital of France", PARAMETERS) == "Paris"
+    assert restored.get("text-davinci-003", "Say hello!", PARAMETERS) == {"text": "Hello"}
+    assert SemanticCache(HashingEmbedder(32)).load(path) == 0
+
+def test_get_response_falls_back_to_semantic_cache(semantic_cache):
+    utils = MagicMock(spec=OpenAIUtils)
+    utils.cache = ResponseCache(LRUCache(max_entries=8, ttl=60), None)
+    utils.semantic_cache = semantic_cache
+    utils.singleflight = None
+    utils.make_request = AsyncMock(return_value="Paris")
+    utils.fetch = OpenAIUtils.fetch.__get__(utils)
+    utils.get_response = OpenAIUtils.get_response.__get__(utils)
+
+    assert asyncio.run(utils.get_response("gpt-3.5-turbo", "What is the capital of France?", PARAMETERS)) == "Paris"
+    assert asyncio.run(utils.get_response("gpt-3.5-turbo", "what is the capital of france", PARAMETERS)) == "Paris"
+    utils.make_request.assert_awaited_once()
+    # Non-deterministic requests never reach either cache
+    asyncio.run(utils.get_response("gpt-3.5-turbo", "what is the capital of france", {"temperature": 0.7}))
+    assert utils.make_request.await_count == 2
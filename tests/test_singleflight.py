@@ -0,0 +1,69 @@
+import asyncio
+from utils.singleflight import SingleFlight
+
+async def _herd(singleflight, keys, fn):
+    return await asyncio.gather(*(singleflight.do(key, fn) for key in keys), return_exceptions=True)
+
+def test_concurrent_identical_calls_share_one_execution():
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "Hello, world!"
+
+    singleflight = SingleFlight()
+    results = asyncio.run(_herd(singleflight, ["same"] * 50, upstream))
+    assert results == ["Hello, world!"] * 50
+    assert len(calls) == 1
+    assert len(singleflight) == 0
+
+def test_distinct_keys_are_not_coalesced():
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    asyncio.run(_herd(SingleFlight(), ["a", "b", "a", "b"], upstream))
+    assert len(calls) == 2
+
+def test_every_waiter_receives_the_error():
+    async def upstream():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    results = asyncio.run(_herd(SingleFlight(), ["same"] * 5, upstream))
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+def test_cancelled_waiter_does_not_cancel_shared_call():
+    async def scenario():
+        singleflight = SingleFlight()
+
+        async def upstream():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        first = asyncio.ensure_future(singleflight.do("same", upstream))
+        second = asyncio.ensure_future(singleflight.do("same", upstream))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == "done"
+
+def test_sequential_calls_start_fresh_executions():
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        return "ok"
+
+    async def scenario():
+        singleflight = SingleFlight()
+        await singleflight.do("same", upstream)
+        await singleflight.do("same", upstream)
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import threading
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from utils import storage
+from utils.db import Base, Request, User, bulk_create_requests_async, create_request_async, get_request_history_async, get_user_request_async
+from utils.storage import BlobStore, PayloadCodec, train_dictionary
+
+PROMPT = "Summarize the following support ticket in two sentences. " * 20
+RESPONSE = {"choices": [{"text": "The customer reports that the export fails. " * 30}]}
+
+@pytest.fixture
+def codec(tmp_path):
+    previous = storage.payload_codec
+    codec = PayloadCodec("zlib", min_size=64, offload_threshold=4096, blob_store=BlobStore(str(tmp_path / "blobs")))
+    storage.set_payload_codec(codec)
+    yield codec
+    storage.set_payload_codec(previous)
+
+@pytest.fixture
+def session_factory():
+    engine = create_async_engine("sqlite+aiosqlite://")
+
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(create_tables())
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+@pytest.mark.parametrize("value", ["short", "\x1estarts with the marker", PROMPT, "x" * 10000])
+def test_text_round_trip(codec, value):
+    assert codec.decode_text(codec.encode_text(value)) == value
+
+@pytest.mark.parametrize("value", ["short", RESPONSE, {"big": "y" * 10000}, [1, 2, 3], "\x1er:looks encoded"])
+def test_json_round_trip(codec, value):
+    assert codec.decode_json(codec.encode_json(value)) == value
+
+def test_large_payloads_are_offloaded_once(codec, tmp_path):
+    payload = "z" * 10000
+    first, second = codec.encode_text(payload), codec.encode_text(payload)
+    assert first == second and first.startswith("\x1eb:")
+    blobs = [name for _, _, files in os.walk(tmp_path / "blobs") for name in files]
+    assert len(blobs) == 1
+
+def test_rows_stay_readable_after_codec_changes(codec, tmp_path):
+    dictionary = train_dictionary([PROMPT.encode()] * 5)
+    with_dictionary = PayloadCodec("zlib", dictionary, min_size=64, blob_store=codec.blob_store)
+    encoded = with_dictionary.encode_text(PROMPT)
+    assert len(encoded) < len(codec.encode_text(PROMPT))
+    # A codec without the dictionary (or compression) finds it in the blob store
+    assert PayloadCodec("none", blob_store=codec.blob_store).decode_text(encoded) == PROMPT
+    assert PayloadCodec("none").decode_text("plain rows are untouched") == "plain rows are untouched"
+
+def test_zstd_codec_round_trip(tmp_path):
+    pytest.importorskip("zstandard")
+    codec = PayloadCodec("zstd", min_size=64)
+    encoded = codec.encode_json(RESPONSE)
+    assert encoded.startswith("\x1ez:zstd:") and codec.decode_json(encoded) == RESPONSE
+
+def test_request_columns_are_encoded_transparently(codec, session_factory):
+    async def scenario():
+        async with session_factory() as db:
+            user = User(username="testuser", email="test@example.com", hashed_password="hashed_password")
+            db.add(user)
+            await db.commit()
+            await bulk_create_requests_async(db, [
+                {"model": "gpt-3.5-turbo", "prompt": PROMPT, "parameters": {}, "response": RESPONSE, "user_id": user.id},
+            ])
+            stored = (await db.execute(text("SELECT prompt, response FROM requests"))).one()
+            request = (await db.scalars(select(Request))).one()
+            history, _ = await get_request_history_async(db, user.id, include=["response"])
+            return stored, request, history
+
+    stored, request, history = asyncio.run(scenario())
+    assert stored.prompt.startswith("\x1ez:zlib:") and len(stored.prompt) < len(PROMPT)
+    assert request.prompt == PROMPT and request.response == RESPONSE
+    assert history[0]["prompt"] == PROMPT and history[0]["response"] == RESPONSE
+
+def test_blob_io_stays_off_the_event_loop(codec, session_factory, monkeypatch):
+    blob_threads = []
+    for name in ("put", "get"):
+        method = getattr(BlobStore, name)
+
+        def recording(self, *args, _method=method):
+            blob_threads.append(threading.current_thread() is threading.main_thread())
+            return _method(self, *args)
+
+        monkeypatch.setattr(BlobStore, name, recording)
+    large_prompt, large_response = "p" * 10000, {"choices": [{"text": "r" * 10000}]}
+
+    async def scenario():
+        async with session_factory() as db:
+            user = User(username="testuser", email="test@example.com", hashed_password="hashed_password")
+            db.add(user)
+            await db.commit()
+            created = await create_request_async(db, "gpt-3.5-turbo", large_prompt, {}, large_response, user.id)
+        async with session_factory() as db:
+            loaded = await get_user_request_async(db, created.id, user.id)
+            history, _ = await get_request_history_async(db, user.id, include=["response"])
+        return created, loaded, history
+
+    created, loaded, history = asyncio.run(scenario())
+    assert created.prompt == loaded.prompt == history[0]["prompt"] == large_prompt
+    assert loaded.response == history[0]["response"] == large_response
+    # Two blobs written and read back twice, none of it on the event loop's thread
+    assert len(blob_threads) == 6 and not any(blob_threads)
@@ -0,0 +1,136 @@
+import asyncio
+import pytest
+from fastapi import APIRouter, Depends, FastAPI, Request
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+from utils.timing import (
+    REQUEST_STAGE_LATENCY, RequestTimings, TimedRoute, add_span_hook, begin_request, current_timings,
+    end_request, remove_span_hook, set_model, stage,
+)
+
+class Item(BaseModel):
+    model: str
+    prompt: str
+
+@pytest.fixture
+def spans():
+    collected = []
+    add_span_hook(collected.append)
+    yield collected
+    remove_span_hook(collected.append)
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    router = APIRouter(prefix="/items", route_class=TimedRoute)
+
+    async def authenticate():
+        with stage("auth"):
+            await asyncio.sleep(0.01)
+            return 1
+
+    @router.post("/create")
+    async def create(item: Item, user_id: int = Depends(authenticate)):
+        set_model(item.model)
+        with stage("upstream"):
+            await asyncio.sleep(0.02)
+        with stage("db"):
+            pass
+        return {"ok": True}
+
+    @app.middleware("http")
+    async def timing_middleware(request: Request, call_next):
+        timings, token = begin_request()
+        try:
+            response = await call_next(request)
+        finally:
+            end_request(token)
+        response.headers["Server-Timing"] = timings.server_timing()
+        timings.finish(response.status_code)
+        return response
+
+    app.include_router(router)
+    return TestClient(app)
+
+def _count(stage_name, route, model, status):
+    labels = {"stage": stage_name, "route": route, "model": model, "status": status}
+    for sample in REQUEST_STAGE_LATENCY.collect()[0].samples:
+        if sample.name.endswith("_count") and sample.labels == labels:
+            return sample.value
+    return 0
+
+def test_stage_records_into_current_request():
+    async def run():
+        timings, token = begin_request()
+        try:
+            with stage("cache"):
+                await asyncio.sleep(0.005)
+            with stage("cache"):
+                pass
+        finally:
+            end_request(token)
+        return timings
+
+    timings = asyncio.run(run())
+    assert timings.durations["cache"] >= 0.005
+    assert current_timings() is None
+
+def test_stage_outside_a_request_is_a_no_op():
+    with stage("db"):
+        pass
+    assert current_timings() is None
+
+def test_server_timing_header_format():
+    timings = RequestTimings()
+    timings.add("auth", 0.0015)
+    timings.add("upstream", 0.25)
+    header = timings.server_timing()
+    assert header.startswith("auth;dur=1.50, upstream;dur=250.00, total;dur=")
+
+def test_timed_route_records_stages_and_histograms(client, spans):
+    before = _count("upstream", "/items/create", "gpt-3.5-turbo", "200")
+    response = client.post("/items/create", json={"model": "gpt-3.5-turbo", "prompt": "Hello"})
+    assert response.status_code == 200
+
+    stages = [metric.split(";")[0] for metric in response.headers["Server-Timing"].split(", ")]
+    assert stages == ["auth", "validation", "upstream", "db", "total"]
+    assert _count("upstream", "/items/create", "gpt-3.5-turbo", "200") == before + 1
+
+    names = [span.name for span in spans]
+    assert names == ["auth", "validation", "upstream", "db", "request"]
+    assert len({span.trace_id for span in spans}) == 1
+    request_span = spans[-1]
+    assert request_span.attributes == {"route": "/items/create", "model": "gpt-3.5-turbo", "status": 200}
+    upstream_span = spans[2]
+    assert upstream_span.duration >= 0.02
+    assert request_span.start_time_ns <= upstream_span.start_time_ns <= upstream_span.end_time_ns <= request_span.end_time_ns
+
+def test_validation_excludes_auth_time(client):
+    response = client.post("/items/create", json={"model": "gpt-3.5-turbo", "prompt": "Hello"})
+    metrics = dict(metric.split(";dur=") for metric in response.headers["Server-Timing"].split(", "))
+    assert float(metrics["auth"]) >= 10
+    assert float(metrics["validation"]) < float(metrics["auth"])
+
+def test_failing_span_hook_does_not_break_requests(client):
+    def broken(span):
+        raise RuntimeError("exporter down")
+
+    add_span_hook(broken)
+    try:
+        response = client.post("/items/create", json={"model": "gpt-3.5-turbo", "prompt": "Hello"})
+    finally:
+        remove_span_hook(broken)
+    assert response.status_code == 200
+
+def test_stage_span_carries_error(spans):
+    async def run():
+        _, token = begin_request()
+        try:
+            with stage("upstream"):
+                raise ValueError("boom")
+        finally:
+            end_request(token)
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+    assert isinstance(spans[0].error, ValueError)
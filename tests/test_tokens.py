@@ -0,0 +1,114 @@
+import asyncio
+import base64
+import threading
+import pytest
+from fastapi import HTTPException
+from models.request_schema import RequestSchema
+from utils import tokens
+from utils.tokens import (
+    ApproximateTokenizer, BPETokenizer, TokenCounter, load_tokenizer, preflight, preflight_async, record_upstream_usage,
+    settle_usage, track_usage, MAX_PIECE_BYTES, PROMPT_OVERHEAD,
+)
+
+# A tiny encoding: every byte of "helo wrd" plus a few merges, lowest rank first
+RANKS = [b"h", b"e", b"l", b"o", b" ", b"w", b"r", b"d", b"he", b"ll", b"hell", b"hello", b" w", b" wo"]
+
+def _write_ranks(directory, name="tiny"):
+    lines = "".join(f"{base64.b64encode(token).decode()} {rank}\n" for rank, token in enumerate(RANKS))
+    (directory / f"{name}.tiktoken").write_text(lines)
+
+def test_bpe_tokenizer_merges_by_rank(tmp_path):
+    _write_ranks(tmp_path)
+    tokenizer = load_tokenizer("tiny", str(tmp_path))
+    assert isinstance(tokenizer, BPETokenizer)
+    # "hello" is one token; " world" merges to " wo" + "r" + "l" + "d"
+    assert tokenizer.count("hello") == 1
+    assert tokenizer.count(" world") == 4
+    assert tokenizer.count_batch(["hello world", "hell"]) == [5, 1]
+    # Repeated pieces are merged once
+    assert tokenizer.piece_tokens.cache_info().hits > 0
+
+def test_missing_encoding_falls_back_to_the_approximation(tmp_path):
+    tokenizer = load_tokenizer("tiny", str(tmp_path))
+    assert isinstance(tokenizer, ApproximateTokenizer)
+    assert tokenizer.count("Hello, world!") == 4
+    assert tokenizer.count("internationalization") == 5
+
+def test_token_counter_memoizes_and_batches_distinct_misses():
+    class CountingTokenizer(ApproximateTokenizer):
+        calls = []
+
+        def count_batch(self, texts):
+            self.calls.append(list(texts))
+            return super().count_batch(texts)
+
+    counter = TokenCounter(cache_size=100)
+    counter.tokenizers["cl100k_base"] = CountingTokenizer()
+    assert counter.count_batch(["a b", "c", "a b"], "cl100k_base") == [2, 1, 2]
+    assert counter.count_batch(["c", "d e f"], "cl100k_base") == [1, 3]
+    assert CountingTokenizer.calls == [["a b", "c"], ["d e f"]]
+
+class ExactTokenizer(ApproximateTokenizer):
+    """Stands in for tiktoken: the approximation's counts, marked exact."""
+    exact = True
+
+def test_preflight_rejects_requests_over_the_context_window(monkeypatch):
+    chat = RequestSchema(model="gpt-3.5-turbo", prompt="Hello there", parameters={"max_tokens": 100})
+    counts = preflight([chat])
+    assert counts[0] > PROMPT_OVERHEAD["chat"]
+
+    fits = RequestSchema(model="text-davinci-003", prompt="Hello", parameters={"max_tokens": 4000})
+    too_long = RequestSchema(model="text-davinci-003", prompt="Hello", parameters={"max_tokens": 4097})
+    # Approximate counts pass the request on for upstream to judge
+    monkeypatch.setattr(tokens.token_counter, "tokenizers", {})
+    monkeypatch.setattr(tokens, "load_tokenizer", lambda encoding, bpe_dir=None: ApproximateTokenizer())
+    assert len(preflight([fits, too_long])) == 2
+
+    monkeypatch.setattr(tokens.token_counter, "tokenizers", {})
+    monkeypatch.setattr(tokens, "load_tokenizer", lambda encoding, bpe_dir=None: ExactTokenizer())
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(preflight_async([fits, too_long]))
+    assert rejected.value.status_code == 400
+    assert rejected.value.detail.startswith("Item 1: ") and "context window of 4097 tokens" in rejected.value.detail
+
+def test_long_pieces_are_merged_in_chunks(tmp_path):
+    _write_ranks(tmp_path)
+    tokenizer = load_tokenizer("tiny", str(tmp_path))
+    # One pre-tokenized piece of 100 KB: merged MAX_PIECE_BYTES at a time, costing at most a
+    # couple of extra tokens per chunk where a chunk boundary splits a word
+    chunks = -(-100000 // MAX_PIECE_BYTES)
+    assert 20000 <= tokenizer.count("hello" * 20000) <= 20000 + 2 * chunks
+
+def test_large_batches_are_counted_off_the_event_loop(monkeypatch):
+    threads = []
+
+    class RecordingTokenizer(ApproximateTokenizer):
+        def count_batch(self, texts):
+            threads.append(threading.current_thread() is threading.main_thread())
+            return super().count_batch(texts)
+
+    counter = TokenCounter(cache_size=100)
+    counter.tokenizers["cl100k_base"] = RecordingTokenizer()
+    large_prompt = "word " * (tokens.THREAD_COUNT_THRESHOLD // 5 + 1)
+    small = asyncio.run(counter.count_batch_async(["a b"], "cl100k_base"))
+    large = asyncio.run(counter.count_batch_async([large_prompt], "cl100k_base"))
+    assert small == [2] and large == [ApproximateTokenizer().count(large_prompt)]
+    assert threads == [True, False]
+
+def test_settle_usage_prefers_upstream_counts_and_charges_only_upstream_calls():
+    usage = track_usage()
+    record_upstream_usage({"prompt_tokens": 12, "completion_tokens": 30})
+    assert settle_usage(usage, "text-davinci-003", 10, "ignored") == {
+        "prompt_tokens": 12, "completion_tokens": 30, "cost": pytest.approx(42 * 0.02 / 1000),
+    }
+
+    # A cache hit never reaches upstream: local counts, no cost
+    cached = track_usage()
+    assert settle_usage(cached, "text-davinci-003", 10, "Hello world") == {"prompt_tokens": 10, "completion_tokens": 2, "cost": 0.0}
+
+    # A stream reaches upstream without a usage object
+    streamed = track_usage()
+    record_upstream_usage()
+    accounting = settle_usage(streamed, "gpt-3.5-turbo", 1000, "Hello world")
+    assert accounting["completion_tokens"] == 2
+    assert accounting["cost"] == pytest.approx((1000 * 0.0005 + 2 * 0.0015) / 1000)
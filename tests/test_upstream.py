@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+from benchmarks.mock_upstream import MockUpstream, start_mock_upstream
+from utils.upstream import UpstreamClient, UpstreamError, parse_retry_after
+
+async def _with_mock(scenario, mock=None):
+    mock = mock or MockUpstream(latency=0)
+    runner, base_url = await start_mock_upstream(mock)
+    client = UpstreamClient(base_url, api_key="test-key", pool_size=4)
+    await client.start()
+    try:
+        return await scenario(client, mock)
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+def test_post_json_reuses_pooled_session():
+    async def scenario(client, mock):
+        session = client.session
+        responses = [await client.post_json("/completions", {"model": "text-davinci-003", "prompt": "Hello"}) for _ in range(3)]
+        assert client.session is session
+        return responses, mock.calls
+
+    responses, calls = asyncio.run(_with_mock(scenario))
+    assert responses[0]["choices"][0]["text"] == "Echo: Hello"
+    assert calls == 3
+
+def test_post_json_raises_upstream_error_with_status_and_retry_after():
+    async def scenario(client, mock):
+        with pytest.raises(UpstreamError) as e:
+            await client.post_json("/completions", {"model": "text-davinci-003", "prompt": "Hello"})
+        return e.value
+
+    error = asyncio.run(_with_mock(scenario, MockUpstream(latency=0, error_status=429, retry_after=2, fail_first=1)))
+    assert error.status == 429
+    assert error.retry_after == 2.0
+    assert "Injected upstream fault" in str(error)
+
+def test_connection_error_is_wrapped():
+    async def scenario():
+        client = UpstreamClient("http://127.0.0.1:9/v1", connect_timeout=1)
+        try:
+            with pytest.raises(UpstreamError) as e:
+                await client.post_json("/completions", {})
+        finally:
+            await client.close()
+        return e.value
+
+    assert asyncio.run(scenario()).status is None
+
+@pytest.mark.parametrize("value, expected", [("3", 3.0), ("0.5", 0.5), (None, None), ("Wed, 21 Oct 2015 07:28:00 GMT", None)])
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value) == expected
+
+def test_stream_events_yields_fragments_until_done():
+    async def scenario(client, mock):
+        return [event["choices"][0]["text"] async for event in client.stream_events("/completions", {"model": "text-davinci-003", "prompt": "Hello world"})]
+
+    fragments = asyncio.run(_with_mock(scenario, MockUpstream(latency=0, token_latency=0)))
+    assert "".join(fragments) == "Echo: Hello world"
+    assert len(fragments) == 3
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import pytest
+from benchmarks.mock_upstream import MockUpstream, start_mock_upstream
+from utils.upstream import UpstreamClient, UpstreamError
+from utils.upstream_pool import PoolMember, UpstreamPool, parse_upstreams
+
+PAYLOAD = {"model": "text-davinci-003", "prompt": "Hello"}
+
+async def _with_pool(scenario, mocks, **options):
+    started = [await start_mock_upstream(mock) for mock in mocks]
+    pool = UpstreamPool(
+        [PoolMember(f"mock{index}", UpstreamClient(base_url, api_key=f"key-{index}")) for index, (_, base_url) in enumerate(started)],
+        **options,
+    )
+    await pool.start()
+    try:
+        return await scenario(pool)
+    finally:
+        await pool.close()
+        for runner, _ in started:
+            await runner.cleanup()
+
+def test_least_outstanding_prefers_the_faster_upstream():
+    fast, slow = MockUpstream(latency=0.01, token_latency=0), MockUpstream(latency=0.1, token_latency=0)
+
+    async def scenario(pool):
+        async def client():
+            for _ in range(10):
+                await pool.post_json("/completions", PAYLOAD)
+
+        # Closed-loop clients: whoever answers sooner frees up sooner and gets the next call
+        await asyncio.gather(*(client() for _ in range(4)))
+        return [member.outstanding for member in pool.members]
+
+    outstanding = asyncio.run(_with_pool(scenario, [fast, slow]))
+    assert outstanding == [0, 0]
+    assert fast.calls > 2 * slow.calls
+
+def test_throttled_key_is_cooled_down_and_calls_fail_over():
+    throttled, healthy = MockUpstream(latency=0, error_status=429, retry_after=30, fail_first=100), MockUpstream(latency=0)
+
+    async def scenario(pool):
+        responses = [await pool.post_json("/completions", PAYLOAD) for _ in range(5)]
+        return responses, pool.members[0].cooldown_until > 0
+
+    responses, cooled = asyncio.run(_with_pool(scenario, [throttled, healthy]))
+    assert [response["choices"][0]["text"] for response in responses] == ["Echo: Hello"] * 5
+    assert cooled and throttled.calls <= 1 and healthy.calls == 5
+
+def test_failing_upstream_is_ejected():
+    failing, healthy = MockUpstream(latency=0, error_status=500, error_rate=1.0), MockUpstream(latency=0)
+
+    async def scenario(pool):
+        # Failures leave its latency estimate at zero, so it keeps winning ties until it is ejected
+        for _ in range(20):
+            await pool.post_json("/completions", PAYLOAD)
+        return pool.members[0].ejected_until > 0
+
+    ejected = asyncio.run(_with_pool(scenario, [failing, healthy], eject_threshold=3))
+    assert ejected
+    assert failing.calls == 3 and healthy.calls == 20
+
+def test_pool_reports_when_no_upstream_is_available():
+    mocks = [MockUpstream(latency=0, error_status=429, retry_after=5, fail_first=100) for _ in range(2)]
+
+    async def scenario(pool):
+        with pytest.raises(UpstreamError) as first:
+            await pool.post_json("/completions", PAYLOAD)
+        with pytest.raises(UpstreamError) as second:
+            await pool.post_json("/completions", PAYLOAD)
+        return first.value, second.value
+
+    first, second = asyncio.run(_with_pool(scenario, mocks))
+    assert first.status == 429
+    assert second.status == 503 and 0 < second.retry_after <= 5
+
+def test_stream_fails_over_before_the_first_event():
+    throttled, healthy = MockUpstream(latency=0, error_status=429, fail_first=100), MockUpstream(latency=0, token_latency=0)
+
+    async def scenario(pool):
+        pool.members[0].latency = -1  # Make sure the throttled member is tried first
+        return [event["choices"][0]["text"] async for event in pool.stream_events("/completions", PAYLOAD)]
+
+    fragments = asyncio.run(_with_pool(scenario, [throttled, healthy]))
+    assert "".join(fragments) == "Echo: Hello"
+    assert throttled.calls == 1
+
+def test_cancelled_call_releases_its_member():
+    async def scenario(pool):
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(pool.post_json("/completions", PAYLOAD), 0.05)
+        return pool.members[0].outstanding, pool.members[0].failures
+
+    assert asyncio.run(_with_pool(scenario, [MockUpstream(latency=1)])) == (0, 0)
+
+def test_parse_upstreams(monkeypatch):
+    monkeypatch.setenv("BACKUP_KEY", "sk-backup")
+    members = parse_upstreams(
+        json.dumps([{"weight": 2}, {"base_url": "https://backup.example.com/v1", "api_key_env": "BACKUP_KEY", "name": "backup"}]),
+        None, "https://api.openai.com/v1", "sk-default",
+    )
+    assert members == [
+        {"name": "api.openai.com#0", "base_url": "https://api.openai.com/v1", "api_key": "sk-default", "weight": 2.0},
+        {"name": "backup", "base_url": "https://backup.example.com/v1", "api_key": "sk-backup", "weight": 1.0},
+    ]
+    keys = parse_upstreams(None, "sk-a, sk-b", "https://api.openai.com/v1", None)
+    assert [member["api_key"] for member in keys] == ["sk-a", "sk-b"]
+    assert parse_upstreams(None, None, "https://api.openai.com/v1", "sk-default") == []
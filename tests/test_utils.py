@@ -1,8 +1,10 @@
+import asyncio
+from datetime import timedelta
 import pytest
-from utils.auth import create_access_token, get_current_user
+from utils.auth import create_access_token, get_current_user, clear_auth_caches, invalidate_user
 from utils.db import Session, get_db, User, create_user
 from models.user_schema import UserSchema
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 import bcrypt
 
 @pytest.fixture
@@ -26,25 +28,44 @@ def test_create_access_token(test_user):
     assert token.split(".")
 
 def test_get_current_user(test_user, mock_db):
+    clear_auth_caches()
+    test_user.id = 1
     token = create_access_token(data={"sub": test_user.id})
-    with patch('utils.auth.get_db', return_value=mock_db):
-        mock_db.query.filter.first.return_value = test_user
-        user = get_current_user(token=token)
-        assert user.id == test_user.id
+    mock_db.get = AsyncMock(return_value=test_user)
+    user = asyncio.run(get_current_user(token=token, db=mock_db))
+    assert user.id == test_user.id
+    assert user.username == test_user.username
+
+def test_get_current_user_is_cached_until_invalidated(test_user, mock_db):
+    clear_auth_caches()
+    test_user.id = 1
+    token = create_access_token(data={"sub": test_user.id})
+    mock_db.get = AsyncMock(return_value=test_user)
+    for _ in range(3):
+        asyncio.run(get_current_user(token=token, db=mock_db))
+    mock_db.get.assert_awaited_once()
+
+    invalidate_user(test_user.id)
+    asyncio.run(get_current_user(token=token, db=mock_db))
+    assert mock_db.get.await_count == 2
 
 def test_get_current_user_invalid_token(mock_db):
     token = "invalid_token"
-    with patch('utils.auth.get_db', return_value=mock_db):
-        with pytest.raises(Exception) as e:
-            get_current_user(token=token)
-        assert "Invalid token" in str(e.value)
+    with pytest.raises(Exception) as e:
+        asyncio.run(get_current_user(token=token, db=mock_db))
+    assert "Invalid token" in str(e.value.detail)
+
+def test_get_current_user_rejects_a_non_numeric_subject(mock_db):
+    token = create_access_token(data={"sub": "admin"})
+    with pytest.raises(Exception) as e:
+        asyncio.run(get_current_user(token=token, db=mock_db))
+    assert e.value.status_code == 401 and "Invalid token" in str(e.value.detail)
 
 def test_get_current_user_expired_token(mock_db):
     token = create_access_token(data={"sub": 1}, expires_delta=timedelta(seconds=-1))
-    with patch('utils.auth.get_db', return_value=mock_db):
-        with pytest.raises(Exception) as e:
-            get_current_user(token=token)
-        assert "Token expired" in str(e.value)
+    with pytest.raises(Exception) as e:
+        asyncio.run(get_current_user(token=token, db=mock_db))
+    assert "Token expired" in str(e.value.detail)
 
 def test_create_user(mock_db):
     user_data = UserSchema(username="testuser", email="test@example.com", password="password123")
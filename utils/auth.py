@@ -1,11 +1,79 @@
 import jwt
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
+from prometheus_client import Counter
+from sqlalchemy.ext.asyncio import AsyncSession
+
 from .config import settings
-from .db import get_db, User
+from .cache import LRUCache
+from .db import get_db, get_user_by_id_async, User
+from .timing import stage
+
+# Prometheus metrics for the authentication caches
+AUTH_CACHE_LOOKUPS = Counter("auth_cache_lookups_total", "Authentication cache lookups", ["cache", "result"])
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    """
+    The principal resolved from a bearer token. A plain, immutable snapshot of the `User`
+    row, so it can be cached safely across requests and sessions.
+    """
+    id: int
+    username: str
+    email: str
+
+    @classmethod
+    def from_user(cls, user: User) -> "AuthenticatedUser":
+        return cls(id=user.id, username=user.username, email=user.email)
+
+# Validated token -> user id, and user id -> principal
+token_cache = LRUCache(max_entries=settings.AUTH_TOKEN_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL, name="auth_token")
+user_cache = LRUCache(max_entries=settings.AUTH_USER_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL, name="auth_user")
+
+def invalidate_user(user_id: int):
+    """
+    Drops a user's cached principal. Call whenever a user row is updated or deleted, so
+    the next authenticated request reloads it (or rejects the token if the user is gone).
+    """
+    user_cache.delete(user_id)
+
+def clear_auth_caches():
+    """Empties both authentication caches."""
+    token_cache.clear()
+    user_cache.clear()
+
+def decode_token(credentials: str) -> int:
+    """
+    Validates a JWT and returns its user id, caching the result until the token expires.
+
+    Raises:
+        jwt.InvalidTokenError: If the token is malformed, has a bad signature or has expired.
+        HTTPException: If the token carries no subject, or one that is not a user id.
+    """
+    user_id = token_cache.get(credentials)
+    if user_id is not None:
+        AUTH_CACHE_LOOKUPS.labels(cache="token", result="hit").inc()
+        return user_id
+    AUTH_CACHE_LOOKUPS.labels(cache="token", result="miss").inc()
+    payload = jwt.decode(credentials, settings.JWT_SECRET, algorithms=["HS256"])
+    if payload.get("sub") is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    try:
+        user_id = int(payload["sub"])
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    ttl = settings.AUTH_CACHE_TTL
+    if "exp" in payload:
+        # Never serve a token from the cache past its own expiry
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        token_cache.set(credentials, user_id, ttl=ttl)
+    return user_id
 
 def create_access_token(data: dict, expires_delta: timedelta = timedelta(minutes=15)) -> str:
     """
@@ -24,45 +92,59 @@ def create_access_token(data: dict, expires_delta: timedelta = timedelta(minutes
     encoded_jwt = jwt.encode(to_encode, settings.JWT_SECRET, algorithm="HS256")
     return encoded_jwt
 
-def get_current_user(token: str = Depends(HTTPBearer())) -> User:
+async def get_current_user(
+    token: HTTPAuthorizationCredentials = Depends(HTTPBearer()),
+    db: AsyncSession = Depends(get_db),
+) -> AuthenticatedUser:
     """
     Verifies the JWT token provided in the request and retrieves the user information.
 
+    Validated tokens and user records are served from bounded TTL caches, so a hot client
+    costs neither a signature check nor a database round trip per request.
+
     Args:
-        token (str, optional): The JWT token from the request. Defaults to Depends(HTTPBearer()).
+        token (HTTPAuthorizationCredentials, optional): The bearer credentials from the request. Defaults to Depends(HTTPBearer()).
+        db (AsyncSession, optional): The database session object. Defaults to Depends(get_db).
 
     Returns:
-        User: The User object if authentication is successful.
+        AuthenticatedUser: The authenticated principal.
 
     Raises:
         HTTPException: If the JWT token is invalid or the user is not found.
     """
-    try:
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=["HS256"])
-        user_id = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-        db = get_db()
-        user = db.query(User).filter(User.id == user_id).first()
-        if user is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-        return user
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token expired",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    except jwt.InvalidTokenError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Error during authentication",
-        )
+    with stage("auth"):
+        try:
+            credentials = token.credentials if isinstance(token, HTTPAuthorizationCredentials) else token
+            user_id = decode_token(credentials)
+            principal = user_cache.get(user_id)
+            if principal is not None:
+                AUTH_CACHE_LOOKUPS.labels(cache="user", result="hit").inc()
+                return principal
+            AUTH_CACHE_LOOKUPS.labels(cache="user", result="miss").inc()
+            user = await get_user_by_id_async(db, user_id)
+            if user is None:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+            principal = AuthenticatedUser.from_user(user)
+            user_cache.set(user_id, principal)
+            return principal
+        except HTTPException:
+            raise
+        except jwt.ExpiredSignatureError:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token expired",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        except jwt.InvalidTokenError:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid token",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Error during authentication",
+            )
 
 oauth2_scheme = HTTPBearer()
\ No newline at end of file
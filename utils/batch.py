@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+async def _run_item(
+    index: int,
+    item: Any,
+    call: Callable[[Any], Awaitable[Any]],
+    semaphore: asyncio.Semaphore,
+    timeout: Optional[float],
+) -> Dict[str, Any]:
+    async with semaphore:
+        try:
+            return {"index": index, "response": await asyncio.wait_for(call(item), timeout=timeout)}
+        except asyncio.TimeoutError:
+            return {"index": index, "error": "Request timed out"}
+        except HTTPException as e:
+            return {"index": index, "error": e.detail}
+        except Exception as e:
+            logger.error(f"Error in batch item {index}: {e}")
+            return {"index": index, "error": "Internal server error"}
+
+async def iter_batch(
+    items: Sequence[Any],
+    call: Callable[[Any], Awaitable[Any]],
+    concurrency: int,
+    timeout: Optional[float] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Runs `call` over every item with at most `concurrency` calls in flight.
+
+    Args:
+        items (Sequence): The batch items.
+        call (Callable): A coroutine function applied to each item.
+        concurrency (int): The maximum number of concurrent calls.
+        timeout (float, optional): A per-item timeout in seconds. Defaults to None.
+
+    Yields:
+        dict: `{"index", "response"}` or `{"index", "error"}` for each item, in completion order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [asyncio.ensure_future(_run_item(index, item, call, semaphore, timeout)) for index, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Stop outstanding work if the consumer goes away (e.g. the client disconnects)
+        for task in tasks:
+            task.cancel()
+
+async def run_batch(
+    items: Sequence[Any],
+    call: Callable[[Any], Awaitable[Any]],
+    concurrency: int,
+    timeout: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """Runs a batch like `iter_batch` and returns the per-item results in input order."""
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    async for result in iter_batch(items, call, concurrency, timeout):
+        results[result["index"]] = result
+    return results
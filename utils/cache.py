@@ -0,0 +1,183 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from prometheus_client import Counter
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics for the response cache, served next to the metrics defined in main.py
+CACHE_HITS = Counter("response_cache_hits_total", "Response cache hits", ["tier"])
+CACHE_MISSES = Counter("response_cache_misses_total", "Response cache misses")
+CACHE_BYPASSES = Counter("response_cache_bypasses_total", "Requests that skipped the response cache", ["reason"])
+CACHE_EVICTIONS = Counter("lru_cache_evictions_total", "Entries evicted from in-process LRU caches", ["cache", "reason"])
+# The response cache's evictions under their original name, which dashboards already use
+RESPONSE_CACHE_EVICTIONS = Counter("response_cache_evictions_total", "Entries evicted from the in-process cache tier", ["reason"])
+
+# Parameters that never change the generated output and are dropped from the cache key
+IGNORED_PARAMETERS = frozenset({"user", "stream"})
+
+def make_cache_key(model: str, prompt: str, parameters: dict) -> str:
+    """
+    Builds a content-addressed cache key from the normalized request.
+
+    Args:
+        model (str): The OpenAI model to use.
+        prompt (str): The input prompt for the model.
+        parameters (dict): Parameters for the API call.
+
+    Returns:
+        str: A hex SHA-256 digest identifying the request.
+    """
+    canonical_parameters = {
+        key: value for key, value in (parameters or {}).items() if key not in IGNORED_PARAMETERS
+    }
+    payload = json.dumps(
+        {"model": model.strip().lower(), "prompt": prompt, "parameters": canonical_parameters},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def bypass_reason(parameters: dict) -> Optional[str]:
+    """
+    Returns why a request must not be cached, or None if it may be.
+
+    Only deterministic requests are cacheable: temperature 0 (the upstream default is 1),
+    a single choice and no streaming.
+    """
+    parameters = parameters or {}
+    if parameters.get("temperature", 1) != 0:
+        return "temperature"
+    if parameters.get("n", 1) != 1 or parameters.get("best_of", 1) != 1:
+        return "multiple_choices"
+    if parameters.get("stream"):
+        return "stream"
+    return None
+
+def parse_cache_control(cache_control: Optional[str]) -> set:
+    """Parses a Cache-Control header value into a set of lower-cased directives."""
+    if not cache_control:
+        return set()
+    return {directive.strip().split("=", 1)[0].lower() for directive in cache_control.split(",") if directive.strip()}
+
+class LRUCache:
+    """
+    A bounded in-process cache with least-recently-used eviction and per-entry TTL.
+    `name` labels its eviction metrics.
+    """
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0, name: str = "response"):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.name = name
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self._evicted("expired")
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value: Any, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evicted("capacity")
+
+    def _evicted(self, reason: str):
+        CACHE_EVICTIONS.labels(cache=self.name, reason=reason).inc()
+        if self.name == "response":
+            RESPONSE_CACHE_EVICTIONS.labels(reason=reason).inc()
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+class RedisCache:
+    """
+    The shared cache tier, backed by Redis. Any client exposing the async `get`/`set`
+    commands of `redis.asyncio.Redis` can be injected, which keeps it testable against
+    a fake Redis.
+    """
+    def __init__(self, client=None, ttl: float = 3600.0, prefix: str = "openai:response:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisCache":
+        import redis.asyncio as redis
+        return cls(redis.from_url(url), **kwargs)
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = await self.client.get(self.prefix + key)
+        except Exception as e:
+            logger.warning(f"Redis cache lookup failed: {e}")
+            return None
+        if raw is None:
+            return None
+        return json.loads(raw)
+
+    async def set(self, key: str, value: Any):
+        try:
+            await self.client.set(self.prefix + key, json.dumps(value), ex=int(self.ttl))
+        except Exception as e:
+            logger.warning(f"Redis cache store failed: {e}")
+
+class ResponseCache:
+    """
+    A two-tier response cache: a bounded in-process LRU in front of a shared Redis tier.
+    Redis hits are promoted into the local tier.
+    """
+    def __init__(self, local: LRUCache, shared: Optional[RedisCache] = None):
+        self.local = local
+        self.shared = shared
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.local.get(key)
+        if value is not None:
+            CACHE_HITS.labels(tier="local").inc()
+            return value
+        if self.shared is not None:
+            value = await self.shared.get(key)
+            if value is not None:
+                CACHE_HITS.labels(tier="redis").inc()
+                self.local.set(key, value)
+                return value
+        CACHE_MISSES.inc()
+        return None
+
+    async def set(self, key: str, value: Any):
+        self.local.set(key, value)
+        if self.shared is not None:
+            await self.shared.set(key, value)
+
+def build_response_cache() -> Optional[ResponseCache]:
+    """Creates the response cache described by the application settings, if enabled."""
+    if not settings.CACHE_ENABLED:
+        return None
+    local = LRUCache(max_entries=settings.CACHE_MAX_ENTRIES, ttl=settings.CACHE_LOCAL_TTL)
+    shared = None
+    if settings.CACHE_REDIS_ENABLED:
+        shared = RedisCache.from_url(settings.REDIS_URL, ttl=settings.CACHE_REDIS_TTL)
+    return ResponseCache(local, shared)
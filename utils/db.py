@@ -1,25 +1,101 @@
-from sqlalchemy import create_engine, Column, Integer, String, JSON, DateTime, ForeignKey
+from sqlalchemy import create_engine, inspect, insert, select, text, tuple_, update, Column, Float, Index, Integer, String, JSON, DateTime, ForeignKey
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship, scoped_session
+from sqlalchemy.orm import sessionmaker, relationship, scoped_session, defer, Session
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.sql import func
 from fastapi import Depends
 from .config import settings
+from .storage import CompressedJSON, CompressedText, decode_payloads, prepare_payloads, stored_column
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Sequence
+import base64
 import bcrypt
+import json
 
-# Configure SQLAlchemy engine and session
-engine = create_engine(settings.DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Async drivers used for each synchronous database URL scheme
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def async_database_url(url: str) -> str:
+    """Returns the async-driver equivalent of a database URL (e.g. postgresql:// -> postgresql+asyncpg://)."""
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.drivername)
+    if driver is None:
+        return url
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+def engine_options(url: str) -> dict:
+    """Connection pool settings from Settings; SQLite uses its own single-connection pools."""
+    options = {
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    }
+    if not make_url(url).drivername.startswith("sqlite"):
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+        )
+    return options
+
+ASYNC_DATABASE_URL = async_database_url(settings.DATABASE_URL)
+
+# The engines are created on first use rather than at import: creating one loads its dialect
+# and driver, and importing the app should neither pay for that nor need a database
+_engine = None
+_async_engine = None
+
+def get_engine():
+    """Returns the synchronous engine (for scripts and table creation), creating it on first use."""
+    global _engine
+    if _engine is None:
+        _engine = create_engine(settings.DATABASE_URL, **engine_options(settings.DATABASE_URL))
+    return _engine
+
+def get_async_engine():
+    """Returns the async engine used by the request handlers, creating it on first use."""
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+    return _async_engine
+
+def __getattr__(name: str):
+    # `engine` and `async_engine` stay importable; they are created when first accessed
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+class LazySessionMaker(sessionmaker):
+    """A sessionmaker bound to `get_engine()` when it makes its first session."""
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=get_engine())
+        return super().__call__(**local_kw)
+
+class LazyAsyncSessionMaker(async_sessionmaker):
+    """An async_sessionmaker bound to `get_async_engine()` when it makes its first session."""
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=get_async_engine())
+        return super().__call__(**local_kw)
+
+SessionLocal = LazySessionMaker(autocommit=False, autoflush=False)
+AsyncSessionLocal = LazyAsyncSessionMaker(autoflush=False, expire_on_commit=False)
 
 # Define base model
 Base = declarative_base()
 
-# Create a scoped session factory
-def get_db():
-    db = SessionLocal()
-    try:
+# Async session dependency for FastAPI routes
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 class User(Base):
     __tablename__ = "users"
@@ -33,19 +109,42 @@ class User(Base):
     def verify_password(self, password):
         return bcrypt.checkpw(password.encode(), self.hashed_password.encode())
 
+# Lifecycle of a request row; synchronous requests are stored "completed", async jobs start "queued"
+REQUEST_STATUSES = ("queued", "running", "completed", "failed")
+
 class Request(Base):
     __tablename__ = "requests"
 
     id = Column(Integer, primary_key=True, index=True)
     model = Column(String(50), nullable=False)
-    prompt = Column(String, nullable=False)
+    # Compressed and/or offloaded to the blob store when STORAGE_CODEC / BLOB_OFFLOAD_THRESHOLD are set
+    prompt = Column(CompressedText("prompt"), nullable=False)
     parameters = Column(JSON, nullable=False)
-    response = Column(JSON, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Null until a job completes
+    response = Column(CompressedJSON("response"), nullable=True)
+    status = Column(String(16), nullable=False, default="completed", server_default="completed")
+    error = Column(String(500), nullable=True)
+    # Webhook notified when a job finishes
+    callback_url = Column(String(2048), nullable=True)
+    # Until when the worker running a job holds it; the worker renews it while the job runs
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    # Token accounting; null for rows stored before it was recorded and for unfinished jobs
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    cost = Column(Float, nullable=True)
+    # Set by the application (with microseconds) on ORM and Core inserts; the server default covers COPY
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), server_default=func.now())
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
+    # Serves a user's history newest first and keyset pagination on (created_at, id);
+    # the status index finds unfinished jobs to recover at startup
+    __table_args__ = (
+        Index("ix_requests_user_created_id", "user_id", "created_at", "id"),
+        Index("ix_requests_status_id", "status", "id"),
+    )
+
 def create_user(db: Session, user: UserSchema):
-    hashed_password = bcrypt.hashpw(user.password.encode(), bcrypt.gensalt()).decode()
+    hashed_password = bcrypt.hashpw(user.password.encode(), bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)).decode()
     db_user = User(
         username=user.username,
         email=user.email,
@@ -75,11 +174,369 @@ def create_request(db: Session, request: RequestSchema, user_id: int):
     db.refresh(db_request)
     return db_request
 
+def bulk_create_requests(db: Session, rows: list):
+    """
+    Inserts many requests with a single executemany statement and one commit.
+
+    Args:
+        db (Session): The database session object.
+        rows (list): Dicts with the `model`, `prompt`, `parameters`, `response` and `user_id` columns.
+
+    Returns:
+        list: The new request ids, in the order of `rows`.
+    """
+    if not rows:
+        return []
+    statement = insert(Request).returning(Request.id, sort_by_parameter_order=True)
+    request_ids = db.scalars(statement, rows).all()
+    db.commit()
+    return list(request_ids)
+
 def get_requests_by_user(db: Session, user_id: int):
     return db.query(Request).filter(Request.user_id == user_id).all()
 
+async def _refresh_async(db: AsyncSession, db_request: Request, prompt: str, response):
+    """Refreshes a just-stored request, keeping the prompt and response it was given rather than decoding them again."""
+    await db.refresh(db_request, [column.key for column in Request.__table__.columns if column.key not in ("prompt", "response")])
+    set_committed_value(db_request, "prompt", prompt)
+    set_committed_value(db_request, "response", response)
+
+async def create_request_async(
+    db: AsyncSession,
+    model: str,
+    prompt: str,
+    parameters: dict,
+    response,
+    user_id: int,
+    prompt_tokens: Optional[int] = None,
+    completion_tokens: Optional[int] = None,
+    cost: Optional[float] = None,
+):
+    db_request = Request(
+        model=model,
+        prompt=prompt,
+        parameters=parameters,
+        response=response,
+        user_id=user_id,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cost=cost
+    )
+    await prepare_payloads([prompt, response])
+    db.add(db_request)
+    await db.commit()
+    await _refresh_async(db, db_request, prompt, response)
+    return db_request
+
+async def bulk_create_requests_async(db: AsyncSession, rows: list):
+    """Async equivalent of `bulk_create_requests`."""
+    if not rows:
+        return []
+    await prepare_payloads([row.get(column) for row in rows for column in ("prompt", "response")])
+    statement = insert(Request).returning(Request.id, sort_by_parameter_order=True)
+    request_ids = (await db.scalars(statement, rows)).all()
+    await db.commit()
+    return list(request_ids)
+
+async def get_requests_by_user_async(db: AsyncSession, user_id: int):
+    result = await db.scalars(select(Request).where(Request.user_id == user_id))
+    return result.all()
+
+async def create_job_async(db: AsyncSession, model: str, prompt: str, parameters: dict, user_id: int, callback_url: Optional[str] = None):
+    """Stores a request to be completed by the job workers, with status "queued"."""
+    db_request = Request(
+        model=model,
+        prompt=prompt,
+        parameters=parameters,
+        response=None,
+        status="queued",
+        callback_url=callback_url,
+        user_id=user_id
+    )
+    await prepare_payloads([prompt])
+    db.add(db_request)
+    await db.commit()
+    await _refresh_async(db, db_request, prompt, None)
+    return db_request
+
+async def _get_request_async(db: AsyncSession, *criteria):
+    """Loads one request, with its prompt and response decoded off the event loop."""
+    statement = (
+        select(Request, stored_column(Request.prompt), stored_column(Request.response))
+        .options(defer(Request.prompt), defer(Request.response))
+        .where(*criteria)
+    )
+    row = (await db.execute(statement)).first()
+    if row is None:
+        return None
+    db_request, prompt, response = row
+    payloads = (await decode_payloads([{"prompt": prompt, "response": response}]))[0]
+    set_committed_value(db_request, "prompt", payloads["prompt"])
+    set_committed_value(db_request, "response", payloads["response"])
+    return db_request
+
+async def get_request_async(db: AsyncSession, request_id: int):
+    """Returns the request with this id, or None."""
+    return await _get_request_async(db, Request.id == request_id)
+
+async def get_user_request_async(db: AsyncSession, request_id: int, user_id: int):
+    """Returns the user's request with this id, or None (also when it belongs to someone else)."""
+    return await _get_request_async(db, Request.id == request_id, Request.user_id == user_id)
+
+async def claim_job_async(db: AsyncSession, request_id: int, statuses: Sequence[str] = ("queued",), lease: float = 60.0) -> bool:
+    """
+    Marks a job "running", held for `lease` seconds, if it is still in one of `statuses`.
+
+    The check and the update are one statement, so of several workers handed the same job
+    exactly one claims it.
+
+    Returns:
+        bool: Whether this caller claimed the job.
+    """
+    result = await db.execute(
+        update(Request)
+        .where(Request.id == request_id, Request.status.in_(statuses))
+        .values(status="running", lease_expires_at=datetime.now(timezone.utc) + timedelta(seconds=lease))
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+async def renew_job_lease_async(db: AsyncSession, request_id: int, lease: float):
+    """Extends the lease of a running job to `lease` seconds from now."""
+    await db.execute(
+        update(Request)
+        .where(Request.id == request_id, Request.status == "running")
+        .values(lease_expires_at=datetime.now(timezone.utc) + timedelta(seconds=lease))
+    )
+    await db.commit()
+
+async def finish_job_async(db: AsyncSession, request_id: int, response=None, error: Optional[str] = None, usage: Optional[dict] = None):
+    """
+    Stores a job's outcome: its response and status "completed", or an error and status "failed",
+    with its token accounting (`prompt_tokens`, `completion_tokens`, `cost`) when given.
+    """
+    values = {"status": "completed", "response": response} if error is None else {"status": "failed", "error": error[:500]}
+    values.update(usage or {})
+    await prepare_payloads([response])
+    await db.execute(update(Request).where(Request.id == request_id).values(**values))
+    await db.commit()
+
+async def release_job_async(db: AsyncSession, request_id: int):
+    """Puts a job that was interrupted while running back to "queued"."""
+    await db.execute(
+        update(Request).where(Request.id == request_id, Request.status == "running").values(status="queued", lease_expires_at=None)
+    )
+    await db.commit()
+
+async def release_expired_jobs_async(db: AsyncSession) -> list:
+    """
+    Puts the running jobs whose lease has expired, i.e. whose worker died, back to "queued".
+
+    Rows claimed before leases were recorded have none and count as expired.
+
+    Returns:
+        list: The ids of the released jobs, oldest first.
+    """
+    expired = (Request.status == "running") & (
+        Request.lease_expires_at.is_(None) | (Request.lease_expires_at < datetime.now(timezone.utc))
+    )
+    job_ids = list((await db.scalars(select(Request.id).where(expired).order_by(Request.id))).all())
+    released = []
+    for job_id in job_ids:
+        # Re-checked per row: a lease renewed since the select keeps its job
+        result = await db.execute(update(Request).where(Request.id == job_id, expired).values(status="queued", lease_expires_at=None))
+        if result.rowcount == 1:
+            released.append(job_id)
+    await db.commit()
+    return released
+
+async def get_pending_job_ids_async(db: AsyncSession, status: str = "queued"):
+    """Returns the ids of the jobs in `status`, oldest first."""
+    result = await db.scalars(select(Request.id).where(Request.status == status).order_by(Request.id))
+    return list(result.all())
+
+# Columns returned by the request history unless more are asked for
+HISTORY_COLUMNS = ("id", "model", "prompt", "created_at")
+HISTORY_OPTIONAL_COLUMNS = ("parameters", "response", "prompt_tokens", "completion_tokens", "cost")
+
+def encode_cursor(created_at: datetime, request_id: int) -> str:
+    """Encodes the (created_at, id) position of the last row of a page as an opaque cursor."""
+    raw = json.dumps([created_at.isoformat(), request_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    """
+    Decodes a cursor produced by `encode_cursor`.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        created_at, request_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(request_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+async def get_request_history_async(
+    db: AsyncSession,
+    user_id: int,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    model: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    include: Sequence[str] = (),
+):
+    """
+    Returns one page of a user's requests, newest first, using keyset pagination.
+
+    The query walks the `(user_id, created_at, id)` index from the cursor position, so a
+    page costs the same however deep into the history it is.
+
+    Args:
+        db (AsyncSession): The database session object.
+        user_id (int): The owner of the requests.
+        limit (int, optional): The page size. Defaults to 50.
+        cursor (str, optional): The `next_cursor` of the previous page. Defaults to None.
+        model (str, optional): Only return requests for this model. Defaults to None.
+        since (datetime, optional): Only return requests created at or after this time. Defaults to None.
+        until (datetime, optional): Only return requests created before this time. Defaults to None.
+        include (Sequence[str], optional): Extra columns to return ("parameters", "response"). Defaults to ().
+
+    Returns:
+        tuple: The rows as dicts and the cursor of the next page (None on the last page).
+
+    Raises:
+        ValueError: If the cursor is malformed or an unknown column is requested.
+    """
+    unknown = set(include) - set(HISTORY_OPTIONAL_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+    columns = [
+        stored_column(getattr(Request, name)) if name in ("prompt", "response") else getattr(Request, name)
+        for name in HISTORY_COLUMNS + tuple(c for c in HISTORY_OPTIONAL_COLUMNS if c in include)
+    ]
+    statement = select(*columns).where(Request.user_id == user_id)
+    if cursor is not None:
+        statement = statement.where(tuple_(Request.created_at, Request.id) < tuple_(*decode_cursor(cursor)))
+    if model is not None:
+        statement = statement.where(Request.model == model)
+    if since is not None:
+        statement = statement.where(Request.created_at >= since)
+    if until is not None:
+        statement = statement.where(Request.created_at < until)
+    statement = statement.order_by(Request.created_at.desc(), Request.id.desc()).limit(limit + 1)
+    rows = await decode_payloads([dict(row) for row in (await db.execute(statement)).mappings()])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    return rows, next_cursor
+
+async def get_user_by_id_async(db: AsyncSession, user_id: int):
+    return await db.get(User, user_id)
+
 def get_request_by_id(db: Session, request_id: int):
     return db.query(Request).filter(Request.id == request_id).first()
 
 def initialize_db():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=get_engine())
+
+def _add_column_ddl(table, column, dialect) -> str:
+    ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=dialect)}"
+    if column.server_default is not None:
+        default = column.server_default.arg
+        ddl += " DEFAULT " + ("'" + default.replace("'", "''") + "'" if isinstance(default, str) else str(default.compile(dialect=dialect)))
+    if not column.nullable:
+        # Only safe with a default: existing rows need a value
+        ddl += " NOT NULL"
+    return ddl
+
+def _relax_not_null(conn, table, columns) -> list:
+    """Drops NOT NULL from `columns`; SQLite cannot alter a column, so the table is rebuilt."""
+    if conn.dialect.name != "sqlite":
+        statements = [f"ALTER TABLE {table.name} ALTER COLUMN {column.name} DROP NOT NULL" for column in columns]
+        for ddl in statements:
+            conn.execute(text(ddl))
+        return statements
+    old_name = f"_{table.name}_before_migrate"
+    existing = [column["name"] for column in inspect(conn).get_columns(table.name)]
+    names = ", ".join(name for name in existing if name in table.columns)
+    # Index names are global in SQLite, so the old ones go before the table is recreated with its own
+    for index in inspect(conn).get_indexes(table.name):
+        conn.execute(text(f"DROP INDEX {index['name']}"))
+    conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {old_name}"))
+    table.create(conn)
+    conn.execute(text(f"INSERT INTO {table.name} ({names}) SELECT {names} FROM {old_name}"))
+    conn.execute(text(f"DROP TABLE {old_name}"))
+    return [f"REBUILD TABLE {table.name} (DROP NOT NULL on {', '.join(column.name for column in columns)})"]
+
+def migrate_db() -> list:
+    """
+    Brings an existing database up to the current schema, idempotently: creates missing
+    tables, adds columns added since the table was created (status, error, callback_url,
+    the token accounting and the job lease), drops NOT NULL from columns that became
+    optional (the response, null until a job completes) and creates missing indexes.
+    `create_all` alone skips tables that already exist, so a database created by an earlier
+    version needs this once per upgrade.
+
+    Returns:
+        list: The DDL statements run (empty when the schema was already current).
+    """
+    engine = get_engine()
+    Base.metadata.create_all(bind=engine)
+    applied = []
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"]: column for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = _add_column_ddl(table, column, conn.dialect)
+                    conn.execute(text(ddl))
+                    applied.append(ddl)
+            relaxed = [
+                column for column in table.columns
+                if column.name in existing and column.nullable and not column.primary_key and not existing[column.name]["nullable"]
+            ]
+            if relaxed:
+                applied.extend(_relax_not_null(conn, table, relaxed))
+            indexes = {index["name"] for index in inspect(conn).get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn, checkfirst=True)
+                    applied.append(f"CREATE INDEX {index.name} ON {table.name} ({', '.join(column.name for column in index.columns)})")
+    return applied
+
+async def initialize_db_async():
+    async with get_async_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+async def start_db():
+    """
+    Creates this process's async engine. Called on startup, i.e. after the server forks its
+    workers; engines a parent process already created get fresh connection pools, so no
+    worker reuses connections opened by its parent.
+    """
+    if _engine is not None:
+        _engine.dispose(close=False)
+    if _async_engine is not None:
+        await _async_engine.dispose(close=False)
+    get_async_engine()
+
+async def close_db():
+    """Closes this process's pooled connections. Called on shutdown."""
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _engine is not None:
+        _engine.dispose()
+
+async def check_db():
+    """
+    Runs `SELECT 1` on a pooled connection.
+
+    Raises:
+        Exception: Whatever the driver raises when the database cannot be reached.
+    """
+    async with get_async_engine().connect() as connection:
+        await connection.execute(text("SELECT 1"))
@@ -0,0 +1,125 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .db import Request
+from .storage import decode_payloads, stored_column
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_COLUMNS = ("id", "user_id", "model", "prompt", "parameters", "response", "created_at")
+
+async def iter_request_rows(
+    db: AsyncSession,
+    user_id: Optional[int] = None,
+    model: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    batch_size: int = 1000,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Streams request rows in id order, `batch_size` at a time, through a server-side cursor.
+
+    Only one batch is held in memory at once, however many rows match.
+
+    Args:
+        db (AsyncSession): The database session object.
+        user_id (int, optional): Only export this user's requests. Defaults to None (all users).
+        model (str, optional): Only export requests for this model. Defaults to None.
+        since (datetime, optional): Only export requests created at or after this time. Defaults to None.
+        until (datetime, optional): Only export requests created before this time. Defaults to None.
+        batch_size (int, optional): Rows fetched per round trip. Defaults to 1000.
+
+    Yields:
+        list: Batches of rows as dicts keyed by `EXPORT_COLUMNS`.
+    """
+    statement = select(*(
+        stored_column(getattr(Request, column)) if column in ("prompt", "response") else getattr(Request, column)
+        for column in EXPORT_COLUMNS
+    ))
+    if user_id is not None:
+        statement = statement.where(Request.user_id == user_id)
+    if model is not None:
+        statement = statement.where(Request.model == model)
+    if since is not None:
+        statement = statement.where(Request.created_at >= since)
+    if until is not None:
+        statement = statement.where(Request.created_at < until)
+    statement = statement.order_by(Request.id).execution_options(yield_per=batch_size)
+    result = await db.stream(statement)
+    async for partition in result.mappings().partitions():
+        # Decompression and blob reads happen on a worker thread
+        yield await decode_payloads([dict(row) for row in partition])
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def encode_ndjson(rows: List[Dict[str, Any]]) -> str:
+    return "".join(json.dumps(dict(row), default=_json_default) + "\n" for row in rows)
+
+class CSVEncoder:
+    """Encodes batches of rows as CSV, with JSON columns serialized as JSON text."""
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def header(self) -> str:
+        self.writer.writerow(EXPORT_COLUMNS)
+        return self._take()
+
+    def encode(self, rows: List[Dict[str, Any]]) -> str:
+        for row in rows:
+            self.writer.writerow([
+                json.dumps(row[column]) if column in ("parameters", "response")
+                else row[column].isoformat() if isinstance(row[column], datetime)
+                else row[column]
+                for column in EXPORT_COLUMNS
+            ])
+        return self._take()
+
+    def _take(self) -> str:
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return text
+
+async def encode_export(
+    batches: AsyncIterator[List[Dict[str, Any]]],
+    export_format: str = "ndjson",
+    compress: bool = False,
+) -> AsyncIterator[bytes]:
+    """
+    Encodes row batches incrementally as NDJSON or CSV, optionally gzip-compressed on the fly.
+
+    Args:
+        batches (AsyncIterator): Row batches, e.g. from `iter_request_rows`.
+        export_format (str, optional): "ndjson" or "csv". Defaults to "ndjson".
+        compress (bool, optional): Gzip the output. Defaults to False.
+
+    Yields:
+        bytes: One encoded (and possibly compressed) chunk per batch.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid export format. Allowed formats are: {', '.join(EXPORT_FORMATS)}")
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    csv_encoder = CSVEncoder() if export_format == "csv" else None
+
+    def chunk(text: str) -> bytes:
+        data = text.encode()
+        return compressor.compress(data) if compressor is not None else data
+
+    if csv_encoder is not None:
+        yield chunk(csv_encoder.header())
+    async for rows in batches:
+        data = chunk(csv_encoder.encode(rows) if csv_encoder is not None else encode_ndjson(rows))
+        if data:
+            yield data
+    if compressor is not None:
+        yield compressor.flush()
@@ -0,0 +1,427 @@
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import logging
+import os
+import socket
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp.abc import AbstractResolver
+from aiohttp.resolver import ThreadedResolver
+from fastapi import HTTPException
+from prometheus_client import Counter, Gauge, Histogram
+
+from .config import settings
+from .db import (
+    AsyncSessionLocal, claim_job_async, finish_job_async, get_pending_job_ids_async, get_request_async,
+    release_expired_jobs_async, release_job_async, renew_job_lease_async,
+)
+from .openai import openai_request
+from .responses import dumps
+from .scheduler import set_request_class
+from .tokens import count_prompt_tokens_async, settle_usage, track_usage
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics for async jobs
+JOBS_FINISHED = Counter("jobs_finished_total", "Async jobs finished", ["status"])
+JOB_DURATION = Histogram(
+    "job_duration_seconds", "Time from a worker claiming a job to its outcome being stored",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+JOB_QUEUE_DEPTH = Gauge("job_queue_depth", "Jobs waiting in the in-process job queue", multiprocess_mode="livesum")
+WEBHOOK_DELIVERIES = Counter("job_webhook_deliveries_total", "Job completion webhook deliveries", ["outcome"])
+
+JOB_BACKENDS = ("local", "redis")
+
+class LocalJobQueue:
+    """
+    An in-process job queue. Queued jobs die with the process, so the pool re-queues the
+    jobs still "queued" in the `requests` table when it starts, and those whose worker died
+    (their lease expired while "running") then and periodically.
+    """
+    recovers_from_table = True
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def put(self, job_id: int):
+        self.queue.put_nowait(job_id)
+        JOB_QUEUE_DEPTH.inc()
+
+    async def get(self) -> Tuple[int, Any, bool]:
+        """Returns the next job id, an acknowledgement token and whether it is a redelivery."""
+        job_id = await self.queue.get()
+        JOB_QUEUE_DEPTH.dec()
+        return job_id, None, False
+
+    async def ack(self, token: Any):
+        pass
+
+class RedisJobQueue:
+    """
+    A job queue on a Redis stream read through a consumer group, shared by every process.
+
+    A job is acknowledged (and deleted from the stream) once its outcome is stored. Jobs a
+    crashed consumer left unacknowledged for `claim_timeout` seconds are claimed by another
+    consumer and run again, so every job runs at least once.
+    """
+    recovers_from_table = False
+
+    def __init__(self, redis, stream: str, group: str, consumer: str, claim_timeout: float = 300.0, block: float = 5.0):
+        self.redis = redis
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer
+        self.claim_timeout = claim_timeout
+        self.block = block
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisJobQueue":
+        import redis.asyncio as redis
+        return cls(redis.from_url(url), **kwargs)
+
+    async def start(self):
+        from redis.exceptions import ResponseError
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def close(self):
+        await self.redis.aclose()
+
+    async def put(self, job_id: int):
+        await self.redis.xadd(self.stream, {"id": job_id})
+
+    @staticmethod
+    def _job_id(fields: dict) -> int:
+        return int(fields.get(b"id") or fields.get("id"))
+
+    async def get(self) -> Tuple[int, Any, bool]:
+        while True:
+            claimed = await self.redis.xautoclaim(
+                self.stream, self.group, self.consumer, min_idle_time=int(self.claim_timeout * 1000), start_id="0-0", count=1
+            )
+            if claimed[1]:
+                message_id, fields = claimed[1][0]
+                return self._job_id(fields), message_id, True
+            response = await self.redis.xreadgroup(self.group, self.consumer, {self.stream: ">"}, count=1, block=int(self.block * 1000))
+            if response:
+                message_id, fields = response[0][1][0]
+                return self._job_id(fields), message_id, False
+
+    async def ack(self, token: Any):
+        await self.redis.xack(self.stream, self.group, token)
+        await self.redis.xdel(self.stream, token)
+
+def webhook_signature(secret: str, body: bytes) -> str:
+    """The `X-Webhook-Signature` header value: `sha256=` and the hex HMAC-SHA256 of the body."""
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+def is_public_address(address: str) -> bool:
+    """Whether an IP address is globally routable (not private, loopback, link-local, reserved or multicast)."""
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+class CallbackResolver(AbstractResolver):
+    """
+    Resolves webhook hosts, refusing any that resolve to a non-public address unless they are
+    in `allowed_hosts`. Checking the addresses actually connected to means a DNS answer that
+    changes after the job was accepted cannot point a callback at an internal service.
+    """
+    def __init__(self, allowed_hosts: Sequence[str] = ()):
+        self.resolver = ThreadedResolver()
+        self.allowed_hosts = set(allowed_hosts)
+
+    async def resolve(self, host: str, port: int = 0, family: socket.AddressFamily = socket.AF_INET):
+        hosts = await self.resolver.resolve(host, port, family)
+        if host.lower() not in self.allowed_hosts:
+            for resolved in hosts:
+                if not is_public_address(resolved["host"]):
+                    raise OSError(f"{host} resolves to the non-public address {resolved['host']}")
+        return hosts
+
+    async def close(self):
+        await self.resolver.close()
+
+def error_message(error: Exception) -> str:
+    if isinstance(error, HTTPException):
+        return error.detail if isinstance(error.detail, str) else dumps(error.detail).decode()
+    return "Internal server error"
+
+class JobWorkerPool:
+    """
+    Runs queued requests in the background and records their outcome on their `requests` row.
+
+    `workers` tasks take job ids off the queue. A worker first claims the job (a conditional
+    update from "queued" to "running"), so a job handed out twice still runs once. The claim
+    holds the job for `lease` seconds and is renewed while it runs, so other processes sharing
+    the database can tell a live job from one whose worker died. The worker then calls
+    upstream in the "batch" scheduling class and stores the response or the error. If the job
+    has a callback URL, the stored outcome is POSTed to it, signed with `webhook_secret` when
+    one is set, and retried on connection errors and 5xx responses. Callbacks are refused
+    unless their host is in `callback_allowed_hosts` or, with no allowlist, resolves to public
+    addresses only; redirects are not followed.
+    """
+    def __init__(
+        self,
+        queue,
+        call: Callable[..., Awaitable[Any]] = openai_request,
+        session_factory=AsyncSessionLocal,
+        workers: int = 8,
+        request_class: str = "batch",
+        webhook_secret: Optional[str] = None,
+        webhook_timeout: float = 10.0,
+        webhook_retries: int = 3,
+        callback_allowed_hosts: Sequence[str] = (),
+        lease: float = 60.0,
+    ):
+        self.queue = queue
+        self.call = call
+        self.session_factory = session_factory
+        self.workers = workers
+        self.request_class = request_class
+        self.webhook_secret = webhook_secret
+        self.webhook_timeout = webhook_timeout
+        self.webhook_retries = webhook_retries
+        self.callback_allowed_hosts = [host.lower() for host in callback_allowed_hosts]
+        self.lease = lease
+        self.http: Optional[aiohttp.ClientSession] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        await self.queue.start()
+        if self.workers <= 0:
+            return
+        self.http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(resolver=CallbackResolver(self.callback_allowed_hosts)),
+            timeout=aiohttp.ClientTimeout(total=self.webhook_timeout),
+        )
+        if self.queue.recovers_from_table:
+            await self.recover()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        if self.queue.recovers_from_table:
+            self._tasks.append(asyncio.create_task(self._recover_expired()))
+
+    async def stop(self):
+        """Stops the workers. Jobs they were running go back to "queued" to be picked up again."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.http is not None:
+            await self.http.close()
+            self.http = None
+        await self.queue.close()
+
+    async def submit(self, job_id: int):
+        await self.queue.put(job_id)
+
+    async def recover(self):
+        """Re-queues the jobs still "queued" and those whose worker died while running them."""
+        async with self.session_factory() as db:
+            # Other processes may share the database, so only jobs whose lease expired are released
+            await release_expired_jobs_async(db)
+            job_ids = await get_pending_job_ids_async(db)
+        for job_id in job_ids:
+            await self.queue.put(job_id)
+        if job_ids:
+            logger.info(f"Re-queued {len(job_ids)} unfinished jobs")
+
+    async def _recover_expired(self):
+        """Re-queues jobs whose lease expired since startup, e.g. those of another process that died."""
+        while True:
+            await asyncio.sleep(self.lease)
+            try:
+                async with self.session_factory() as db:
+                    job_ids = await release_expired_jobs_async(db)
+            except Exception as e:
+                logger.error(f"Error recovering expired jobs: {e}")
+                continue
+            for job_id in job_ids:
+                await self.queue.put(job_id)
+            if job_ids:
+                logger.info(f"Re-queued {len(job_ids)} jobs whose worker stopped renewing them")
+
+    async def _renew_lease(self, job_id: int):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                async with self.session_factory() as db:
+                    await renew_job_lease_async(db, job_id, self.lease)
+            except Exception as e:
+                logger.error(f"Error renewing the lease of job {job_id}: {e}")
+
+    async def _work(self):
+        set_request_class(self.request_class)
+        while True:
+            job_id, token, redelivered = await self.queue.get()
+            try:
+                await self.run(job_id, redelivered)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The job goes back to "queued" for redelivery (Redis) or the next startup (local)
+                logger.error(f"Error running job {job_id}: {e}")
+                try:
+                    await self._release(job_id)
+                except Exception as release_error:
+                    logger.error(f"Error releasing job {job_id}: {release_error}")
+                continue
+            await self.queue.ack(token)
+
+    async def run(self, job_id: int, redelivered: bool = False) -> bool:
+        """
+        Runs one job if it can be claimed.
+
+        Args:
+            job_id (int): The job's request id.
+            redelivered (bool, optional): Whether a previous consumer may have died running it,
+                in which case a "running" job is claimed too. Defaults to False.
+
+        Returns:
+            bool: Whether this call ran the job.
+        """
+        async with self.session_factory() as db:
+            statuses = ("queued", "running") if redelivered else ("queued",)
+            if not await claim_job_async(db, job_id, statuses, self.lease):
+                return False
+            job = await get_request_async(db, job_id)
+        started = time.perf_counter()
+        response, error, accounting = None, None, None
+        renewal = asyncio.create_task(self._renew_lease(job_id))
+        try:
+            try:
+                usage = track_usage()
+                response = await self.call(job.model, job.prompt, job.parameters)
+                accounting = settle_usage(usage, job.model, (await count_prompt_tokens_async([job]))[0], response)
+            except asyncio.CancelledError:
+                await asyncio.shield(self._release(job_id))
+                raise
+            except Exception as e:
+                if not isinstance(e, HTTPException):
+                    logger.error(f"Error in job {job_id}: {e}")
+                error = error_message(e)
+            async with self.session_factory() as db:
+                await finish_job_async(db, job_id, response, error, accounting)
+        finally:
+            renewal.cancel()
+        status = "failed" if error is not None else "completed"
+        JOB_DURATION.observe(time.perf_counter() - started)
+        JOBS_FINISHED.labels(status=status).inc()
+        if job.callback_url:
+            await self.notify(job.callback_url, {
+                "id": job_id, "status": status, "model": job.model, "response": response, "error": error,
+            })
+        return True
+
+    async def _release(self, job_id: int):
+        async with self.session_factory() as db:
+            await release_job_async(db, job_id)
+
+    async def refused_callback(self, url: str) -> Optional[str]:
+        """Returns why a callback URL may not be called, or None if it may."""
+        host = (urlsplit(url).hostname or "").lower()
+        if self.callback_allowed_hosts:
+            return None if host in self.callback_allowed_hosts else f"{host} is not an allowed callback host"
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            return f"{host} does not resolve: {e}"
+        for *_, address in infos:
+            if not is_public_address(address[0]):
+                return f"{host} resolves to the non-public address {address[0]}"
+        return None
+
+    async def notify(self, url: str, payload: dict) -> bool:
+        """POSTs a finished job to its callback URL. Returns whether it was accepted with a 2xx."""
+        refused = await self.refused_callback(url)
+        if refused is not None:
+            logger.warning(f"Refusing webhook {url} for job {payload['id']}: {refused}")
+            WEBHOOK_DELIVERIES.labels(outcome="refused").inc()
+            return False
+        body = dumps(payload)
+        headers = {"Content-Type": "application/json"}
+        if self.webhook_secret:
+            headers["X-Webhook-Signature"] = webhook_signature(self.webhook_secret, body)
+        reason = None
+        for attempt in range(self.webhook_retries + 1):
+            if attempt:
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+            try:
+                async with self.http.post(url, data=body, headers=headers, allow_redirects=False) as response:
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                reason = str(e) or type(e).__name__
+                continue
+            if status < 300:
+                WEBHOOK_DELIVERIES.labels(outcome="delivered").inc()
+                return True
+            if status < 500:
+                logger.warning(f"Webhook {url} rejected job {payload['id']} with status {status}")
+                WEBHOOK_DELIVERIES.labels(outcome="rejected").inc()
+                return False
+            reason = f"status {status}"
+        logger.warning(f"Giving up on webhook {url} for job {payload['id']}: {reason}")
+        WEBHOOK_DELIVERIES.labels(outcome="failed").inc()
+        return False
+
+def build_job_queue():
+    """Creates the job queue described by the application settings."""
+    if settings.JOB_QUEUE_BACKEND == "redis":
+        return RedisJobQueue.from_url(
+            settings.REDIS_URL,
+            stream=settings.JOB_STREAM,
+            group=settings.JOB_CONSUMER_GROUP,
+            consumer=f"{socket.gethostname()}-{os.getpid()}",
+            claim_timeout=settings.JOB_CLAIM_TIMEOUT,
+        )
+    if settings.JOB_QUEUE_BACKEND != "local":
+        raise ValueError(f"Invalid job queue backend. Allowed backends are: {', '.join(JOB_BACKENDS)}")
+    return LocalJobQueue()
+
+job_workers: Optional[JobWorkerPool] = None
+
+def get_job_workers() -> Optional[JobWorkerPool]:
+    """Returns the running job pool, or None when async jobs are disabled."""
+    return job_workers
+
+async def start_job_workers():
+    """Creates the job queue and starts this process's workers if `JOBS_ENABLED`. Called on startup."""
+    global job_workers
+    if not settings.JOBS_ENABLED or job_workers is not None:
+        return
+    if settings.JOB_QUEUE_BACKEND == "local" and settings.JOB_WORKERS <= 0:
+        logger.warning("JOB_WORKERS is 0 with the local job queue; submitted jobs will not run")
+    job_workers = JobWorkerPool(
+        build_job_queue(),
+        workers=settings.JOB_WORKERS,
+        request_class=settings.JOB_REQUEST_CLASS,
+        webhook_secret=settings.JOB_WEBHOOK_SECRET,
+        webhook_timeout=settings.JOB_WEBHOOK_TIMEOUT,
+        webhook_retries=settings.JOB_WEBHOOK_RETRIES,
+        callback_allowed_hosts=settings.JOB_CALLBACK_ALLOWED_HOSTS,
+        lease=settings.JOB_LEASE,
+    )
+    await job_workers.start()
+
+async def stop_job_workers():
+    """Stops this process's workers. Called on shutdown."""
+    global job_workers
+    if job_workers is not None:
+        await job_workers.stop()
+        job_workers = None
@@ -0,0 +1,76 @@
+import logging
+import os
+
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, REGISTRY, generate_latest, start_http_server
+from prometheus_client import multiprocess
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+def multiprocess_mode() -> bool:
+    """True when metrics are written to `PROMETHEUS_MULTIPROC_DIR` and aggregated across workers."""
+    return settings.PROMETHEUS_MULTIPROC_DIR is not None
+
+def metrics_registry() -> CollectorRegistry:
+    """
+    Returns the registry to expose: the process-local default registry, or in multi-process
+    mode a fresh registry collecting the files every worker writes.
+    """
+    if not multiprocess_mode():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=settings.PROMETHEUS_MULTIPROC_DIR)
+    return registry
+
+def metrics_response() -> Response:
+    """Renders the metrics in the Prometheus text format."""
+    return Response(generate_latest(metrics_registry()), media_type=CONTENT_TYPE_LATEST)
+
+# The (server, thread) serving METRICS_PORT, while it runs
+metrics_server = None
+
+def start_metrics_server():
+    """
+    Serves metrics on `METRICS_PORT` in single-process deployments. Called on startup.
+
+    Multiple workers cannot share one port, so in multi-process mode (or with more than one
+    worker configured) metrics are only served from the app's `/metrics` endpoint.
+    """
+    global metrics_server
+    if settings.METRICS_PORT <= 0 or multiprocess_mode() or metrics_server is not None:
+        return
+    if settings.WORKERS > 1:
+        logger.warning("WORKERS > 1 without PROMETHEUS_MULTIPROC_DIR; metrics are per worker and not served on METRICS_PORT")
+        return
+    try:
+        metrics_server = start_http_server(settings.METRICS_PORT)
+    except OSError as e:
+        logger.warning(f"Could not serve metrics on port {settings.METRICS_PORT}: {e}")
+
+def stop_metrics_server():
+    """Stops serving metrics on `METRICS_PORT` and frees the port. Called on shutdown."""
+    global metrics_server
+    if metrics_server is None:
+        return
+    server, thread = metrics_server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+    metrics_server = None
+
+def clear_multiprocess_dir():
+    """Removes metric files left by a previous run. Called once by the master before workers start."""
+    path = settings.PROMETHEUS_MULTIPROC_DIR
+    if path is None:
+        return
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if name.endswith(".db"):
+            os.remove(os.path.join(path, name))
+
+def mark_worker_dead(pid: int):
+    """Drops the live gauges of an exited worker so `live*` aggregations stop counting it."""
+    if multiprocess_mode():
+        multiprocess.mark_process_dead(pid, settings.PROMETHEUS_MULTIPROC_DIR)
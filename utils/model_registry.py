@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Optional
+
+from prometheus_client import Counter
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics for the model registry
+MODEL_REGISTRY_RELOADS = Counter("model_registry_reloads_total", "Model registry reloads", ["outcome"])
+
+ENDPOINTS = ("chat", "completion")
+
+# Used when neither MODEL_REGISTRY nor MODEL_REGISTRY_PATH is set: the models the service has
+# always accepted, with gpt-3.5-turbo on the chat endpoint it actually serves. Prices are USD
+# per 1K tokens.
+DEFAULT_MODELS = {
+    "gpt-3.5-turbo": {
+        "endpoint": "chat", "prompt_price": 0.0005, "completion_price": 0.0015,
+        "context_window": 16385, "encoding": "cl100k_base",
+    },
+    "text-davinci-003": {
+        "endpoint": "completion", "prompt_price": 0.02, "completion_price": 0.02,
+        "context_window": 4097, "encoding": "p50k_base",
+    },
+    "text-curie-001": {
+        "endpoint": "completion", "prompt_price": 0.002, "completion_price": 0.002,
+        "context_window": 2049, "encoding": "r50k_base",
+    },
+    "text-babbage-001": {
+        "endpoint": "completion", "prompt_price": 0.0005, "completion_price": 0.0005,
+        "context_window": 2049, "encoding": "r50k_base",
+    },
+    "text-ada-001": {
+        "endpoint": "completion", "prompt_price": 0.0004, "completion_price": 0.0004,
+        "context_window": 2049, "encoding": "r50k_base",
+    },
+}
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """
+    How one model is served.
+
+    Attributes:
+        name (str): The model name clients request (lowercase).
+        endpoint (str): "chat" for /chat/completions or "completion" for /completions.
+        upstream_model (str): The model name sent upstream; defaults to `name`, so a client-facing
+            name can be pointed at a different model or backend.
+        base_url (str, optional): The upstream base URL; defaults to OPENAI_BASE_URL.
+        api_key_env (str, optional): Environment variable holding this upstream's API key;
+            defaults to OPENAI_API_KEY.
+        max_prompt_length (int, optional): Longest prompt accepted, in characters. Unset by
+            default: prompts are limited by `context_window`, counted in tokens.
+        default_parameters (dict): Parameters applied unless the request sets them.
+        max_concurrency (int): Upstream calls in flight for this model per worker; 0 is unlimited.
+        prompt_price (float): USD per 1K prompt tokens.
+        completion_price (float): USD per 1K completion tokens.
+        context_window (int): Most tokens a call may use, prompt and completion together.
+        encoding (str): The tokenizer encoding used to count the model's tokens.
+    """
+    name: str
+    endpoint: str = "completion"
+    upstream_model: str = ""
+    base_url: Optional[str] = None
+    api_key_env: Optional[str] = None
+    max_prompt_length: Optional[int] = None
+    default_parameters: Dict[str, Any] = field(default_factory=dict)
+    max_concurrency: int = 0
+    prompt_price: float = 0.0
+    completion_price: float = 0.0
+    context_window: int = 4096
+    encoding: str = "cl100k_base"
+
+    def __post_init__(self):
+        if self.endpoint not in ENDPOINTS:
+            raise ValueError(f"Invalid endpoint for {self.name}. Allowed endpoints are: {', '.join(ENDPOINTS)}")
+        if not self.upstream_model:
+            object.__setattr__(self, "upstream_model", self.name)
+
+    @property
+    def api_key(self) -> Optional[str]:
+        return os.getenv(self.api_key_env) if self.api_key_env else settings.OPENAI_API_KEY
+
+    @property
+    def upstream_url(self) -> str:
+        return self.base_url or settings.OPENAI_BASE_URL
+
+    def with_defaults(self, parameters: Optional[dict]) -> dict:
+        """Returns `parameters` on top of the model's default parameters."""
+        if not self.default_parameters:
+            return parameters or {}
+        return {**self.default_parameters, **(parameters or {})}
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        """The price, in USD, of a call with the given token counts."""
+        return (prompt_tokens * self.prompt_price + completion_tokens * self.completion_price) / 1000
+
+def parse_model_registry(raw: str) -> Dict[str, ModelSpec]:
+    """
+    Parses a registry document: a JSON object mapping model names to `ModelSpec` fields.
+
+    Raises:
+        ValueError: If the document is not valid JSON or an entry is invalid.
+    """
+    try:
+        entries = json.loads(raw)
+        return {
+            name.lower(): ModelSpec(name=name.lower(), **(entry or {}))
+            for name, entry in entries.items()
+        }
+    except (TypeError, AttributeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid model registry: {e}") from e
+
+class ModelRegistry:
+    """
+    The models the service accepts, loaded from config and reloadable while running.
+
+    Lookups are a single dict access. A reload parses the new document completely and then
+    swaps the whole mapping in one assignment, so a request sees either the old or the new
+    registry, never a mix, and an invalid document leaves the current one in place.
+    """
+    def __init__(self, raw: Optional[str] = None, path: Optional[str] = None):
+        self.raw = raw
+        self.path = path
+        self.models: Dict[str, ModelSpec] = {}
+        self.names: FrozenSet[str] = frozenset()
+        self.loaded_mtime: Optional[float] = None
+        self._watcher: Optional[asyncio.Task] = None
+        self.reload(force=True)
+
+    def get(self, name: str) -> Optional[ModelSpec]:
+        return self.models.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.models
+
+    def _read(self) -> str:
+        if self.path:
+            with open(self.path, encoding="utf-8") as registry_file:
+                return registry_file.read()
+        return self.raw or json.dumps(DEFAULT_MODELS)
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Reloads the registry if its file changed (or always, with `force`).
+
+        Returns:
+            bool: Whether a new registry was installed.
+
+        Raises:
+            ValueError: If `force` is set and the document is invalid.
+        """
+        mtime = None
+        if self.path:
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError as e:
+                if force:
+                    raise ValueError(f"Cannot read model registry {self.path}: {e}") from e
+                logger.error(f"Cannot read model registry {self.path}: {e}")
+                MODEL_REGISTRY_RELOADS.labels(outcome="error").inc()
+                return False
+            if not force and mtime == self.loaded_mtime:
+                return False
+        try:
+            models = parse_model_registry(self._read())
+        except (OSError, ValueError) as e:
+            if force:
+                raise ValueError(str(e)) from e
+            logger.error(f"Keeping the current model registry: {e}")
+            MODEL_REGISTRY_RELOADS.labels(outcome="error").inc()
+            return False
+        self.models, self.names, self.loaded_mtime = models, frozenset(models), mtime
+        MODEL_REGISTRY_RELOADS.labels(outcome="loaded").inc()
+        logger.info(f"Loaded {len(models)} models: {', '.join(sorted(models))}")
+        return True
+
+    async def watch(self, interval: float):
+        """Polls the registry file every `interval` seconds and reloads it when it changes."""
+        while True:
+            await asyncio.sleep(interval)
+            self.reload()
+
+    def start_watcher(self, interval: float):
+        if self.path and interval > 0 and self._watcher is None:
+            self._watcher = asyncio.create_task(self.watch(interval))
+
+    async def stop_watcher(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+model_registry = ModelRegistry(settings.MODEL_REGISTRY, settings.MODEL_REGISTRY_PATH)
@@ -1,10 +1,60 @@
-import openai
 from .config import settings
+from .cache import build_response_cache, bypass_reason, make_cache_key, parse_cache_control, CACHE_BYPASSES
+from .scheduler import build_scheduler
+from .singleflight import SingleFlight
+from .upstream import UpstreamClient, UpstreamError
+from .upstream_pool import build_upstream, make_client
+from .timing import stage
+from .tokens import record_upstream_usage, token_counter
+from .resilience import CircuitBreakerRegistry, CircuitOpenError, RetryPolicy, call_with_resilience, is_retryable, UPSTREAM_RETRIES
+from .model_registry import ModelSpec, model_registry
 from fastapi import HTTPException, status
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+import asyncio
+import contextlib
 import logging
+import math
+import os
 
 logger = logging.getLogger(__name__)
 
+class CompletionAdapter:
+    """The legacy /completions API: a prompt in, `choices[0].text` out."""
+    path = "/completions"
+
+    def payload(self, spec: ModelSpec, prompt: str, parameters: dict) -> Dict[str, Any]:
+        return {**parameters, "model": spec.upstream_model, "prompt": prompt}
+
+    def text(self, response: Dict[str, Any]) -> str:
+        return response["choices"][0]["text"]
+
+    def fragment(self, event: Dict[str, Any]) -> Optional[str]:
+        choices = event.get("choices") or []
+        return choices[0].get("text") if choices else None
+
+class ChatAdapter:
+    """The /chat/completions API: the prompt as a single user message, `choices[0].message.content` out."""
+    path = "/chat/completions"
+
+    def payload(self, spec: ModelSpec, prompt: str, parameters: dict) -> Dict[str, Any]:
+        return {**parameters, "model": spec.upstream_model, "messages": [{"role": "user", "content": prompt}]}
+
+    def text(self, response: Dict[str, Any]) -> str:
+        return response["choices"][0]["message"]["content"]
+
+    def fragment(self, event: Dict[str, Any]) -> Optional[str]:
+        choices = event.get("choices") or []
+        return (choices[0].get("delta") or {}).get("content") if choices else None
+
+ADAPTERS = {"completion": CompletionAdapter(), "chat": ChatAdapter()}
+
+def resolve_model(model: str) -> ModelSpec:
+    """Looks a model up in the registry, rejecting models it no longer lists with a 400."""
+    spec = model_registry.get(model)
+    if spec is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Model {model} is not available.")
+    return spec
+
 class OpenAIUtils:
     __instance = None
 
@@ -12,7 +62,33 @@ class OpenAIUtils:
         if OpenAIUtils.__instance is not None:
             raise Exception("This class is a singleton!")
         else:
-            openai.api_key = settings.OPENAI_API_KEY
+            # A single client, or a balanced pool when several keys or base URLs are configured
+            self.client = build_upstream(settings.OPENAI_BASE_URL, settings.OPENAI_API_KEY)
+            self.retry_policy = RetryPolicy(
+                max_retries=settings.UPSTREAM_MAX_RETRIES,
+                base_delay=settings.UPSTREAM_RETRY_BASE_DELAY,
+                max_delay=settings.UPSTREAM_RETRY_MAX_DELAY,
+                max_retry_after=settings.UPSTREAM_RETRY_AFTER_MAX,
+            )
+            self.breakers = CircuitBreakerRegistry(
+                failure_threshold=settings.CIRCUIT_FAILURE_THRESHOLD,
+                recovery_timeout=settings.CIRCUIT_RECOVERY_TIMEOUT,
+            )
+            # One pooled client per upstream (base URL and API key); the default one is opened at startup
+            self.clients: Dict[Tuple[str, Optional[str]], UpstreamClient] = {
+                (settings.OPENAI_BASE_URL, settings.OPENAI_API_KEY): self.client,
+            }
+            # Per-model concurrency limits as (limit, semaphore), replaced when a reload changes the limit
+            self.concurrency: Dict[str, Tuple[int, asyncio.Semaphore]] = {}
+            # Global cap and fair queueing across request classes, applied after the per-model limit
+            self.scheduler = build_scheduler()
+            self.cache = build_response_cache()
+            self.semantic_cache = None
+            if settings.CACHE_ENABLED and settings.SEMANTIC_CACHE_ENABLED:
+                # Imported only when enabled, as it loads numpy
+                from .semantic_cache import build_semantic_cache
+                self.semantic_cache = build_semantic_cache()
+            self.singleflight = SingleFlight() if settings.SINGLEFLIGHT_ENABLED else None
             OpenAIUtils.__instance = self
 
     @staticmethod
@@ -21,37 +97,222 @@ class OpenAIUtils:
             OpenAIUtils()
         return OpenAIUtils.__instance
 
+    async def startup(self):
+        """
+        Opens the pooled upstream HTTP session, loads the tokenizers of the registry's models
+        and restores the semantic cache snapshot. Called when the app's lifespan starts.
+        """
+        await self.client.start()
+        await asyncio.to_thread(token_counter.load, [spec.encoding for spec in model_registry.models.values()])
+        path = settings.SEMANTIC_CACHE_SNAPSHOT_PATH
+        if self.semantic_cache is not None and path and os.path.exists(path):
+            try:
+                restored = await self.semantic_cache.run(self.semantic_cache.load, path)
+                logger.info(f"Restored {restored} semantic cache entries from {path}")
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Cannot restore semantic cache snapshot {path}: {e}")
+
+    async def shutdown(self):
+        """
+        Closes the pooled upstream HTTP sessions and snapshots the semantic cache.
+        Called when the app's lifespan ends.
+        """
+        for client in self.clients.values():
+            await client.close()
+        if self.semantic_cache is not None and settings.SEMANTIC_CACHE_SNAPSHOT_PATH:
+            try:
+                await self.semantic_cache.run(self.semantic_cache.save, settings.SEMANTIC_CACHE_SNAPSHOT_PATH)
+            except OSError as e:
+                logger.error(f"Cannot snapshot the semantic cache: {e}")
+
+    def client_for(self, spec: ModelSpec) -> UpstreamClient:
+        """Returns the pooled client for the model's upstream, creating it on first use."""
+        key = (spec.upstream_url, spec.api_key)
+        client = self.clients.get(key)
+        if client is None:
+            client = self.clients[key] = make_client(spec.upstream_url, spec.api_key)
+        return client
+
+    def concurrency_slot(self, spec: ModelSpec):
+        """Returns a context manager holding one of the model's concurrent upstream call slots."""
+        if spec.max_concurrency <= 0:
+            return contextlib.nullcontext()
+        limit = self.concurrency.get(spec.name)
+        if limit is None or limit[0] != spec.max_concurrency:
+            # Calls holding the old semaphore finish on it; new calls use the new limit
+            limit = self.concurrency[spec.name] = (spec.max_concurrency, asyncio.Semaphore(spec.max_concurrency))
+        return limit[1]
+
+    def scheduler_slot(self):
+        """Returns a context manager holding a global upstream call slot from the scheduler."""
+        if self.scheduler is None:
+            return contextlib.nullcontext()
+        return self.scheduler.slot()
+
+    @contextlib.asynccontextmanager
+    async def upstream_slots(self, spec: ModelSpec):
+        """Holds the model's concurrency slot and then a scheduler slot for one upstream attempt."""
+        async with self.concurrency_slot(spec), self.scheduler_slot():
+            yield
+
     async def make_request(self, model: str, prompt: str, parameters: dict = {}):
         """
         Makes a request to the OpenAI API.
 
+        The model's registry entry selects the upstream, the endpoint (chat or completion)
+        and the concurrency limit the call waits for; the call then waits for a scheduler
+        slot, or fails with a 503 if it would miss its queueing deadline. Transient failures
+        (429, 5xx, timeouts) are retried with exponential backoff and full jitter, honoring
+        upstream `Retry-After`; the slots are given up while backing off and taken again for
+        the next attempt. While the model's circuit breaker is open the call fails fast with a 503.
+
         Args:
             model (str): The OpenAI model to use.
             prompt (str): The input prompt for the model.
             parameters (dict, optional): Optional parameters for the API call. Defaults to {}.
 
         Returns:
-            dict: The response from the OpenAI API.
+            str: The completion text from the OpenAI API.
         """
+        spec = resolve_model(model)
+        adapter = ADAPTERS[spec.endpoint]
+        client = self.client_for(spec)
         try:
-            response = await openai.Completion.create(
-                model=model,
-                prompt=prompt,
-                **parameters
+            response = await call_with_resilience(
+                lambda: client.post_json(adapter.path, adapter.payload(spec, prompt, parameters)),
+                self.breakers.get(model),
+                self.retry_policy,
+                slot=lambda: self.upstream_slots(spec),
             )
-            return response.choices[0].text
-        except openai.error.APIError as e:
+            record_upstream_usage(response.get("usage"))
+            return adapter.text(response)
+        except HTTPException:
+            raise
+        except CircuitOpenError as e:
+            raise circuit_open_exception(e)
+        except UpstreamError as e:
             logger.error(f"Error while making OpenAI request: {e}")
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"OpenAI API Error: {e}")
         except Exception as e:
             logger.error(f"Unexpected error during OpenAI request: {e}")
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error")
 
-    async def get_response(self, model: str, prompt: str, parameters: dict = {}):
+    async def stream_response(self, model: str, prompt: str, parameters: dict = {}) -> AsyncIterator[str]:
+        """
+        Streams a completion from the OpenAI API as it is generated.
+
+        Streamed requests bypass the response cache and request coalescing.
+
+        Args:
+            model (str): The OpenAI model to use.
+            prompt (str): The input prompt for the model.
+            parameters (dict, optional): Optional parameters for the API call. Defaults to {}.
+
+        Yields:
+            str: Each text fragment as upstream produces it.
+        """
+        spec = resolve_model(model)
+        adapter = ADAPTERS[spec.endpoint]
+        client = self.client_for(spec)
+        parameters = spec.with_defaults(parameters)
+        breaker = self.breakers.get(model)
+        retry = 0
+        while True:
+            started = False
+            try:
+                # Slots are held per attempt and given up before backing off, as in make_request
+                async with self.upstream_slots(spec):
+                    # The breaker permit is taken once a slot is held, so a rejected or abandoned wait never holds it
+                    try:
+                        breaker.before_call()
+                    except CircuitOpenError as e:
+                        raise circuit_open_exception(e)
+                    recorded = False
+                    try:
+                        async for event in client.stream_events(adapter.path, adapter.payload(spec, prompt, parameters)):
+                            text = adapter.fragment(event)
+                            if text:
+                                started = True
+                                yield text
+                        breaker.record_success()
+                        recorded = True
+                    except UpstreamError as e:
+                        if not is_retryable(e):
+                            breaker.record_success()
+                        else:
+                            breaker.record_failure()
+                        recorded = True
+                        raise
+                    finally:
+                        if not recorded:
+                            # Client disconnect (GeneratorExit), cancellation or a local error: no outcome
+                            breaker.release()
+                record_upstream_usage()
+                return
+            except UpstreamError as e:
+                # Only retry before the first fragment; once text has been relayed it cannot be taken back
+                if started or not is_retryable(e) or retry >= self.retry_policy.max_retries:
+                    logger.error(f"Error while streaming OpenAI request: {e}")
+                    raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"OpenAI API Error: {e}")
+                UPSTREAM_RETRIES.labels(model=model, reason=str(e.status or "connection")).inc()
+                await asyncio.sleep(self.retry_policy.delay(retry, e.retry_after))
+                retry += 1
+
+    async def get_response(self, model: str, prompt: str, parameters: dict = {}, cache_control: Optional[str] = None):
         """
         Retrieves a response from the OpenAI API, handling caching if configured.
 
+        Deterministic requests are looked up in the response cache first. A `no-cache`
+        Cache-Control directive skips the lookup but still refreshes the cache, while
+        `no-store` bypasses the cache entirely. When the semantic cache is enabled, an exact
+        miss is looked up again by prompt similarity. Concurrent identical requests that
+        reach upstream are coalesced into a single call.
+
+        Args:
+            model (str): The OpenAI model to use.
+            prompt (str): The input prompt for the model.
+            parameters (dict, optional): Optional parameters for the API call. Defaults to {}.
+            cache_control (str, optional): The client's Cache-Control header. Defaults to None.
+
+        Returns:
+            str: The response from the OpenAI API.
+        """
+        # Registry defaults are part of the request, and so of its cache key
+        parameters = resolve_model(model).with_defaults(parameters)
+        key = make_cache_key(model, prompt, parameters)
+        directives = parse_cache_control(cache_control)
+        cacheable = False
+        if self.cache is not None:
+            reason = bypass_reason(parameters)
+            if reason is None and ("no-cache" in directives or "no-store" in directives):
+                reason = "cache_control"
+                cacheable = "no-store" not in directives
+            elif reason is None:
+                cacheable = True
+                with stage("cache"):
+                    cached = await self.cache.get(key)
+                    if cached is None and self.semantic_cache is not None:
+                        cached = await self.semantic_cache.get_async(model, prompt, parameters)
+                if cached is not None:
+                    return cached
+            if reason is not None:
+                CACHE_BYPASSES.labels(reason=reason).inc()
+
+        with stage("upstream"):
+            response = await self.fetch(key, model, prompt, parameters)
+        if cacheable:
+            with stage("cache"):
+                await self.cache.set(key, response)
+                if self.semantic_cache is not None:
+                    await self.semantic_cache.set_async(model, prompt, parameters, response)
+        return response
+
+    async def fetch(self, key: str, model: str, prompt: str, parameters: dict = {}):
+        """
+        Calls upstream, sharing one call among concurrent requests with the same key.
+
         Args:
+            key (str): The content-addressed key of the request.
             model (str): The OpenAI model to use.
             prompt (str): The input prompt for the model.
             parameters (dict, optional): Optional parameters for the API call. Defaults to {}.
@@ -59,10 +320,19 @@ class OpenAIUtils:
         Returns:
             str: The response from the OpenAI API.
         """
-        # Implement caching logic if needed (see section 7 for caching strategies)
-        return await self.make_request(model, prompt, parameters)
+        if self.singleflight is None:
+            return await self.make_request(model, prompt, parameters)
+        return await self.singleflight.do(key, lambda: self.make_request(model, prompt, parameters))
+
+def circuit_open_exception(error: CircuitOpenError) -> HTTPException:
+    """Maps an open circuit breaker to a 503 telling the client when to retry."""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="OpenAI API is temporarily unavailable.",
+        headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))},
+    )
 
-async def openai_request(model: str, prompt: str, parameters: dict = {}):
+async def openai_request(model: str, prompt: str, parameters: dict = {}, cache_control: Optional[str] = None):
     """
     A wrapper function for making OpenAI requests using the OpenAIUtils class.
 
@@ -70,9 +340,27 @@ async def openai_request(model: str, prompt: str, parameters: dict = {}):
         model (str): The OpenAI model to use.
         prompt (str): The input prompt for the model.
         parameters (dict, optional): Optional parameters for the API call. Defaults to {}.
+        cache_control (str, optional): The client's Cache-Control header. Defaults to None.
 
     Returns:
         str: The response from the OpenAI API.
     """
     openai_utils = OpenAIUtils.get_instance()
-    return await openai_utils.get_response(model, prompt, parameters)
\ No newline at end of file
+    return await openai_utils.get_response(model, prompt, parameters, cache_control)
+
+async def openai_stream(model: str, prompt: str, parameters: dict = {}) -> AsyncIterator[str]:
+    """
+    A wrapper function for streaming OpenAI completions using the OpenAIUtils class.
+
+    Args:
+        model (str): The OpenAI model to use.
+        prompt (str): The input prompt for the model.
+        parameters (dict, optional): Optional parameters for the API call. Defaults to {}.
+
+    Yields:
+        str: Each text fragment as upstream produces it.
+    """
+    openai_utils = OpenAIUtils.get_instance()
+    with stage("upstream"):
+        async for text in openai_utils.stream_response(model, prompt, parameters):
+            yield text
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import bcrypt
+from fastapi import HTTPException, status
+from prometheus_client import Counter, Gauge, Histogram
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics for the password hashing pool
+PASSWORD_OPERATIONS = Histogram(
+    "password_operation_seconds", "Time to hash or verify a password, including queueing", ["operation"]
+)
+PASSWORD_POOL_PENDING = Gauge(
+    "password_pool_pending", "Password operations running or queued", multiprocess_mode="livesum"
+)
+PASSWORD_POOL_REJECTIONS = Counter("password_pool_rejections_total", "Password operations rejected because the pool was full")
+
+POOL_MODES = ("thread", "process")
+
+def hash_password(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=rounds)).decode()
+
+def check_password(password: str, hashed_password: str) -> bool:
+    try:
+        return bcrypt.checkpw(password.encode(), hashed_password.encode())
+    except ValueError:
+        # Not a bcrypt hash (e.g. a legacy plaintext value); never matches
+        return False
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords with bcrypt on a dedicated, size-bounded pool.
+
+    bcrypt costs tens of milliseconds of CPU per call, which would stall every other request
+    on the event loop. Calls run on `pool_size` threads (bcrypt releases the GIL) or
+    processes; at most `max_queue` more may wait, and further calls are rejected with 503
+    instead of piling up. A `pool_size` of 0 runs bcrypt inline on the event loop, which is
+    only meant for tests and for benchmarking the difference.
+    """
+    def __init__(self, pool_size: int = 4, max_queue: int = 64, rounds: int = 12, mode: str = "thread"):
+        if mode not in POOL_MODES:
+            raise ValueError(f"Invalid password pool mode. Allowed modes are: {', '.join(POOL_MODES)}")
+        self.pool_size = pool_size
+        self.max_queue = max_queue
+        self.rounds = rounds
+        self.mode = mode
+        self.pending = 0
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        # Created on first use, i.e. inside the worker process after fork
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.pool_size)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, operation: str, fn: Callable[..., Any], *args) -> Any:
+        started = time.perf_counter()
+        if self.pool_size <= 0:
+            result = fn(*args)
+            PASSWORD_OPERATIONS.labels(operation=operation).observe(time.perf_counter() - started)
+            return result
+        if self.pending >= self.pool_size + self.max_queue:
+            PASSWORD_POOL_REJECTIONS.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many login attempts in progress. Please retry shortly.",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        PASSWORD_POOL_PENDING.set(self.pending)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+            PASSWORD_POOL_PENDING.set(self.pending)
+            PASSWORD_OPERATIONS.labels(operation=operation).observe(time.perf_counter() - started)
+
+    async def hash(self, password: str) -> str:
+        """
+        Hashes a password with the configured cost factor.
+
+        Raises:
+            HTTPException: 503 when the pool and its queue are full.
+        """
+        return await self._run("hash", hash_password, password, self.rounds)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        """
+        Checks a password against a stored bcrypt hash.
+
+        Raises:
+            HTTPException: 503 when the pool and its queue are full.
+        """
+        return await self._run("verify", check_password, password, hashed_password)
+
+password_hasher = PasswordHasher(
+    pool_size=settings.PASSWORD_POOL_SIZE,
+    max_queue=settings.PASSWORD_POOL_QUEUE,
+    rounds=settings.BCRYPT_ROUNDS,
+    mode=settings.PASSWORD_POOL_MODE,
+)
+
+def shutdown_password_pool():
+    """Stops the password pool's workers. Called on shutdown."""
+    password_hasher.shutdown()
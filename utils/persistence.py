@@ -0,0 +1,304 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import insert
+
+from .config import settings
+from .db import AsyncSessionLocal, Request, bulk_create_requests_async
+from . import storage
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics for write-behind persistence
+WRITE_BEHIND_QUEUE_DEPTH = Gauge("write_behind_queue_depth", "Request records waiting to be written", multiprocess_mode="livesum")
+WRITE_BEHIND_FLUSH_LATENCY = Histogram("write_behind_flush_latency_seconds", "Time to write one batch of request records")
+WRITE_BEHIND_ROWS = Counter("write_behind_rows_total", "Request records handled by the write-behind queue", ["outcome"])
+
+OVERFLOW_POLICIES = ("block", "drop", "spill")
+REQUEST_COLUMNS = ("model", "prompt", "parameters", "response", "user_id", "prompt_tokens", "completion_tokens", "cost")
+
+# Wakes the flush task when the queue is stopped
+_STOP = object()
+
+class WriteBehindQueue:
+    """
+    Buffers request records in memory and writes them to the `requests` table in batches.
+
+    A background task flushes whenever `batch_size` records are waiting or `flush_interval`
+    seconds have passed since the first one arrived. When the queue is full, the overflow
+    policy decides what `put` does: `block` waits for room, `drop` discards the record and
+    `spill` appends it to a JSON-lines file that is replayed once the queue drains.
+    """
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        max_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        overflow: str = "block",
+        spill_path: Optional[str] = None,
+        use_copy: bool = True,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Invalid overflow policy. Allowed policies are: {', '.join(OVERFLOW_POLICIES)}")
+        if overflow == "spill" and not spill_path:
+            raise ValueError("The spill overflow policy requires a spill path.")
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.use_copy = use_copy
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def start(self):
+        """Starts the background flush task."""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the flush task after writing every queued and spilled record."""
+        self._stopping = True
+        if self._task is not None:
+            try:
+                self.queue.put_nowait(_STOP)
+            except asyncio.QueueFull:
+                pass
+            await self._task
+            self._task = None
+        while not self.queue.empty():
+            await self._flush(self._drain(self.batch_size))
+        await self._replay_spill()
+
+    async def put(self, row: Dict[str, Any]) -> bool:
+        """
+        Queues a request record for writing.
+
+        Args:
+            row (dict): The `model`, `prompt`, `parameters`, `response` and `user_id` columns, and
+                optionally `prompt_tokens`, `completion_tokens` and `cost`.
+
+        Returns:
+            bool: False if the record was dropped because the queue was full.
+        """
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            if self.overflow == "drop":
+                WRITE_BEHIND_ROWS.labels(outcome="dropped").inc()
+                return False
+            if self.overflow == "spill":
+                await self._spill([row])
+                return True
+            await self.queue.put(row)
+        WRITE_BEHIND_QUEUE_DEPTH.set(self.queue.qsize())
+        return True
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                if not await self._flush_next():
+                    break
+            except Exception as e:
+                # One bad batch or spill file must not stop the flushing for good
+                logger.error(f"Error in the write-behind flush loop: {e}")
+                await asyncio.sleep(self.flush_interval)
+
+    async def _flush_next(self) -> bool:
+        """Waits for and writes the next batch. Returns False once the queue is stopped."""
+        try:
+            first = await asyncio.wait_for(self.queue.get(), timeout=self.flush_interval)
+        except asyncio.TimeoutError:
+            await self._replay_spill()
+            return True
+        if first is _STOP:
+            return False
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and not self._stopping:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                row = await asyncio.wait_for(self.queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if row is _STOP:
+                break
+            batch.append(row)
+        await self._flush(batch)
+        return True
+
+    def _drain(self, limit: int) -> List[Dict[str, Any]]:
+        rows = []
+        while len(rows) < limit:
+            try:
+                row = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if row is not _STOP:
+                rows.append(row)
+        return rows
+
+    async def _flush(self, rows: List[Dict[str, Any]]):
+        WRITE_BEHIND_QUEUE_DEPTH.set(self.queue.qsize())
+        if not rows:
+            return
+        # Every row gets every column (records spilled by older versions lack the token accounting)
+        rows = [{column: row.get(column) for column in REQUEST_COLUMNS} for row in rows]
+        started = time.perf_counter()
+        try:
+            await storage.prepare_payloads([row[column] for row in rows for column in ("prompt", "response")])
+            async with self.session_factory() as db:
+                if self.use_copy and db.bind.dialect.driver == "asyncpg":
+                    await self._copy(db, rows)
+                else:
+                    await db.execute(insert(Request), rows)
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Error writing {len(rows)} queued requests: {e}")
+            if self.spill_path:
+                await self._spill(rows)
+            else:
+                WRITE_BEHIND_ROWS.labels(outcome="dropped").inc(len(rows))
+            return
+        WRITE_BEHIND_FLUSH_LATENCY.observe(time.perf_counter() - started)
+        WRITE_BEHIND_ROWS.labels(outcome="written").inc(len(rows))
+
+    @staticmethod
+    async def _copy(db, rows: List[Dict[str, Any]]):
+        """Writes the batch with PostgreSQL COPY through the asyncpg driver connection."""
+        connection = await db.connection()
+        raw_connection = await connection.get_raw_connection()
+        # COPY bypasses the column types, so the payload codec is applied here
+        codec = storage.payload_codec
+        records = [
+            (
+                row["model"],
+                codec.encode_text(row["prompt"], "prompt"),
+                json.dumps(row["parameters"]),
+                json.dumps(codec.encode_json(row["response"], "response")),
+                row["user_id"],
+                row["prompt_tokens"],
+                row["completion_tokens"],
+                row["cost"],
+            )
+            for row in rows
+        ]
+        await raw_connection.driver_connection.copy_records_to_table(
+            Request.__tablename__, records=records, columns=list(REQUEST_COLUMNS)
+        )
+
+    async def _spill(self, rows: List[Dict[str, Any]]):
+        lines = "".join(json.dumps({column: row.get(column) for column in REQUEST_COLUMNS}) + "\n" for row in rows)
+
+        def append():
+            with open(self.spill_path, "a", encoding="utf-8") as spill_file:
+                spill_file.write(lines)
+
+        await asyncio.to_thread(append)
+        WRITE_BEHIND_ROWS.labels(outcome="spilled").inc(len(rows))
+
+    async def _replay_spill(self):
+        """Writes records spilled to disk once the in-memory queue has drained."""
+        if not self.spill_path or not self.queue.empty():
+            return
+        replay_path = f"{self.spill_path}.replay"
+
+        def read_spilled():
+            if os.path.exists(self.spill_path):
+                if os.path.exists(replay_path):
+                    # A replay interrupted by a crash: add to it rather than overwrite it
+                    with open(self.spill_path, "rb") as spill_file, open(replay_path, "ab+") as replay_file:
+                        replay_file.seek(0, os.SEEK_END)
+                        if replay_file.tell():
+                            # The crash may have torn the last line; keep it from swallowing the next one
+                            replay_file.seek(-1, os.SEEK_END)
+                            if replay_file.read(1) != b"\n":
+                                replay_file.write(b"\n")
+                        shutil.copyfileobj(spill_file, replay_file)
+                    os.remove(self.spill_path)
+                else:
+                    os.replace(self.spill_path, replay_path)
+            elif not os.path.exists(replay_path):
+                return None
+            rows, corrupt = [], 0
+            with open(replay_path, encoding="utf-8", errors="replace") as replay_file:
+                for number, line in enumerate(replay_file, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        row = json.loads(line)
+                        if not isinstance(row, dict):
+                            raise ValueError("not a JSON object")
+                    except ValueError as e:
+                        logger.error(f"Skipping line {number} of {replay_path}: {e}")
+                        corrupt += 1
+                        continue
+                    rows.append(row)
+            return rows, corrupt
+
+        spilled = await asyncio.to_thread(read_spilled)
+        if spilled is None:
+            return
+        rows, corrupt = spilled
+        if corrupt:
+            WRITE_BEHIND_ROWS.labels(outcome="dropped").inc(corrupt)
+        # Rows that fail to write are spilled again by _flush, so the file is only removed afterwards
+        for start in range(0, len(rows), self.batch_size):
+            await self._flush(rows[start:start + self.batch_size])
+        await asyncio.to_thread(os.remove, replay_path)
+
+write_behind_queue: Optional[WriteBehindQueue] = None
+
+def get_write_behind_queue() -> Optional[WriteBehindQueue]:
+    """Returns the running write-behind queue, or None when requests are written synchronously."""
+    return write_behind_queue
+
+async def start_write_behind():
+    """Creates and starts the write-behind queue if `PERSIST_MODE` is `write_behind`. Called on startup."""
+    global write_behind_queue
+    if settings.PERSIST_MODE != "write_behind" or write_behind_queue is not None:
+        return
+    write_behind_queue = WriteBehindQueue(
+        max_size=settings.WRITE_BEHIND_MAX_QUEUE,
+        batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+        flush_interval=settings.WRITE_BEHIND_FLUSH_INTERVAL,
+        overflow=settings.WRITE_BEHIND_OVERFLOW,
+        spill_path=settings.WRITE_BEHIND_SPILL_PATH,
+    )
+    await write_behind_queue.start()
+
+async def stop_write_behind():
+    """Flushes everything still queued and stops the write-behind queue. Called on shutdown."""
+    global write_behind_queue
+    if write_behind_queue is not None:
+        await write_behind_queue.stop()
+        write_behind_queue = None
+
+async def persist_requests(rows: List[Dict[str, Any]]) -> Optional[List[int]]:
+    """
+    Stores request records, through the write-behind queue when it is running.
+
+    Args:
+        rows (list): Dicts with the `model`, `prompt`, `parameters`, `response` and `user_id` columns,
+            and optionally `prompt_tokens`, `completion_tokens` and `cost`.
+
+    Returns:
+        list: The new request ids in the order of `rows`, or None when the records were queued.
+    """
+    if write_behind_queue is not None:
+        for row in rows:
+            await write_behind_queue.put(row)
+        return None
+    async with AsyncSessionLocal() as db:
+        return await bulk_create_requests_async(db, rows)
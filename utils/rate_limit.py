@@ -0,0 +1,278 @@
+import json
+import logging
+import math
+import time
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, status
+from prometheus_client import Counter
+
+from .config import settings
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# (model, exhausted limit, seconds to wait) when rejected, (None, None, 0) when admitted
+Admission = Tuple[Optional[str], Optional[str], float]
+
+# Prometheus metrics for rate limiting and token spend
+RATE_LIMITED = Counter("rate_limited_requests_total", "Requests rejected by the rate limiter", ["model", "limit"])
+RATE_LIMITER_ERRORS = Counter("rate_limiter_errors_total", "Rate limiter backend errors, by how the request was handled", ["outcome"])
+ESTIMATED_TOKENS = Counter("estimated_tokens_total", "Estimated prompt plus completion tokens admitted", ["model"])
+
+# The upstream default for max_tokens on completions
+DEFAULT_MAX_TOKENS = 16
+
+def estimate_tokens(prompt: str, parameters: Optional[dict] = None, prompt_tokens: Optional[int] = None) -> int:
+    """
+    Estimates the tokens a request will consume: its prompt tokens plus max_tokens. Without a
+    counted `prompt_tokens` the prompt is estimated at ~4 characters per token.
+    """
+    max_tokens = (parameters or {}).get("max_tokens") or DEFAULT_MAX_TOKENS
+    if prompt_tokens is None:
+        prompt_tokens = math.ceil(len(prompt) / 4)
+    return prompt_tokens + int(max_tokens)
+
+class RateLimit:
+    """Per-minute request and token limits for one model."""
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+def parse_rate_limits(raw: str) -> Dict[str, RateLimit]:
+    """
+    Parses the `RATE_LIMITS` setting, a JSON object mapping model names (or "default") to
+    `{"requests_per_minute": ..., "tokens_per_minute": ...}`.
+    """
+    return {
+        model: RateLimit(float(limit["requests_per_minute"]), float(limit["tokens_per_minute"]))
+        for model, limit in json.loads(raw).items()
+    }
+
+class TokenBucket:
+    """
+    A token bucket refilled continuously at `rate` tokens per second up to `capacity`.
+
+    It is only touched from the event loop and never awaits, so each check-and-take runs
+    atomically without a lock.
+    """
+    __slots__ = ("capacity", "rate", "tokens", "updated_at")
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated_at) * self.rate)
+        self.updated_at = max(self.updated_at, now)
+
+    def wait_time(self, cost: float) -> float:
+        """Seconds until `cost` tokens are available (0 if they already are)."""
+        if cost <= self.tokens:
+            return 0.0
+        if cost > self.capacity or self.rate <= 0:
+            return math.inf
+        return (cost - self.tokens) / self.rate
+
+class LocalRateLimiter:
+    """
+    Single-node rate limiter keeping one request bucket and one token bucket per (user, model).
+
+    Buckets live in an LRU cache of at most `max_keys` entries whose TTL is the time to refill
+    completely, so a bucket expiring is indistinguishable from a full one. A bucket evicted for
+    capacity starts over full, so with more active (user, model) pairs than `max_keys` the
+    least recently seen can briefly exceed their limit. Token spend is kept for the `max_keys`
+    most recently active users; the Redis backend keeps it for every user.
+    """
+    def __init__(self, limits: Dict[str, RateLimit], max_keys: int = 100000):
+        self.limits = limits
+        self.buckets = LRUCache(max_entries=max_keys, ttl=60.0, name="rate_limit")
+        self.spend = LRUCache(max_entries=max_keys, ttl=math.inf, name="rate_limit_spend")
+
+    def limit_for(self, model: str) -> RateLimit:
+        return self.limits.get(model) or self.limits["default"]
+
+    async def acquire(self, user_id: int, model: str, requests: int, tokens: int) -> Tuple[Optional[str], float]:
+        """
+        Takes `requests` and `tokens` from the user's buckets for `model` if both have room.
+
+        Returns:
+            tuple: `(None, 0)` when admitted, otherwise the exhausted limit ("requests" or
+            "tokens") and the seconds to wait before retrying.
+        """
+        _, exhausted, wait = await self.acquire_all(user_id, {model: (requests, tokens)})
+        return exhausted, wait
+
+    async def acquire_all(self, user_id: int, costs: Dict[str, Tuple[int, int]]) -> Admission:
+        """
+        Takes the `(requests, tokens)` cost of each model from the user's buckets, or nothing:
+        every bucket is checked before any is debited.
+
+        Returns:
+            tuple: `(None, None, 0)` when admitted, otherwise the model, the exhausted limit
+            and the seconds to wait before retrying.
+        """
+        now = time.monotonic()
+        buckets = []
+        for model, (requests, tokens) in costs.items():
+            limit = self.limit_for(model)
+            for kind, per_minute, cost in (("requests", limit.requests_per_minute, requests), ("tokens", limit.tokens_per_minute, tokens)):
+                key = (user_id, model, kind)
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(per_minute, per_minute / 60.0)
+                bucket.refill(now)
+                wait = bucket.wait_time(cost)
+                if wait > 0:
+                    return model, kind, wait
+                buckets.append((key, bucket, cost))
+        for key, bucket, cost in buckets:
+            bucket.tokens -= cost
+            self.buckets.set(key, bucket)
+        self.spend.set(user_id, (self.spend.get(user_id) or 0) + sum(tokens for _, tokens in costs.values()))
+        return None, None, 0.0
+
+    async def get_spend(self, user_id: int) -> int:
+        return self.spend.get(user_id) or 0
+
+# Atomically refills every bucket in KEYS and, only if all have room, takes from each and adds
+# the admitted tokens to the spend counter, the last key.
+# ARGV: the per-minute capacity and the cost of each bucket, in KEYS order, then the tokens spent.
+# Returns {0, 0} when admitted, otherwise {index of the exhausted bucket (from 1), wait in milliseconds}.
+TOKEN_BUCKET_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local buckets = #KEYS - 1
+local states = {}
+for i = 1, buckets do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = capacity / 60
+    local cost = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'updated_at')
+    local tokens = tonumber(state[1]) or capacity
+    local updated_at = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+    if cost > tokens then
+        if cost > capacity or rate <= 0 then
+            return {i, -1}
+        end
+        return {i, math.ceil((cost - tokens) / rate * 1000)}
+    end
+    states[i] = {tokens - cost, capacity / rate}
+end
+for i = 1, buckets do
+    redis.call('HSET', KEYS[i], 'tokens', states[i][1], 'updated_at', now)
+    redis.call('EXPIRE', KEYS[i], math.ceil(states[i][2]))
+end
+redis.call('INCRBY', KEYS[#KEYS], ARGV[#ARGV])
+return {0, 0}
+"""
+
+class RedisRateLimiter:
+    """
+    Multi-node rate limiter: the same two buckets per (user, model), kept in Redis and
+    updated atomically by a Lua script so every replica enforces one shared limit.
+    """
+    def __init__(self, client, limits: Dict[str, RateLimit], prefix: str = "ratelimit:"):
+        self.client = client
+        self.limits = limits
+        self.prefix = prefix
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str, limits: Dict[str, RateLimit]) -> "RedisRateLimiter":
+        import redis.asyncio as redis
+        return cls(redis.from_url(url), limits)
+
+    def limit_for(self, model: str) -> RateLimit:
+        return self.limits.get(model) or self.limits["default"]
+
+    async def acquire(self, user_id: int, model: str, requests: int, tokens: int) -> Tuple[Optional[str], float]:
+        """See `LocalRateLimiter.acquire`."""
+        _, exhausted, wait = await self.acquire_all(user_id, {model: (requests, tokens)})
+        return exhausted, wait
+
+    async def acquire_all(self, user_id: int, costs: Dict[str, Tuple[int, int]]) -> Admission:
+        """See `LocalRateLimiter.acquire_all`; one script call checks and debits every bucket and records the spend."""
+        buckets, keys, args = [], [], []
+        for model, (requests, tokens) in costs.items():
+            limit = self.limit_for(model)
+            for kind, per_minute, cost in (("requests", limit.requests_per_minute, requests), ("tokens", limit.tokens_per_minute, tokens)):
+                buckets.append((model, kind))
+                keys.append(f"{self.prefix}{user_id}:{model}:{kind}")
+                args += [per_minute, cost]
+        keys.append(f"{self.prefix}{user_id}:spend")
+        args.append(sum(tokens for _, tokens in costs.values()))
+        exhausted, wait_ms = await self.script(keys=keys, args=args)
+        if exhausted:
+            model, kind = buckets[int(exhausted) - 1]
+            return model, kind, math.inf if wait_ms < 0 else wait_ms / 1000
+        return None, None, 0.0
+
+    async def get_spend(self, user_id: int) -> int:
+        return int(await self.client.get(f"{self.prefix}{user_id}:spend") or 0)
+
+def build_rate_limiter():
+    """Creates the rate limiter described by the application settings, if enabled."""
+    if not settings.RATE_LIMIT_ENABLED:
+        return None
+    limits = parse_rate_limits(settings.RATE_LIMITS)
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        return RedisRateLimiter.from_url(settings.REDIS_URL, limits)
+    return LocalRateLimiter(limits)
+
+rate_limiter = build_rate_limiter()
+
+async def enforce_rate_limit(user_id: int, items: Iterable, limiter=None, prompt_tokens: Optional[Sequence[int]] = None):
+    """
+    Admits requests against the per-user, per-model limits or rejects them with 429.
+
+    Args:
+        user_id (int): The authenticated user's id.
+        items (Iterable): Objects with `model`, `prompt` and `parameters` (e.g. RequestSchema);
+            items for the same model are charged together.
+        limiter (optional): The limiter to use. Defaults to the configured one.
+        prompt_tokens (Sequence[int], optional): The counted prompt tokens of each item, from
+            `preflight`; prompts are estimated from their length otherwise.
+
+    Every model's limits are checked before any is charged, so a rejected batch costs nothing.
+
+    Raises:
+        HTTPException: 429 with a `Retry-After` header when a limit is exhausted, or 503 when the
+            limiter is unavailable and `RATE_LIMIT_FAIL_OPEN` is off.
+    """
+    limiter = limiter or rate_limiter
+    if limiter is None:
+        return
+    costs: Dict[str, list] = {}
+    for index, item in enumerate(items):
+        cost = costs.setdefault(item.model, [0, 0])
+        cost[0] += 1
+        cost[1] += estimate_tokens(item.prompt, item.parameters, prompt_tokens[index] if prompt_tokens is not None else None)
+    try:
+        model, exhausted, wait = await limiter.acquire_all(user_id, {model: tuple(cost) for model, cost in costs.items()})
+    except Exception as e:
+        # The limiter's backend (Redis) is unreachable: admit or refuse as RATE_LIMIT_FAIL_OPEN says
+        if settings.RATE_LIMIT_FAIL_OPEN:
+            RATE_LIMITER_ERRORS.labels(outcome="admitted").inc()
+            logger.warning(f"Rate limiter unavailable, admitting the request: {e}")
+            return
+        RATE_LIMITER_ERRORS.labels(outcome="rejected").inc()
+        logger.error(f"Rate limiter unavailable, rejecting the request: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Rate limiter unavailable.")
+    if exhausted is not None:
+        RATE_LIMITED.labels(model=model, limit=exhausted).inc()
+        if math.isinf(wait):
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=f"Request exceeds the {exhausted} per minute limit for {model}.",
+            )
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Rate limit exceeded for {model} ({exhausted} per minute).",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
+    for model, (_, tokens) in costs.items():
+        ESTIMATED_TOKENS.labels(model=model).inc(tokens)
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from prometheus_client import Counter
+
+from .config import settings
+from .db import check_db
+from .openai import OpenAIUtils
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics for readiness checks
+READINESS_CHECK_FAILURES = Counter("readiness_check_failures_total", "Failed readiness checks", ["check"])
+
+class ReadinessProbe:
+    """
+    Checks the dependencies a worker needs to serve requests, for the `/ready` endpoint.
+
+    `/health` only shows the process is up. The probe reports ready once startup has
+    finished (`started`) and every check passes within `timeout` seconds. A result is reused
+    for `cache_ttl` seconds and concurrent probes wait for the same run, so frequent probes
+    from several load balancers do not each query the database and upstream.
+    """
+    def __init__(self, checks: Dict[str, Callable[[], Awaitable[None]]], timeout: float = 2.0, cache_ttl: float = 5.0):
+        self.checks = checks
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.started = False
+        self._result: Optional[Tuple[bool, Dict[str, str]]] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _run_check(self, name: str, check: Callable[[], Awaitable[None]]) -> str:
+        try:
+            await asyncio.wait_for(check(), timeout=self.timeout)
+            return "ok"
+        except asyncio.TimeoutError:
+            reason = f"timed out after {self.timeout}s"
+        except Exception as e:
+            reason = str(e) or type(e).__name__
+        READINESS_CHECK_FAILURES.labels(check=name).inc()
+        logger.warning(f"Readiness check {name} failed: {reason}")
+        return reason
+
+    async def check(self) -> Tuple[bool, Dict[str, str]]:
+        """
+        Runs the checks, or returns the result of a run less than `cache_ttl` seconds old.
+
+        Returns:
+            tuple: Whether the worker is ready, and "ok" or the failure reason per check.
+        """
+        if not self.started:
+            return False, {"startup": "not finished"}
+        async with self._lock:
+            if self._result is None or time.monotonic() - self._checked_at >= self.cache_ttl:
+                names = list(self.checks)
+                outcomes = await asyncio.gather(*(self._run_check(name, self.checks[name]) for name in names))
+                self._result = (all(outcome == "ok" for outcome in outcomes), dict(zip(names, outcomes)))
+                self._checked_at = time.monotonic()
+            return self._result
+
+async def check_upstream():
+    """Pings the default upstream (or any member of the upstream pool)."""
+    await OpenAIUtils.get_instance().client.ping()
+
+def build_readiness_probe() -> ReadinessProbe:
+    """Creates the readiness probe described by the application settings."""
+    checks = {"database": check_db}
+    if settings.READINESS_CHECK_UPSTREAM:
+        checks["upstream"] = check_upstream
+    return ReadinessProbe(checks, timeout=settings.READINESS_TIMEOUT, cache_ttl=settings.READINESS_CACHE_TTL)
@@ -0,0 +1,192 @@
+import asyncio
+import contextlib
+import logging
+import random
+import time
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, Optional
+
+from prometheus_client import Counter, Gauge
+
+from .upstream import UpstreamError
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics for upstream retries and circuit breakers
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "Upstream calls retried after a transient failure", ["model", "reason"])
+CIRCUIT_STATE = Gauge(
+    "upstream_circuit_state", "Circuit breaker state per model (0 closed, 1 half-open, 2 open)", ["model"],
+    multiprocess_mode="livemax",
+)
+CIRCUIT_REJECTIONS = Counter("upstream_circuit_rejections_total", "Calls failed fast by an open circuit breaker", ["model"])
+
+# Statuses worth retrying: throttling and server-side failures. None means a timeout or connection error.
+RETRYABLE_STATUSES = frozenset({None, 408, 409, 429, 500, 502, 503, 504})
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling upstream while a circuit breaker is open.
+
+    Attributes:
+        retry_after (float): Seconds until the breaker lets a trial call through.
+    """
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit breaker for {name} is open")
+        self.retry_after = retry_after
+
+def is_retryable(error: UpstreamError) -> bool:
+    return error.status in RETRYABLE_STATUSES
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: before retry n (starting at 0) it sleeps a random
+    time in [0, min(max_delay, base_delay * 2**n)]. An upstream `Retry-After` hint replaces
+    the random delay, capped at `max_retry_after`.
+    """
+    def __init__(self, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 8.0, max_retry_after: float = 30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def delay(self, retry: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry)))
+
+class CircuitBreaker:
+    """
+    A closed/open/half-open circuit breaker.
+
+    After `failure_threshold` consecutive failures the breaker opens and fails calls fast
+    for `recovery_timeout` seconds. It then lets up to `half_open_max_calls` trial calls
+    through: a success closes it again, a failure re-opens it, and a call that ends without
+    an upstream outcome (cancelled, or a local error) gives its trial slot back.
+    """
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.failures = 0
+        self.opened_at = 0.0
+        self.half_open_calls = 0
+        self._set_state(CLOSED)
+
+    def _set_state(self, state: str):
+        self.state = state
+        CIRCUIT_STATE.labels(model=self.name).set(STATE_VALUES[state])
+
+    def before_call(self):
+        """
+        Admits or rejects a call.
+
+        Raises:
+            CircuitOpenError: While the breaker is open, or half-open with its trial calls in flight.
+        """
+        if self.state == OPEN:
+            remaining = self.opened_at + self.recovery_timeout - time.monotonic()
+            if remaining > 0:
+                CIRCUIT_REJECTIONS.labels(model=self.name).inc()
+                raise CircuitOpenError(self.name, remaining)
+            self._set_state(HALF_OPEN)
+            self.half_open_calls = 0
+        if self.state == HALF_OPEN:
+            if self.half_open_calls >= self.half_open_max_calls:
+                CIRCUIT_REJECTIONS.labels(model=self.name).inc()
+                raise CircuitOpenError(self.name, self.recovery_timeout)
+            self.half_open_calls += 1
+
+    def release(self):
+        """
+        Frees the trial slot of a call that ended without an upstream outcome, e.g. cancelled
+        or failed before reaching upstream. Such a call neither closes nor re-opens the breaker.
+        """
+        if self.state == HALF_OPEN and self.half_open_calls > 0:
+            self.half_open_calls -= 1
+
+    def record_success(self):
+        self.failures = 0
+        if self.state != CLOSED:
+            logger.info(f"Circuit breaker for {self.name} closed")
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(f"Circuit breaker for {self.name} opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+class CircuitBreakerRegistry:
+    """One circuit breaker per model, created on first use."""
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, self.failure_threshold, self.recovery_timeout, self.half_open_max_calls)
+            self.breakers[name] = breaker
+        return breaker
+
+async def call_with_resilience(
+    fn: Callable[[], Awaitable[Any]],
+    breaker: CircuitBreaker,
+    policy: RetryPolicy,
+    sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    slot: Callable[[], AsyncContextManager] = contextlib.nullcontext,
+) -> Any:
+    """
+    Calls upstream through a circuit breaker, retrying transient failures.
+
+    Each attempt holds its own `slot` (e.g. the concurrency and scheduler slots), taken
+    before the breaker permit and released before backing off, so a call waiting to retry
+    holds neither.
+
+    Args:
+        fn (Callable): A zero-argument coroutine function making the upstream call.
+        breaker (CircuitBreaker): The breaker guarding the model being called.
+        policy (RetryPolicy): The retry and backoff policy.
+        sleep (Callable, optional): The sleep used between attempts. Defaults to asyncio.sleep.
+        slot (Callable, optional): Returns the async context manager held during each attempt.
+            Defaults to holding nothing.
+
+    Returns:
+        Any: The result of the first successful attempt.
+
+    Raises:
+        CircuitOpenError: If the breaker is (or becomes) open.
+        UpstreamError: If a non-retryable error occurs or the retries are exhausted.
+    """
+    retry = 0
+    while True:
+        async with slot():
+            breaker.before_call()
+            try:
+                result = await fn()
+            except UpstreamError as e:
+                if not is_retryable(e):
+                    # The request itself was bad; upstream is healthy
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                if retry >= policy.max_retries:
+                    raise
+                error = e
+            except BaseException:
+                # Cancelled or failed before upstream answered: no outcome, but the permit must be returned
+                breaker.release()
+                raise
+            else:
+                breaker.record_success()
+                return result
+        UPSTREAM_RETRIES.labels(model=breaker.name, reason=str(error.status or "connection")).inc()
+        await sleep(policy.delay(retry, error.retry_after))
+        retry += 1
@@ -0,0 +1,46 @@
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+def _default(value: Any):
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(content: Any) -> bytes:
+    """
+    Serializes a response body to compact JSON bytes.
+
+    Pydantic models are serialized by pydantic-core directly, other content with orjson when
+    it is installed and with pydantic-core otherwise. Datetimes become ISO 8601 strings.
+
+    Args:
+        content (Any): A pydantic model or JSON-compatible data.
+
+    Returns:
+        bytes: The encoded body.
+    """
+    if isinstance(content, BaseModel):
+        return content.__pydantic_serializer__.to_json(content)
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return to_json(content)
+
+class FastJSONResponse(JSONResponse):
+    """
+    A JSONResponse rendered with `dumps`.
+
+    Handlers return it with an already-typed body, which also skips FastAPI's re-validation
+    of the return value against the route's `response_model` (kept for the OpenAPI schema).
+    """
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
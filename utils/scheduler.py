@@ -0,0 +1,238 @@
+import asyncio
+import contextlib
+import json
+import logging
+import math
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+
+from fastapi import HTTPException, status
+from prometheus_client import Counter, Gauge, Histogram
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics for the upstream call scheduler
+SCHEDULER_QUEUE_WAIT = Histogram(
+    "scheduler_queue_wait_seconds", "Time upstream calls waited for a scheduler slot", ["request_class"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+SCHEDULER_QUEUED = Gauge("scheduler_queued_calls", "Upstream calls waiting for a scheduler slot", ["request_class"], multiprocess_mode="livesum")
+SCHEDULER_INFLIGHT = Gauge("scheduler_inflight_calls", "Upstream calls holding a scheduler slot", multiprocess_mode="livesum")
+SCHEDULER_REJECTED = Counter("scheduler_rejected_total", "Upstream calls rejected by the scheduler", ["request_class", "reason"])
+
+# Weight of the newest sample in the slot hold time moving average
+SERVICE_TIME_EWMA_ALPHA = 0.2
+
+@dataclass(frozen=True)
+class RequestClass:
+    """
+    A scheduling class.
+
+    Attributes:
+        name (str): The class name, e.g. "interactive" or "batch".
+        weight (float): Its share of the slots while several classes are queued.
+        deadline (float): Longest a call may wait for a slot, in seconds; 0 waits indefinitely.
+    """
+    name: str
+    weight: float = 1.0
+    deadline: float = 0.0
+
+def parse_request_classes(raw: str) -> Dict[str, RequestClass]:
+    """
+    Parses the `SCHEDULER_CLASSES` setting, a JSON object mapping class names to
+    `{"weight": ..., "deadline": ...}`.
+
+    Raises:
+        ValueError: If the document is invalid or a weight is not positive.
+    """
+    try:
+        classes = {
+            name: RequestClass(name, float(entry.get("weight", 1)), float(entry.get("deadline", 0)))
+            for name, entry in json.loads(raw).items()
+        }
+    except (TypeError, AttributeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid scheduler classes: {e}") from e
+    if not classes or any(request_class.weight <= 0 for request_class in classes.values()):
+        raise ValueError("Scheduler classes need at least one class, each with a positive weight")
+    return classes
+
+# The scheduling class and deadline of the current request, set by the routers
+_request_class: ContextVar[Optional[str]] = ContextVar("request_class", default=None)
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+def set_request_class(name: str, deadline: Optional[float] = None):
+    """
+    Schedules the current request's upstream calls in class `name`.
+
+    Args:
+        name (str): The request class.
+        deadline (float, optional): A tighter queueing deadline for this request, in seconds.
+    """
+    _request_class.set(name)
+    _deadline.set(deadline)
+
+def request_class_for(route_class: str, username: Optional[str] = None) -> str:
+    """Returns the class for a route's calls, unless `SCHEDULER_USER_CLASSES` assigns the user another."""
+    return scheduler_user_classes.get(username, route_class) if username else route_class
+
+class _Waiter:
+    __slots__ = ("tag", "request_class", "future", "enqueued_at")
+
+    def __init__(self, tag: float, request_class: RequestClass, future: asyncio.Future, enqueued_at: float):
+        self.tag = tag
+        self.request_class = request_class
+        self.future = future
+        self.enqueued_at = enqueued_at
+
+class Scheduler:
+    """
+    Admission control and weighted fair queueing for upstream calls.
+
+    At most `max_concurrency` calls hold a slot at once. Further calls queue per request
+    class and are granted slots in order of their virtual finish tag (start-time fair
+    queueing), so while several classes are backlogged each gets slots in proportion to its
+    weight, and a lightly used class never waits behind the whole backlog of a heavy one.
+
+    A call whose projected wait (its queue position times the average slot hold time,
+    divided by the slots) exceeds its deadline is rejected at once with a 503 carrying its
+    queue position and a `Retry-After`; a call still queued at its deadline is rejected too.
+    """
+    def __init__(self, max_concurrency: int, classes: Dict[str, RequestClass], default_class: str):
+        if default_class not in classes:
+            raise ValueError(f"Unknown default scheduler class {default_class}")
+        self.max_concurrency = max_concurrency
+        self.classes = classes
+        self.default_class = default_class
+        self.inflight = 0
+        self.queues: Dict[str, Deque[_Waiter]] = {name: deque() for name in classes}
+        self.finish_tags: Dict[str, float] = {name: 0.0 for name in classes}
+        self.virtual_time = 0.0
+        self.service_time = 0.0
+
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def position(self, tag: float) -> int:
+        """The number of queued calls that will be granted a slot before one tagged `tag`."""
+        return sum(1 for queue in self.queues.values() for waiter in queue if waiter.tag <= tag)
+
+    def projected_wait(self, position: int) -> float:
+        return (position + 1) * self.service_time / self.max_concurrency
+
+    def resolve(self, name: Optional[str]) -> RequestClass:
+        return self.classes.get(name or self.default_class) or self.classes[self.default_class]
+
+    @contextlib.asynccontextmanager
+    async def slot(self, name: Optional[str] = None, deadline: Optional[float] = None):
+        """
+        Holds a slot for the enclosed upstream call.
+
+        Args:
+            name (str, optional): The request class; defaults to the current request's class.
+            deadline (float, optional): Overrides the class deadline, if tighter.
+
+        Raises:
+            HTTPException: 503 when the call cannot get a slot within its deadline.
+        """
+        request_class = self.resolve(name or _request_class.get())
+        deadline = deadline if deadline is not None else _deadline.get()
+        if request_class.deadline and (deadline is None or deadline > request_class.deadline):
+            deadline = request_class.deadline
+        await self.acquire(request_class, deadline)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    async def acquire(self, request_class: RequestClass, deadline: Optional[float]):
+        now = time.monotonic()
+        if self.inflight < self.max_concurrency and not self.queued():
+            self.inflight += 1
+            SCHEDULER_INFLIGHT.inc()
+            SCHEDULER_QUEUE_WAIT.labels(request_class=request_class.name).observe(0)
+            return
+        tag = max(self.virtual_time, self.finish_tags[request_class.name]) + 1 / request_class.weight
+        position = self.position(tag)
+        projected = self.projected_wait(position)
+        if deadline and projected > deadline:
+            SCHEDULER_REJECTED.labels(request_class=request_class.name, reason="projected_wait").inc()
+            raise overloaded_exception(position + 1, projected)
+
+        self.finish_tags[request_class.name] = tag
+        waiter = _Waiter(tag, request_class, asyncio.get_running_loop().create_future(), now)
+        self.queues[request_class.name].append(waiter)
+        SCHEDULER_QUEUED.labels(request_class=request_class.name).inc()
+        try:
+            await asyncio.wait_for(waiter.future, timeout=deadline or None)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            SCHEDULER_REJECTED.labels(request_class=request_class.name, reason="deadline").inc()
+            raise overloaded_exception(self.position(tag) + 1, self.projected_wait(self.position(tag)))
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter: _Waiter):
+        if waiter.future.done() and not waiter.future.cancelled():
+            # The slot was granted just as the caller gave up: hand it on
+            self.release(None)
+            return
+        queue = self.queues[waiter.request_class.name]
+        if waiter in queue:
+            queue.remove(waiter)
+            SCHEDULER_QUEUED.labels(request_class=waiter.request_class.name).dec()
+
+    def release(self, held: Optional[float]):
+        self.inflight -= 1
+        SCHEDULER_INFLIGHT.dec()
+        if held is not None:
+            self.service_time = held if self.service_time == 0 else (
+                SERVICE_TIME_EWMA_ALPHA * held + (1 - SERVICE_TIME_EWMA_ALPHA) * self.service_time
+            )
+        self._dispatch()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self.inflight < self.max_concurrency:
+            heads = [queue for queue in self.queues.values() if queue]
+            if not heads:
+                return
+            waiter = min(heads, key=lambda queue: queue[0].tag).popleft()
+            SCHEDULER_QUEUED.labels(request_class=waiter.request_class.name).dec()
+            if waiter.future.done():
+                continue
+            self.virtual_time = waiter.tag
+            self.inflight += 1
+            SCHEDULER_INFLIGHT.inc()
+            SCHEDULER_QUEUE_WAIT.labels(request_class=waiter.request_class.name).observe(now - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+def overloaded_exception(position: int, projected_wait: float) -> HTTPException:
+    """A 503 telling the client where it stood in the queue and when to retry."""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail={
+            "message": "Too many requests are queued for the OpenAI API.",
+            "queue_position": position,
+            "projected_wait": round(projected_wait, 3),
+        },
+        headers={"Retry-After": str(max(1, math.ceil(projected_wait)))},
+    )
+
+def build_scheduler() -> Optional[Scheduler]:
+    """Creates the scheduler described by the application settings, or None when it is disabled."""
+    if settings.SCHEDULER_MAX_CONCURRENCY <= 0:
+        return None
+    return Scheduler(
+        settings.SCHEDULER_MAX_CONCURRENCY,
+        parse_request_classes(settings.SCHEDULER_CLASSES),
+        settings.SCHEDULER_DEFAULT_CLASS,
+    )
+
+scheduler_user_classes: Dict[str, str] = json.loads(settings.SCHEDULER_USER_CLASSES) if settings.SCHEDULER_USER_CLASSES else {}
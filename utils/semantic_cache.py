@@ -0,0 +1,350 @@
+import asyncio
+import importlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from prometheus_client import Counter, Histogram
+
+from .config import settings
+from .cache import CACHE_EVICTIONS, CACHE_HITS, make_cache_key
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics for the semantic cache; its hits count towards response_cache_hits_total{tier="semantic"}
+SEMANTIC_CACHE_MISSES = Counter("semantic_cache_misses_total", "Semantic cache lookups without a close enough entry")
+SEMANTIC_CACHE_LOOKUP = Histogram(
+    "semantic_cache_lookup_seconds", "Time to embed a prompt and search the index",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+SEMANTIC_CACHE_SIMILARITY = Histogram(
+    "semantic_cache_similarity", "Cosine similarity of the nearest entry found",
+    buckets=(0.5, 0.7, 0.8, 0.85, 0.9, 0.925, 0.95, 0.975, 0.99, 1.0),
+)
+
+_WORDS = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+class HashingEmbedder:
+    """
+    A deterministic, dependency-free embedder using the hashing trick.
+
+    Words, word bigrams and character 4-grams of the normalized prompt (lower-cased, with
+    punctuation and repeated whitespace dropped) are hashed into `dim` signed buckets and
+    the vector is L2-normalized. Prompts differing only in casing, spacing or punctuation
+    embed identically and small edits stay close; it has no notion of synonyms.
+    """
+    name = "hashing"
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def features(self, text: str) -> List[Tuple[str, float]]:
+        words = _WORDS.findall(text.lower())
+        normalized = " ".join(words)
+        features = [(word, 1.0) for word in words]
+        features += [(f"{first} {second}", 1.0) for first, second in zip(words, words[1:])]
+        features += [(f"#{normalized[i:i + 4]}", 0.5) for i in range(max(0, len(normalized) - 3))]
+        return features
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in self.features(text):
+            digest = zlib.crc32(feature.encode())
+            vector[digest % self.dim] += weight if digest & 0x80000000 else -weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+def load_embedder(name: str, dim: int):
+    """
+    Returns the embedder called `name`: "hashing", or "package.module:factory" for a local
+    model wrapper. A factory is called with `dim` and must return an object with a `name`,
+    a `dim` and an `embed(text) -> np.ndarray` returning unit-length vectors.
+    """
+    if name == "hashing":
+        return HashingEmbedder(dim)
+    module_name, _, factory = name.partition(":")
+    if not factory:
+        raise ValueError(f"Invalid embedder {name}. Use \"hashing\" or \"package.module:factory\"")
+    return getattr(importlib.import_module(module_name), factory)(dim)
+
+def fit_centroids(data: np.ndarray, iterations: int = 8, seed: int = 0) -> np.ndarray:
+    """Fits about sqrt(n) IVF centroids to unit-vector rows with spherical k-means."""
+    lists = max(1, int(np.sqrt(len(data))))
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), lists, replace=False)]
+    for _ in range(iterations):
+        assignments = np.argmax(data @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Keep the previous centroid for lists that ended up empty
+        centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+    return centroids.astype(np.float32)
+
+class VectorIndex:
+    """
+    A bounded, in-memory approximate nearest-neighbour index over unit vectors.
+
+    Vectors live in one preallocated float32 matrix of `capacity` rows, so memory is fixed
+    up front. Rows are recycled least-recently-used first. Below `train_size` rows a lookup
+    is an exact scan; from then on the index is IVF-partitioned: rows are assigned to the
+    nearest of about sqrt(n) k-means centroids, and a lookup only scores rows in the
+    `nprobe` lists closest to the query. `needs_training` turns true once `train_size` rows
+    are live and, since the last training, rows amounting to `retrain_churn` of the index
+    have been added or recycled, so the centroids follow the data even when it no longer grows.
+    """
+    def __init__(self, dim: int, capacity: int, nprobe: int = 8, train_size: int = 2048, retrain_churn: float = 0.5):
+        self.dim = dim
+        self.capacity = capacity
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.retrain_churn = retrain_churn
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.groups = np.zeros(capacity, dtype=np.int64)
+        self.assignments = np.full(capacity, -1, dtype=np.int32)
+        self.payloads: List[Optional[Any]] = [None] * capacity
+        self.expires_at = np.zeros(capacity, dtype=np.float64)
+        self.recency: "OrderedDict[int, None]" = OrderedDict()
+        self.size = 0
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_size = 0
+        # Rows added or recycled since the last training
+        self.changes = 0
+
+    def __len__(self):
+        return len(self.recency)
+
+    def _slot(self) -> int:
+        if self.size < self.capacity:
+            self.size += 1
+            return self.size - 1
+        slot, _ = self.recency.popitem(last=False)
+        CACHE_EVICTIONS.labels(cache="semantic", reason="capacity").inc()
+        return slot
+
+    def add(self, vector: np.ndarray, group: int, payload: Any, ttl: float):
+        slot = self._slot()
+        self.vectors[slot] = vector
+        self.groups[slot] = group
+        self.payloads[slot] = payload
+        self.expires_at[slot] = time.monotonic() + ttl
+        self.recency[slot] = None
+        self.recency.move_to_end(slot)
+        if self.centroids is not None:
+            self.assignments[slot] = int(np.argmax(self.centroids @ vector))
+        self.changes += 1
+
+    @property
+    def needs_training(self) -> bool:
+        live = len(self.recency)
+        return live >= self.train_size and self.changes >= max(1, live * self.retrain_churn)
+
+    def training_data(self) -> np.ndarray:
+        """A copy of the live rows, to fit centroids on while the index keeps serving."""
+        return self.vectors[np.fromiter(self.recency, dtype=np.int64)]
+
+    def install(self, centroids: np.ndarray):
+        """Switches to new centroids, reassigning every live row, including those added since they were fitted."""
+        rows = np.fromiter(self.recency, dtype=np.int64)
+        self.assignments[rows] = np.argmax(self.vectors[rows] @ centroids.T, axis=1)
+        self.centroids = centroids
+        self.trained_size = len(rows)
+        self.changes = 0
+
+    def train(self, iterations: int = 8, seed: int = 0):
+        """Fits the IVF centroids with spherical k-means over the current rows."""
+        self.install(fit_centroids(self.training_data(), iterations, seed))
+
+    def search(self, vector: np.ndarray, group: int) -> Tuple[Optional[int], float]:
+        """Returns the live row in `group` most similar to `vector` and its cosine similarity."""
+        if not self.recency:
+            return None, 0.0
+        now = time.monotonic()
+        if self.centroids is None:
+            # Exact scan: score every row in place rather than gathering the live ones first
+            scores = self.vectors[:self.size] @ vector
+            scores[(self.groups[:self.size] != group) | (self.expires_at[:self.size] <= now)] = -np.inf
+            best = int(np.argmax(scores))
+            return (best, float(scores[best])) if np.isfinite(scores[best]) else (None, 0.0)
+        probes = np.argsort(self.centroids @ vector)[-self.nprobe:]
+        candidates = np.flatnonzero(np.isin(self.assignments[:self.size], probes))
+        candidates = candidates[(self.groups[candidates] == group) & (self.expires_at[candidates] > now)]
+        if not len(candidates):
+            return None, 0.0
+        scores = self.vectors[candidates] @ vector
+        best = int(np.argmax(scores))
+        return int(candidates[best]), float(scores[best])
+
+    def touch(self, slot: int):
+        self.recency.move_to_end(slot)
+
+    def state(self) -> Dict[str, Any]:
+        rows = np.fromiter(self.recency, dtype=np.int64)
+        now = time.monotonic()
+        return {
+            "vectors": self.vectors[rows],
+            "groups": self.groups[rows],
+            "ttl": np.maximum(self.expires_at[rows] - now, 0),
+            "payloads": [self.payloads[row] for row in rows],
+        }
+
+class SemanticCache:
+    """
+    Serves cached responses to prompts that are close to, not just equal to, earlier ones.
+
+    Each model has its own `VectorIndex`. Entries are grouped by the rest of the request
+    (model and parameters), so a match never crosses different parameters, and a hit needs
+    a cosine similarity of at least `threshold`. Like the exact cache it only holds
+    deterministic requests; `OpenAIUtils.get_response` consults it after an exact miss.
+
+    The event loop uses `get_async` and `set_async`, which embed and search on a single
+    thread that owns the indexes, so no lock is needed and requests are never stalled by
+    it. An index that needs training is retrained in the background: its centroids are
+    fitted on a copy of its rows in another thread and then installed on the owning thread.
+    """
+    def __init__(
+        self,
+        embedder,
+        threshold: float = 0.92,
+        max_entries: int = 10000,
+        ttl: float = 3600.0,
+        nprobe: int = 8,
+        train_size: int = 2048,
+    ):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.indexes: Dict[str, VectorIndex] = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="semantic-cache")
+        self._training: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def index(self, model: str) -> VectorIndex:
+        index = self.indexes.get(model)
+        if index is None:
+            index = self.indexes[model] = VectorIndex(self.embedder.dim, self.max_entries, self.nprobe, self.train_size)
+        return index
+
+    @staticmethod
+    def group(model: str, parameters: dict) -> int:
+        """A 63-bit id of everything but the prompt."""
+        return int(make_cache_key(model, "", parameters)[:15], 16)
+
+    def get(self, model: str, prompt: str, parameters: dict) -> Optional[Any]:
+        started = time.perf_counter()
+        index = self.indexes.get(model)
+        slot, similarity = (None, 0.0)
+        if index is not None:
+            slot, similarity = index.search(self.embedder.embed(prompt), self.group(model, parameters))
+        SEMANTIC_CACHE_LOOKUP.observe(time.perf_counter() - started)
+        if slot is not None:
+            SEMANTIC_CACHE_SIMILARITY.observe(similarity)
+        if slot is None or similarity < self.threshold:
+            SEMANTIC_CACHE_MISSES.inc()
+            return None
+        index.touch(slot)
+        CACHE_HITS.labels(tier="semantic").inc()
+        return index.payloads[slot]
+
+    def add(self, model: str, prompt: str, parameters: dict, response: Any) -> VectorIndex:
+        index = self.index(model)
+        index.add(self.embedder.embed(prompt), self.group(model, parameters), response, self.ttl)
+        return index
+
+    def set(self, model: str, prompt: str, parameters: dict, response: Any):
+        """Adds an entry, retraining its index in place if needed. `set_async` is the event loop's version."""
+        index = self.add(model, prompt, parameters, response)
+        if index.needs_training:
+            index.train()
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Runs `fn(*args)` on the thread that owns the indexes."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def get_async(self, model: str, prompt: str, parameters: dict) -> Optional[Any]:
+        return await self.run(self.get, model, prompt, parameters)
+
+    async def set_async(self, model: str, prompt: str, parameters: dict, response: Any):
+        index = await self.run(self.add, model, prompt, parameters, response)
+        if index.needs_training and model not in self._training:
+            self._training.add(model)
+            task = asyncio.create_task(self._retrain(model, index))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _retrain(self, model: str, index: VectorIndex):
+        try:
+            data = await self.run(index.training_data)
+            centroids = await asyncio.to_thread(fit_centroids, data)
+            await self.run(index.install, centroids)
+        except Exception as e:
+            logger.error(f"Error retraining the semantic cache index of {model}: {e}")
+        finally:
+            self._training.discard(model)
+
+    def save(self, path: str):
+        """Writes every live entry to `path` (a .npz archive), atomically."""
+        arrays, meta = {}, {"embedder": self.embedder.name, "dim": self.embedder.dim, "models": []}
+        for position, (model, index) in enumerate(self.indexes.items()):
+            state = index.state()
+            meta["models"].append({"model": model, "payloads": state["payloads"]})
+            arrays[f"vectors_{position}"] = state["vectors"]
+            arrays[f"groups_{position}"] = state["groups"]
+            arrays[f"ttl_{position}"] = state["ttl"]
+        directory = os.path.dirname(os.path.abspath(path))
+        handle, temporary_path = tempfile.mkstemp(dir=directory, suffix=".npz")
+        try:
+            with os.fdopen(handle, "wb") as snapshot_file:
+                np.savez_compressed(snapshot_file, meta=np.array(json.dumps(meta)), **arrays)
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+    def load(self, path: str) -> int:
+        """
+        Restores entries saved by `save`, keeping their remaining TTL.
+
+        Returns:
+            int: The number of entries restored; 0 if the snapshot was made with another embedder.
+        """
+        with np.load(path, allow_pickle=False) as snapshot:
+            meta = json.loads(str(snapshot["meta"]))
+            if meta["embedder"] != self.embedder.name or meta["dim"] != self.embedder.dim:
+                logger.warning(f"Ignoring semantic cache snapshot made with {meta['embedder']}/{meta['dim']}")
+                return 0
+            restored = 0
+            for position, entry in enumerate(meta["models"]):
+                index = self.index(entry["model"])
+                vectors, groups, ttls = snapshot[f"vectors_{position}"], snapshot[f"groups_{position}"], snapshot[f"ttl_{position}"]
+                for vector, group, ttl, payload in zip(vectors, groups, ttls, entry["payloads"]):
+                    if ttl > 0:
+                        index.add(vector, int(group), payload, float(ttl))
+                        restored += 1
+                if index.needs_training:
+                    index.train()
+        return restored
+
+def build_semantic_cache() -> Optional[SemanticCache]:
+    """Creates the semantic cache described by the application settings, if enabled."""
+    if not settings.CACHE_ENABLED or not settings.SEMANTIC_CACHE_ENABLED:
+        return None
+    return SemanticCache(
+        load_embedder(settings.SEMANTIC_CACHE_EMBEDDER, settings.SEMANTIC_CACHE_DIM),
+        threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+        max_entries=settings.SEMANTIC_CACHE_MAX_ENTRIES,
+        ttl=settings.SEMANTIC_CACHE_TTL,
+        nprobe=settings.SEMANTIC_CACHE_NPROBE,
+    )
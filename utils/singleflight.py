@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics for request coalescing
+COALESCED_CALLS = Counter("upstream_coalesced_calls_total", "Calls that joined an identical in-flight upstream call")
+LEADER_CALLS = Counter("upstream_leader_calls_total", "Calls that started a new upstream call")
+INFLIGHT_KEYS = Gauge("upstream_inflight_keys", "Distinct upstream calls currently in flight", multiprocess_mode="livesum")
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into a single execution.
+
+    The first caller for a key starts the work as a task; callers arriving while it is
+    in flight await the same task and receive its result or its exception. The entry is
+    removed as soon as the task finishes, so later calls start a fresh execution.
+    """
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs `fn` once for all concurrent callers sharing `key`.
+
+        Args:
+            key (str): Identifies calls that may share a result.
+            fn (Callable): A zero-argument coroutine function producing the result.
+
+        Returns:
+            Any: The result of the shared call.
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            COALESCED_CALLS.inc()
+        else:
+            LEADER_CALLS.inc()
+            future = asyncio.ensure_future(fn())
+            self._inflight[key] = future
+            INFLIGHT_KEYS.inc()
+            future.add_done_callback(lambda _: self._forget(key, future))
+        # Shield the shared task so one cancelled caller does not cancel it for the others
+        return await asyncio.shield(future)
+
+    def _forget(self, key: str, future: asyncio.Future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+            INFLIGHT_KEYS.dec()
+        if not future.cancelled() and future.exception() is not None:
+            # Retrieve the exception so an abandoned task does not log "never retrieved"
+            logger.debug(f"Coalesced upstream call failed: {future.exception()}")
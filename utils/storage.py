@@ -0,0 +1,429 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import zlib
+from collections import Counter as Tally
+from typing import Any, Dict, Iterable, List, Optional
+
+from prometheus_client import Counter
+from sqlalchemy import JSON, String, type_coerce
+from sqlalchemy.types import TypeDecorator
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics for the request payload storage codec
+STORAGE_BYTES = Counter("payload_storage_bytes_total", "Prompt and response bytes before and after encoding", ["column", "stage"])
+STORAGE_PAYLOADS = Counter("payload_storage_payloads_total", "Prompt and response payloads written, by stored form", ["column", "form"])
+BLOB_DEDUPLICATED = Counter("blob_store_deduplicated_total", "Offloaded payloads already present in the blob store")
+
+CODECS = ("none", "zlib", "zstd")
+
+# Encoded values start with a record separator, which ordinary prompts and responses never do:
+#   \x1ez:<codec>:<dictionary id>:<kind>:<base85 data>   compressed inline
+#   \x1eb:<kind>:<sha256>                               offloaded to the blob store
+#   \x1er:<text>                                        plain text that itself starts with \x1e
+# <kind> is "t" for text and "j" for a JSON document.
+MARKER = "\x1e"
+ZLIB_MAX_DICTIONARY = 32768
+
+# Columns that go through the codec, and whether each holds text or a JSON document
+PAYLOAD_COLUMNS = {"prompt": "t", "response": "j"}
+
+# Blob keys known to be stored are remembered up to this many, then forgotten all at once
+STORED_KEYS_MAX = 100000
+
+class ZlibCodec:
+    name = "zlib"
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes, dictionary: bytes = b"") -> bytes:
+        if dictionary:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY, dictionary)
+        else:
+            compressor = zlib.compressobj(self.level)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: bytes, dictionary: bytes = b"") -> bytes:
+        decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+        return decompressor.decompress(data) + decompressor.flush()
+
+class ZstdCodec:
+    """zstd through the optional `zstandard` package, with dictionaries digested once."""
+    name = "zstd"
+
+    def __init__(self, level: int = 3):
+        import zstandard
+        self.zstandard = zstandard
+        self.level = level
+        self._dictionaries: Dict[bytes, Any] = {}
+
+    def _dictionary(self, dictionary: bytes):
+        compression_dictionary = self._dictionaries.get(dictionary)
+        if compression_dictionary is None:
+            compression_dictionary = self.zstandard.ZstdCompressionDict(dictionary)
+            compression_dictionary.precompute_compress(level=self.level)
+            self._dictionaries[dictionary] = compression_dictionary
+        return compression_dictionary
+
+    def compress(self, data: bytes, dictionary: bytes = b"") -> bytes:
+        # Compressor objects are not thread-safe, so one is created per call; that is cheap
+        # once the dictionary has been digested
+        dict_data = self._dictionary(dictionary) if dictionary else None
+        return self.zstandard.ZstdCompressor(level=self.level, dict_data=dict_data).compress(data)
+
+    def decompress(self, data: bytes, dictionary: bytes = b"") -> bytes:
+        dict_data = self._dictionary(dictionary) if dictionary else None
+        return self.zstandard.ZstdDecompressor(dict_data=dict_data).decompress(data)
+
+def make_codec(name: str, level: Optional[int] = None):
+    """Returns the codec called `name`, or None for "none"."""
+    if name not in CODECS:
+        raise ValueError(f"Invalid storage codec. Allowed codecs are: {', '.join(CODECS)}")
+    if name == "zlib":
+        return ZlibCodec(level if level is not None else 6)
+    if name == "zstd":
+        return ZstdCodec(level if level is not None else 3)
+    return None
+
+def dictionary_id(dictionary: bytes) -> str:
+    return hashlib.sha256(dictionary).hexdigest()[:16]
+
+def train_dictionary(samples: Iterable[bytes], codec: str = "zlib", size: int = ZLIB_MAX_DICTIONARY) -> bytes:
+    """
+    Builds a compression dictionary from sample prompts or responses.
+
+    zstd uses its own trainer. zlib only supports a preset window of up to 32 KiB, so its
+    dictionary is made of the most frequent lines and words in the samples, the most
+    frequent last (where back-references are cheapest).
+
+    Args:
+        samples (Iterable[bytes]): Representative payloads.
+        codec (str, optional): "zlib" or "zstd". Defaults to "zlib".
+        size (int, optional): Maximum dictionary size in bytes. Defaults to 32768.
+
+    Returns:
+        bytes: The dictionary.
+    """
+    samples = list(samples)
+    if codec == "zstd":
+        import zstandard
+        return zstandard.train_dictionary(size, samples).as_bytes()
+    size = min(size, ZLIB_MAX_DICTIONARY)
+    fragments: Tally = Tally()
+    for sample in samples:
+        for line in sample.splitlines(keepends=True):
+            fragments[line] += 1
+            for word in line.split():
+                fragments[word + b" "] += 1
+    # Weight by the bytes a fragment would save, and skip ones seen only once
+    ranked = sorted(
+        (fragment for fragment, count in fragments.items() if count > 1),
+        key=lambda fragment: fragments[fragment] * len(fragment),
+    )
+    dictionary, total = [], 0
+    for fragment in reversed(ranked):
+        if total + len(fragment) > size:
+            continue
+        dictionary.append(fragment)
+        total += len(fragment)
+    return b"".join(reversed(dictionary))
+
+class BlobStore:
+    """
+    Content-addressed payload store on the local filesystem (a stand-in for object storage).
+
+    Blobs are keyed by the SHA-256 of the original payload, so a payload stored twice is
+    written once. Files are written to a temporary name and renamed into place, which keeps
+    concurrent writers of the same blob from exposing a partial file.
+    """
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def put(self, key: str, data: bytes) -> bool:
+        """Stores `data` under `key` unless it is already present; returns whether it was written."""
+        path = self.path(key)
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(handle, "wb") as blob_file:
+                blob_file.write(data)
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        return True
+
+    def get(self, key: str) -> bytes:
+        with open(self.path(key), "rb") as blob_file:
+            return blob_file.read()
+
+class PayloadCodec:
+    """
+    Encodes prompt and response values for storage and decodes them on read.
+
+    Values shorter than `min_size` bytes are stored as they are. Larger ones are compressed
+    with `codec` (and `dictionary`, if any); payloads of `offload_threshold` bytes or more
+    go to `blob_store` and only their content hash is stored in the row. Decoding does not
+    depend on the current settings: rows written under an earlier codec, dictionary or with
+    no codec at all stay readable, which makes the codec safe to turn on for an existing table.
+
+    Args:
+        codec (str, optional): "none", "zlib" or "zstd". Defaults to "none".
+        dictionary (bytes, optional): Compression dictionary, e.g. from `train_dictionary`.
+        min_size (int, optional): Smallest payload, in bytes, worth compressing. Defaults to 256.
+        offload_threshold (int, optional): Payloads this large go to the blob store; 0 disables offloading.
+        blob_store (BlobStore, optional): Where offloaded payloads and dictionaries are kept.
+        level (int, optional): Compression level. Defaults to the codec's default.
+    """
+    def __init__(
+        self,
+        codec: str = "none",
+        dictionary: bytes = b"",
+        min_size: int = 256,
+        offload_threshold: int = 0,
+        blob_store: Optional[BlobStore] = None,
+        level: Optional[int] = None,
+    ):
+        self.codec = make_codec(codec, level)
+        self.dictionary = dictionary
+        self.dictionary_id = dictionary_id(dictionary) if dictionary else "-"
+        self.min_size = min_size
+        self.offload_threshold = offload_threshold
+        self.blob_store = blob_store
+        self._codecs: Dict[str, Any] = {self.codec.name: self.codec} if self.codec else {}
+        self._dictionaries: Dict[str, bytes] = {"-": b""}
+        self._stored_keys: set = set()
+        if dictionary:
+            self._dictionaries[self.dictionary_id] = dictionary
+            if blob_store is not None:
+                # Kept next to the blobs so rows compressed with it can be read after it is replaced
+                blob_store.put(f"dictionary-{self.dictionary_id}", dictionary)
+
+    @property
+    def enabled(self) -> bool:
+        return self.codec is not None or bool(self.offload_threshold and self.blob_store)
+
+    def encode_text(self, text: Optional[str], column: str = "prompt") -> Optional[str]:
+        if text is None:
+            return None
+        encoded = self._encode(text.encode(), "t", column)
+        if encoded is not None:
+            return encoded
+        return MARKER + "r:" + text if text.startswith(MARKER) else text
+
+    def decode_text(self, value: Optional[str]) -> Optional[str]:
+        if not isinstance(value, str) or not value.startswith(MARKER):
+            return value
+        return self._decode(value).decode()
+
+    def encode_json(self, value: Any, column: str = "response") -> Any:
+        if isinstance(value, str):
+            # Text responses keep their JSON string form when stored uncompressed
+            return self.encode_text(value, column)
+        encoded = self._encode(json.dumps(value, separators=(",", ":")).encode(), "j", column) if value is not None else None
+        return value if encoded is None else encoded
+
+    def decode_json(self, value: Any) -> Any:
+        if not isinstance(value, str) or not value.startswith(MARKER):
+            return value
+        if value.startswith(MARKER + "r:"):
+            return value[3:]
+        kind = value.split(":", 4)[3] if value[1] == "z" else value.split(":", 2)[1]
+        data = self._decode(value).decode()
+        return json.loads(data) if kind == "j" else data
+
+    def _offloads(self, data: bytes) -> bool:
+        return bool(self.offload_threshold and self.blob_store is not None and len(data) >= self.offload_threshold)
+
+    def _store_blob(self, data: bytes) -> str:
+        """Writes `data` to the blob store unless it is known to be there; returns its key."""
+        key = hashlib.sha256(data).hexdigest()
+        if key in self._stored_keys:
+            return key
+        if not self.blob_store.exists(key):
+            body = self.codec.compress(data, self.dictionary) if self.codec else data
+            header = f"{self.codec.name if self.codec else 'none'}:{self.dictionary_id if self.codec else '-'}:".encode()
+            if not self.blob_store.put(key, header + body):
+                BLOB_DEDUPLICATED.inc()
+        else:
+            BLOB_DEDUPLICATED.inc()
+        if len(self._stored_keys) >= STORED_KEYS_MAX:
+            self._stored_keys.clear()
+        # Blobs are content-addressed and never removed, so a stored key stays valid
+        self._stored_keys.add(key)
+        return key
+
+    def offload(self, values: Iterable[Any]):
+        """
+        Writes the values that will be offloaded to the blob store ahead of encoding them, so
+        that encoding them afterwards (while the ORM flushes) does no file I/O. Blocking; see
+        `prepare_payloads`.
+        """
+        if not (self.offload_threshold and self.blob_store is not None):
+            return
+        for value in values:
+            if value is None:
+                continue
+            data = value.encode() if isinstance(value, str) else json.dumps(value, separators=(",", ":")).encode()
+            if self._offloads(data):
+                self._store_blob(data)
+
+    def _encode(self, data: bytes, kind: str, column: str) -> Optional[str]:
+        STORAGE_BYTES.labels(column=column, stage="raw").inc(len(data))
+        if self._offloads(data):
+            key = self._store_blob(data)
+            encoded = f"{MARKER}b:{kind}:{key}"
+            STORAGE_PAYLOADS.labels(column=column, form="blob").inc()
+        elif self.codec is not None and len(data) >= self.min_size:
+            compressed = base64.b85encode(self.codec.compress(data, self.dictionary)).decode()
+            encoded = f"{MARKER}z:{self.codec.name}:{self.dictionary_id}:{kind}:{compressed}"
+            if len(encoded) >= len(data):
+                # Incompressible (or too short to win after base85): keep it plain
+                STORAGE_BYTES.labels(column=column, stage="stored").inc(len(data))
+                STORAGE_PAYLOADS.labels(column=column, form="plain").inc()
+                return None
+            STORAGE_PAYLOADS.labels(column=column, form="compressed").inc()
+        else:
+            STORAGE_BYTES.labels(column=column, stage="stored").inc(len(data))
+            STORAGE_PAYLOADS.labels(column=column, form="plain").inc()
+            return None
+        STORAGE_BYTES.labels(column=column, stage="stored").inc(len(encoded))
+        return encoded
+
+    def _decode(self, value: str) -> bytes:
+        form = value[1:3]
+        if form == "r:":
+            return value[3:].encode()
+        if form == "z:":
+            _, codec_name, dictionary_key, _, data = value.split(":", 4)
+            return self._codec(codec_name).decompress(base64.b85decode(data), self._dictionary(dictionary_key))
+        if form == "b:":
+            if self.blob_store is None:
+                raise ValueError("Payload is in the blob store but no blob store is configured")
+            key = value.split(":", 2)[2]
+            codec_name, dictionary_key, body = self.blob_store.get(key).split(b":", 2)
+            if codec_name == b"none":
+                return body
+            return self._codec(codec_name.decode()).decompress(body, self._dictionary(dictionary_key.decode()))
+        raise ValueError("Unrecognized stored payload")
+
+    def _codec(self, name: str):
+        codec = self._codecs.get(name)
+        if codec is None:
+            codec = self._codecs[name] = make_codec(name)
+        return codec
+
+    def _dictionary(self, key: str) -> bytes:
+        dictionary = self._dictionaries.get(key)
+        if dictionary is None:
+            if self.blob_store is None:
+                raise ValueError(f"Compression dictionary {key} is not available")
+            dictionary = self._dictionaries[key] = self.blob_store.get(f"dictionary-{key}")
+        return dictionary
+
+def build_payload_codec() -> PayloadCodec:
+    """Builds the payload codec described by Settings."""
+    dictionary = b""
+    if settings.STORAGE_DICTIONARY_PATH:
+        with open(settings.STORAGE_DICTIONARY_PATH, "rb") as dictionary_file:
+            dictionary = dictionary_file.read()
+    return PayloadCodec(
+        codec=settings.STORAGE_CODEC,
+        dictionary=dictionary,
+        min_size=settings.STORAGE_MIN_SIZE,
+        offload_threshold=settings.BLOB_OFFLOAD_THRESHOLD,
+        blob_store=BlobStore(settings.BLOB_STORE_PATH) if settings.BLOB_STORE_PATH else None,
+        level=settings.STORAGE_LEVEL,
+    )
+
+payload_codec = build_payload_codec()
+
+def set_payload_codec(codec: PayloadCodec):
+    """Replaces the codec used by the `Request` columns (tests, benchmarks and scripts)."""
+    global payload_codec
+    payload_codec = codec
+
+async def prepare_payloads(values: Iterable[Any]):
+    """
+    Writes the prompts and responses about to be stored that go to the blob store, on a
+    worker thread. Call it before adding or flushing them: the column types then only look
+    the blobs up instead of writing files on the event loop.
+    """
+    codec = payload_codec
+    if codec.offload_threshold and codec.blob_store is not None:
+        await asyncio.to_thread(codec.offload, list(values))
+
+def stored_column(column):
+    """`column` (`Request.prompt` or `Request.response`) selected as stored, for `decode_payloads`."""
+    return type_coerce(column, column.type.impl_instance).label(column.key)
+
+async def decode_payloads(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Decodes the `prompt` and `response` values of rows selected with `stored_column`, in place.
+
+    Values that need decompressing or a blob read are decoded on a worker thread, so a page of
+    large or offloaded payloads does not block the event loop; plain values are left as they are.
+    """
+    encoded = [
+        (row, column) for row in rows for column in PAYLOAD_COLUMNS
+        if isinstance(row.get(column), str) and row[column].startswith(MARKER)
+    ]
+    if encoded:
+        codec = payload_codec
+
+        def decode():
+            for row, column in encoded:
+                row[column] = codec.decode_text(row[column]) if PAYLOAD_COLUMNS[column] == "t" else codec.decode_json(row[column])
+
+        await asyncio.to_thread(decode)
+    return rows
+
+class CompressedText(TypeDecorator):
+    """
+    A text column whose values go through the payload codec. The async queries select it with
+    `stored_column` and decode with `decode_payloads` instead, off the event loop.
+    """
+    impl = String
+    cache_ok = True
+
+    def __init__(self, column: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.column = column
+
+    def process_bind_param(self, value, dialect):
+        return payload_codec.encode_text(value, self.column)
+
+    def process_result_value(self, value, dialect):
+        return payload_codec.decode_text(value)
+
+class CompressedJSON(TypeDecorator):
+    """A JSON column whose values go through the payload codec."""
+    impl = JSON
+    cache_ok = True
+
+    def __init__(self, column: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.column = column
+
+    def process_bind_param(self, value, dialect):
+        return payload_codec.encode_json(value, self.column)
+
+    def process_result_value(self, value, dialect):
+        return payload_codec.decode_json(value)
@@ -0,0 +1,211 @@
+import asyncio
+import functools
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from prometheus_client import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Sub-millisecond cache and auth hits up to slow upstream completions
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Prometheus metrics for per-stage request latency
+REQUEST_STAGE_LATENCY = Histogram(
+    "request_stage_latency_seconds",
+    "Time spent in each request stage (auth, validation, cache, upstream, db)",
+    ["stage", "route", "model", "status"],
+    buckets=STAGE_BUCKETS,
+)
+
+@dataclass
+class Span:
+    """
+    A finished timed operation handed to span hooks.
+
+    Attributes:
+        name (str): The stage name, or "request" for the whole request.
+        trace_id (str): Shared by every span of one request.
+        start_time_ns (int): Wall-clock start in nanoseconds since the epoch.
+        end_time_ns (int): Wall-clock end in nanoseconds since the epoch.
+        attributes (dict): Route, model, status and any stage-specific attributes.
+        error (BaseException, optional): The exception that ended the span, if any.
+    """
+    name: str
+    trace_id: str
+    start_time_ns: int
+    end_time_ns: int
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[BaseException] = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end_time_ns - self.start_time_ns) / 1e9
+
+SpanHook = Callable[[Span], None]
+
+span_hooks: List[SpanHook] = []
+
+def add_span_hook(hook: SpanHook):
+    """
+    Registers a callable invoked with every finished `Span`.
+
+    This is the attachment point for tracing exporters (e.g. an OpenTelemetry adapter
+    creating spans with the given start and end times). Hooks run inline, so they should
+    only hand the span off; exceptions they raise are logged and ignored.
+    """
+    span_hooks.append(hook)
+
+def remove_span_hook(hook: SpanHook):
+    if hook in span_hooks:
+        span_hooks.remove(hook)
+
+def emit_span(span: Span):
+    for hook in list(span_hooks):
+        try:
+            hook(span)
+        except Exception as e:
+            logger.error(f"Error in span hook {hook!r}: {e}")
+
+class RequestTimings:
+    """
+    Per-request stage durations, measured with `time.perf_counter`.
+
+    Concurrent stages of the same name (e.g. upstream calls of a batch) add up, so each
+    stage reports the total time spent in it.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.started_ns = time.time_ns()
+        self.trace_id = uuid.uuid4().hex
+        self.route = "unmatched"
+        self.model = "none"
+        self.durations: Dict[str, float] = {}
+        self.route_started: Optional[float] = None
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def wall_time_ns(self, perf_time: float) -> int:
+        """Converts a `perf_counter` reading taken during this request to wall-clock nanoseconds."""
+        return self.started_ns + int((perf_time - self.started) * 1e9)
+
+    def add(self, name: str, duration: float):
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+
+    def server_timing(self) -> str:
+        """Formats the stages recorded so far, plus the total, as a `Server-Timing` header value."""
+        metrics = [f"{name};dur={duration * 1000:.2f}" for name, duration in self.durations.items()]
+        metrics.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(metrics)
+
+    def finish(self, status_code: int):
+        """Observes every stage in the stage histogram and emits the request span."""
+        status = str(status_code)
+        for name, duration in self.durations.items():
+            REQUEST_STAGE_LATENCY.labels(stage=name, route=self.route, model=self.model, status=status).observe(duration)
+        if span_hooks:
+            emit_span(Span(
+                name="request",
+                trace_id=self.trace_id,
+                start_time_ns=self.started_ns,
+                end_time_ns=self.wall_time_ns(time.perf_counter()),
+                attributes={"route": self.route, "model": self.model, "status": status_code},
+            ))
+
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+def begin_request() -> Tuple[RequestTimings, Any]:
+    """Starts timing a request in the current context. Returns the timings and a reset token."""
+    timings = RequestTimings()
+    return timings, _current_timings.set(timings)
+
+def end_request(token: Any):
+    _current_timings.reset(token)
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current_timings.get()
+
+def set_model(model: str):
+    """Labels the current request's metrics with the model it targets."""
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.model = model
+
+def record_stage(name: str, started: float, ended: float, error: Optional[BaseException] = None, **attributes):
+    """Records a stage that ran from `started` to `ended` (`perf_counter` readings)."""
+    timings = _current_timings.get()
+    if timings is None:
+        return
+    timings.add(name, ended - started)
+    if span_hooks:
+        emit_span(Span(
+            name=name,
+            trace_id=timings.trace_id,
+            start_time_ns=timings.wall_time_ns(started),
+            end_time_ns=timings.wall_time_ns(ended),
+            attributes={"route": timings.route, "model": timings.model, **attributes},
+            error=error,
+        ))
+
+@contextmanager
+def stage(name: str, **attributes) -> Iterator[None]:
+    """
+    Times the enclosed block as stage `name` of the current request.
+
+    Outside a request (no timings in the context) the block runs untimed.
+
+    Args:
+        name (str): The stage name, e.g. "auth", "cache", "upstream" or "db".
+        **attributes: Extra attributes passed to span hooks.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        record_stage(name, started, time.perf_counter(), e, **attributes)
+        raise
+    record_stage(name, started, time.perf_counter(), **attributes)
+
+def _time_validation(endpoint: Callable) -> Callable:
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        timings = _current_timings.get()
+        if timings is not None and timings.route_started is not None:
+            # Body parsing and validation run alongside the dependencies; auth is timed on its own
+            now = time.perf_counter()
+            elapsed = now - timings.route_started - timings.durations.get("auth", 0.0)
+            record_stage("validation", now - max(0.0, elapsed), now)
+        return await endpoint(*args, **kwargs)
+    wrapper.times_validation = True
+    return wrapper
+
+class TimedRoute(APIRoute):
+    """
+    An APIRoute that labels request metrics with the route path and records the time
+    FastAPI spends parsing and validating the request before the endpoint runs as the
+    `validation` stage.
+    """
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        # include_router re-creates routes from already wrapped endpoints
+        if asyncio.iscoroutinefunction(endpoint) and not getattr(endpoint, "times_validation", False):
+            endpoint = _time_validation(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            timings = _current_timings.get()
+            if timings is not None:
+                timings.route = self.path_format
+                timings.route_started = time.perf_counter()
+            return await handler(request)
+
+        return timed_handler
@@ -0,0 +1,356 @@
+import asyncio
+import base64
+import functools
+import hashlib
+import logging
+import math
+import os
+import re
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from fastapi import HTTPException, status
+from prometheus_client import Counter
+
+from .config import settings
+from .cache import LRUCache
+from .model_registry import ModelSpec, model_registry
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics for token accounting
+REQUEST_TOKENS = Counter("request_tokens_total", "Prompt and completion tokens of served requests", ["model", "kind"])
+UPSTREAM_COST = Counter("upstream_cost_dollars_total", "Upstream spend, priced from the model registry", ["model"])
+PREFLIGHT_REJECTIONS = Counter("preflight_rejections_total", "Requests rejected for exceeding the model's context window", ["model"])
+PREFLIGHT_UNCHECKED = Counter(
+    "preflight_unchecked_total", "Requests that may exceed the context window, passed on because their count is approximate", ["model"]
+)
+
+# Splits text into words (with their leading space), digit groups, punctuation runs and
+# whitespace, like the pre-tokenizers of the GPT encodings. BPE merges never cross pieces.
+PRETOKENIZE = re.compile(r"""'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+""")
+
+# Tokens the chat format adds around a single user message and for priming the reply
+PROMPT_OVERHEAD = {"chat": 7, "completion": 0}
+
+# The upstream default for max_tokens on completions; chat completions default to the rest of the window
+DEFAULT_COMPLETION_MAX_TOKENS = 16
+
+# Pre-tokenized pieces are merged at most this many bytes at a time, which bounds the quadratic
+# merge loop for degenerate input (a long run of letters or symbols is a single piece)
+MAX_PIECE_BYTES = 128
+
+# Batches with more prompt characters than this are counted on a worker thread
+THREAD_COUNT_THRESHOLD = 32768
+
+class TiktokenTokenizer:
+    """Exact counts from the `tiktoken` package, when it is installed."""
+    kind = "tiktoken"
+    exact = True
+
+    def __init__(self, encoding: str, threads: int = 4):
+        import tiktoken
+        self.encoding = tiktoken.get_encoding(encoding)
+        self.threads = threads
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode_ordinary(text))
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        # Encodes on a thread pool inside tiktoken's Rust core
+        return [len(tokens) for tokens in self.encoding.encode_ordinary_batch(list(texts), num_threads=self.threads)]
+
+class BPETokenizer:
+    """
+    Byte-pair encoding from a `.tiktoken` rank file (one base64 token and its rank per line).
+
+    Each pre-tokenized piece is merged greedily by rank, lowest first. Pieces repeat heavily
+    across prompts, so the merge result of each distinct piece is memoized. Pieces longer than
+    `MAX_PIECE_BYTES` are merged in chunks, which may count a token or two more than tiktoken
+    would for such a piece.
+    """
+    kind = "bpe"
+    exact = True
+
+    def __init__(self, ranks: Dict[bytes, int], piece_cache_size: int = 65536):
+        self.ranks = ranks
+        self.piece_tokens = functools.lru_cache(maxsize=piece_cache_size)(self._merge)
+
+    @classmethod
+    def from_file(cls, path: str) -> "BPETokenizer":
+        ranks = {}
+        with open(path, "rb") as rank_file:
+            for line in rank_file:
+                if line.strip():
+                    token, rank = line.split()
+                    ranks[base64.b64decode(token)] = int(rank)
+        return cls(ranks)
+
+    def _merge(self, piece: bytes) -> int:
+        if piece in self.ranks:
+            return 1
+        parts = [piece[i:i + 1] for i in range(len(piece))]
+        while len(parts) > 1:
+            best, best_rank = None, None
+            for i in range(len(parts) - 1):
+                rank = self.ranks.get(parts[i] + parts[i + 1])
+                if rank is not None and (best_rank is None or rank < best_rank):
+                    best, best_rank = i, rank
+            if best is None:
+                break
+            parts[best:best + 2] = [parts[best] + parts[best + 1]]
+        return len(parts)
+
+    def count(self, text: str) -> int:
+        total = 0
+        for piece in PRETOKENIZE.findall(text):
+            data = piece.encode()
+            for start in range(0, len(data), MAX_PIECE_BYTES):
+                total += self.piece_tokens(data[start:start + MAX_PIECE_BYTES])
+        return total
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        return [self.count(text) for text in texts]
+
+class ApproximateTokenizer:
+    """
+    A dependency-free estimate used when no encoding is available: a short piece (a common
+    word with its leading space, a digit group, punctuation) is one token and longer pieces
+    are about four characters per token.
+    """
+    kind = "approximate"
+    exact = False
+
+    def count(self, text: str) -> int:
+        return sum(1 if len(piece) <= 6 else math.ceil(len(piece) / 4) for piece in PRETOKENIZE.findall(text))
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        return [self.count(text) for text in texts]
+
+def load_tokenizer(encoding: str, bpe_dir: Optional[str] = None):
+    """
+    Returns the best tokenizer available for `encoding`: `tiktoken` if installed (and its
+    encoding can be loaded), else a rank file `<bpe_dir>/<encoding>.tiktoken`, else the
+    approximate tokenizer.
+    """
+    try:
+        return TiktokenTokenizer(encoding)
+    except Exception as e:
+        logger.debug(f"tiktoken is unavailable for {encoding}: {e}")
+    path = os.path.join(bpe_dir, f"{encoding}.tiktoken") if bpe_dir else None
+    if path and os.path.exists(path):
+        return BPETokenizer.from_file(path)
+    logger.warning(f"No {encoding} encoding available; token counts are approximate")
+    return ApproximateTokenizer()
+
+class TokenCounter:
+    """
+    Counts tokens per encoding, memoizing the count of each distinct text.
+
+    Tokenizers are loaded once per encoding (`load` preloads them at startup). Counts are
+    cached under a digest of the text, so repeated prompts, e.g. templated prompts or retried
+    requests, are counted once. `count_batch` looks every text up first and hands only the
+    distinct misses to the tokenizer in one call.
+    """
+    def __init__(self, cache_size: int = 10000, bpe_dir: Optional[str] = None):
+        self.bpe_dir = bpe_dir
+        self.tokenizers: Dict[str, Any] = {}
+        self.counts = LRUCache(max_entries=cache_size, ttl=86400.0, name="token_counts")
+
+    def tokenizer(self, encoding: str):
+        tokenizer = self.tokenizers.get(encoding)
+        if tokenizer is None:
+            tokenizer = self.tokenizers[encoding] = load_tokenizer(encoding, self.bpe_dir)
+            logger.info(f"Loaded the {tokenizer.kind} tokenizer for {encoding}")
+        return tokenizer
+
+    def load(self, encodings: Iterable[str]):
+        for encoding in set(encodings):
+            self.tokenizer(encoding)
+
+    @staticmethod
+    def _key(encoding: str, text: str) -> tuple:
+        return encoding, hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+    def count(self, text: str, encoding: str) -> int:
+        return self.count_batch([text], encoding)[0]
+
+    def count_batch(self, texts: Sequence[str], encoding: str) -> List[int]:
+        keys, counts, missing = self._lookup(texts, encoding)
+        if missing:
+            return self._store(keys, counts, missing, self.tokenizer(encoding).count_batch(list(missing.values())))
+        return counts
+
+    async def count_batch_async(self, texts: Sequence[str], encoding: str) -> List[int]:
+        """
+        `count_batch` for the event loop: misses totalling more than `THREAD_COUNT_THRESHOLD`
+        characters are tokenized on a worker thread. The memo is only touched on the loop.
+        """
+        keys, counts, missing = self._lookup(texts, encoding)
+        if not missing:
+            return counts
+        tokenizer, pending = self.tokenizer(encoding), list(missing.values())
+        if sum(len(text) for text in pending) > THREAD_COUNT_THRESHOLD:
+            computed = await asyncio.to_thread(tokenizer.count_batch, pending)
+        else:
+            computed = tokenizer.count_batch(pending)
+        return self._store(keys, counts, missing, computed)
+
+    def _lookup(self, texts: Sequence[str], encoding: str):
+        keys = [self._key(encoding, text) for text in texts]
+        counts = [self.counts.get(key) for key in keys]
+        missing = {key: text for key, text, count in zip(keys, texts, counts) if count is None}
+        return keys, counts, missing
+
+    def _store(self, keys: list, counts: list, missing: dict, computed_counts: List[int]) -> List[int]:
+        computed = dict(zip(missing, computed_counts))
+        for key, count in computed.items():
+            self.counts.set(key, count)
+        return [computed[key] if count is None else count for key, count in zip(keys, counts)]
+
+    def is_exact(self, encoding: str) -> bool:
+        """Whether counts for `encoding` come from a real tokenizer rather than the approximation."""
+        return self.tokenizer(encoding).exact
+
+token_counter = TokenCounter(settings.TOKEN_COUNT_CACHE_SIZE, settings.TOKENIZER_BPE_DIR)
+
+def requested_completion_tokens(spec: ModelSpec, parameters: Optional[dict]) -> int:
+    """The completion tokens a request reserves: its max_tokens, or the endpoint's default."""
+    max_tokens = (parameters or {}).get("max_tokens")
+    if max_tokens:
+        return int(max_tokens)
+    return DEFAULT_COMPLETION_MAX_TOKENS if spec.endpoint == "completion" else 0
+
+def _by_encoding(items: Sequence[Any]) -> Dict[str, List[int]]:
+    by_encoding: Dict[str, List[int]] = {}
+    for index, item in enumerate(items):
+        spec = model_registry.get(item.model)
+        by_encoding.setdefault(spec.encoding if spec else "cl100k_base", []).append(index)
+    return by_encoding
+
+def _with_overhead(item: Any, count: int) -> int:
+    spec = model_registry.get(item.model)
+    return count + PROMPT_OVERHEAD.get(spec.endpoint if spec else "completion", 0)
+
+def count_prompt_tokens(items: Sequence[Any]) -> List[int]:
+    """
+    Counts the prompt tokens of requests (objects with `model` and `prompt`), including the
+    chat format's overhead. Prompts sharing an encoding are counted in one batch.
+    """
+    counts: List[int] = [0] * len(items)
+    for encoding, indexes in _by_encoding(items).items():
+        for index, count in zip(indexes, token_counter.count_batch([items[index].prompt for index in indexes], encoding)):
+            counts[index] = _with_overhead(items[index], count)
+    return counts
+
+async def count_prompt_tokens_async(items: Sequence[Any]) -> List[int]:
+    """`count_prompt_tokens` for the event loop; large prompts are tokenized on a worker thread."""
+    counts: List[int] = [0] * len(items)
+    for encoding, indexes in _by_encoding(items).items():
+        batch = await token_counter.count_batch_async([items[index].prompt for index in indexes], encoding)
+        for index, count in zip(indexes, batch):
+            counts[index] = _with_overhead(items[index], count)
+    return counts
+
+def check_context_windows(items: Sequence[Any], counts: Sequence[int]):
+    """
+    Rejects the first request whose prompt tokens and requested completion tokens do not fit
+    the model's context window. Approximate counts are never grounds for a rejection: such a
+    request is passed on (and counted in `preflight_unchecked_total`) for upstream to judge.
+
+    Raises:
+        HTTPException: 400 naming the first item that does not fit.
+    """
+    for index, (item, prompt_tokens) in enumerate(zip(items, counts)):
+        spec = model_registry.get(item.model)
+        if spec is None:
+            continue
+        completion_tokens = requested_completion_tokens(spec, item.parameters)
+        if prompt_tokens + completion_tokens <= spec.context_window:
+            continue
+        if not token_counter.is_exact(spec.encoding):
+            PREFLIGHT_UNCHECKED.labels(model=item.model).inc()
+            continue
+        PREFLIGHT_REJECTIONS.labels(model=item.model).inc()
+        prefix = f"Item {index}: " if len(items) > 1 else ""
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=(
+                f"{prefix}The prompt is {prompt_tokens} tokens and {completion_tokens} completion tokens are requested, "
+                f"but {item.model} has a context window of {spec.context_window} tokens."
+            ),
+        )
+
+def preflight(items: Sequence[Any]) -> List[int]:
+    """
+    Counts the prompt tokens of requests and rejects any that cannot fit the model's context
+    window with the completion tokens it asks for, before anything is sent upstream.
+
+    Args:
+        items (Sequence): Objects with `model`, `prompt` and `parameters` (e.g. RequestSchema).
+
+    Returns:
+        list: The prompt tokens of each item.
+
+    Raises:
+        HTTPException: 400 naming the first item that does not fit.
+    """
+    counts = count_prompt_tokens(items)
+    check_context_windows(items, counts)
+    return counts
+
+async def preflight_async(items: Sequence[Any]) -> List[int]:
+    """`preflight` for the event loop; large prompts are tokenized on a worker thread."""
+    counts = await count_prompt_tokens_async(items)
+    check_context_windows(items, counts)
+    return counts
+
+@dataclass
+class Usage:
+    """Token usage reported by upstream for the current request, if it reached upstream."""
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    upstream_calls: int = 0
+
+_current_usage: ContextVar[Optional[Usage]] = ContextVar("request_usage", default=None)
+
+def track_usage() -> Usage:
+    """Starts collecting upstream usage for the calls made from the current context."""
+    usage = Usage()
+    _current_usage.set(usage)
+    return usage
+
+def record_upstream_usage(usage: Optional[dict] = None):
+    """Notes an upstream call, with its `usage` object when upstream reports one."""
+    current = _current_usage.get()
+    if current is None:
+        return
+    current.upstream_calls += 1
+    if usage:
+        current.prompt_tokens = usage.get("prompt_tokens", current.prompt_tokens)
+        current.completion_tokens = usage.get("completion_tokens", current.completion_tokens)
+
+def settle_usage(usage: Usage, model: str, prompt_tokens: int, response: Any) -> Dict[str, Any]:
+    """
+    Works out the token counts and cost to store with a finished request.
+
+    Counts reported by upstream win; otherwise (streams, cache hits, coalesced calls) the
+    prompt count from `preflight` and a local count of the response are used. Only requests
+    that called upstream themselves cost anything.
+
+    Returns:
+        dict: The `prompt_tokens`, `completion_tokens` and `cost` columns.
+    """
+    spec = model_registry.get(model)
+    completion_tokens = usage.completion_tokens
+    if completion_tokens is None:
+        text = response if isinstance(response, str) else str(response or "")
+        completion_tokens = token_counter.count(text, spec.encoding if spec else "cl100k_base")
+    prompt_tokens = usage.prompt_tokens if usage.prompt_tokens is not None else prompt_tokens
+    cost = spec.cost(prompt_tokens, completion_tokens) if spec is not None and usage.upstream_calls else 0.0
+    REQUEST_TOKENS.labels(model=model, kind="prompt").inc(prompt_tokens)
+    REQUEST_TOKENS.labels(model=model, kind="completion").inc(completion_tokens)
+    if cost:
+        UPSTREAM_COST.labels(model=model).inc(cost)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "cost": cost}
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+class UpstreamError(Exception):
+    """
+    Raised when the upstream API returns an error response or cannot be reached.
+
+    Attributes:
+        status (int, optional): The HTTP status returned by upstream, or None on connection errors and timeouts.
+        retry_after (float, optional): The upstream `Retry-After` hint in seconds, if any.
+    """
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses a `Retry-After` header given in seconds; HTTP-date values are ignored."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
+
+class UpstreamClient:
+    """
+    A pooled async HTTP client for the OpenAI-compatible upstream API.
+
+    A single long-lived `aiohttp.ClientSession` is opened by `start()` and closed by `close()`,
+    both from the app's lifespan. Its connector keeps a bounded pool of keep-alive
+    connections, so calls reuse sockets instead of paying a TCP/TLS handshake each time.
+    """
+    def __init__(
+        self,
+        base_url: str,
+        api_key: Optional[str] = None,
+        pool_size: int = 100,
+        keepalive_timeout: float = 30.0,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        """Opens the shared session. Safe to call more than once."""
+        if self.session is not None and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, headers=headers)
+
+    async def close(self):
+        """Closes the shared session and its pooled connections."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    async def post_json(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Sends a JSON POST request to the upstream API.
+
+        Args:
+            path (str): The endpoint path relative to the base URL (e.g. "/completions").
+            payload (dict): The JSON request body.
+
+        Returns:
+            dict: The decoded JSON response.
+
+        Raises:
+            UpstreamError: If upstream returns a non-2xx status, times out or cannot be reached.
+        """
+        if self.session is None:
+            await self.start()
+        try:
+            async with self.session.post(self.url(path), json=payload) as response:
+                if response.status >= 400:
+                    raise UpstreamError(
+                        await self._error_message(response),
+                        status=response.status,
+                        retry_after=parse_retry_after(response.headers.get("Retry-After")),
+                    )
+                return await response.json()
+        except asyncio.TimeoutError:
+            raise UpstreamError("Upstream request timed out")
+        except aiohttp.ClientError as e:
+            raise UpstreamError(f"Upstream connection error: {e}")
+
+    async def stream_events(self, path: str, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Sends a streaming JSON POST request and yields the upstream Server-Sent Events.
+
+        Lines are read from the socket only as the caller consumes events, so a slow
+        client applies backpressure all the way to upstream and the body is never
+        buffered in full.
+
+        Args:
+            path (str): The endpoint path relative to the base URL (e.g. "/completions").
+            payload (dict): The JSON request body; `stream` is forced on.
+
+        Yields:
+            dict: Each decoded `data:` event, until upstream sends `[DONE]`.
+
+        Raises:
+            UpstreamError: If upstream returns a non-2xx status, times out or cannot be reached.
+        """
+        if self.session is None:
+            await self.start()
+        try:
+            async with self.session.post(self.url(path), json={**payload, "stream": True}) as response:
+                if response.status >= 400:
+                    raise UpstreamError(
+                        await self._error_message(response),
+                        status=response.status,
+                        retry_after=parse_retry_after(response.headers.get("Retry-After")),
+                    )
+                async for raw_line in response.content:
+                    line = raw_line.decode().strip()
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        return
+                    yield json.loads(data)
+        except asyncio.TimeoutError:
+            raise UpstreamError("Upstream request timed out")
+        except aiohttp.ClientError as e:
+            raise UpstreamError(f"Upstream connection error: {e}")
+
+    async def ping(self, path: str = "/models"):
+        """
+        Checks that upstream answers an authenticated GET, for readiness probes.
+
+        Raises:
+            UpstreamError: If upstream rejects the request, times out or cannot be reached.
+        """
+        if self.session is None:
+            await self.start()
+        try:
+            async with self.session.get(self.url(path)) as response:
+                # A throttled key still shows upstream is reachable and accepts the key
+                if response.status >= 400 and response.status != 429:
+                    raise UpstreamError(await self._error_message(response), status=response.status)
+        except asyncio.TimeoutError:
+            raise UpstreamError("Upstream request timed out")
+        except aiohttp.ClientError as e:
+            raise UpstreamError(f"Upstream connection error: {e}")
+
+    @staticmethod
+    async def _error_message(response: aiohttp.ClientResponse) -> str:
+        try:
+            body = await response.json()
+            return body.get("error", {}).get("message") or str(body)
+        except (aiohttp.ContentTypeError, ValueError, AttributeError):
+            return await response.text() or response.reason or f"HTTP {response.status}"
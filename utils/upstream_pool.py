@@ -0,0 +1,257 @@
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+from urllib.parse import urlparse
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from .config import settings
+from .upstream import UpstreamClient, UpstreamError
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics per pooled upstream (a base URL and API key pair)
+UPSTREAM_INFLIGHT = Gauge("upstream_inflight_requests", "Calls in flight per pooled upstream", ["upstream"], multiprocess_mode="livesum")
+UPSTREAM_CALL_LATENCY = Histogram("upstream_call_seconds", "Latency of calls per pooled upstream", ["upstream", "outcome"])
+UPSTREAM_COOLDOWNS = Counter("upstream_cooldowns_total", "Pooled upstreams cooled down after a 429", ["upstream"])
+UPSTREAM_EJECTIONS = Counter("upstream_ejections_total", "Pooled upstreams ejected after consecutive failures", ["upstream"])
+
+STRATEGIES = ("least_outstanding", "weighted")
+
+# Statuses that say this upstream (rather than the request) is unhealthy. None is a timeout or connection error.
+UNHEALTHY_STATUSES = frozenset({None, 500, 502, 503, 504})
+
+# Weight of the newest sample in the latency moving average
+LATENCY_EWMA_ALPHA = 0.3
+
+class PoolMember:
+    """One upstream of a pool, with its load and health state."""
+    def __init__(self, name: str, client: UpstreamClient, weight: float = 1.0):
+        self.name = name
+        self.client = client
+        self.weight = weight
+        self.outstanding = 0
+        self.latency = 0.0
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.ejected_until = 0.0
+
+    def available_at(self) -> float:
+        return max(self.cooldown_until, self.ejected_until)
+
+class UpstreamPool:
+    """
+    Balances upstream calls over several API keys and/or base URLs.
+
+    Each call goes to the available member with the fewest outstanding calls per unit of
+    weight, ties going to the lower recent latency ("least_outstanding"), or to a member
+    drawn in proportion to its weight ("weighted"). A member answering 429 is cooled down
+    for its `Retry-After` (or `cooldown`) and the call moves on to another member; a member
+    failing `eject_threshold` times in a row with 5xx or connection errors is ejected for
+    `eject_duration` seconds. When every member is unavailable the call fails with a
+    retryable 503 whose `Retry-After` is the time until the first one returns.
+
+    It has the same `start`/`close`/`ping`/`post_json`/`stream_events` interface as `UpstreamClient`.
+    """
+    def __init__(
+        self,
+        members: List[PoolMember],
+        strategy: str = "least_outstanding",
+        cooldown: float = 10.0,
+        eject_threshold: int = 3,
+        eject_duration: float = 30.0,
+    ):
+        if not members:
+            raise ValueError("An upstream pool needs at least one member")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Invalid balancing strategy. Allowed strategies are: {', '.join(STRATEGIES)}")
+        self.members = members
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self.eject_threshold = eject_threshold
+        self.eject_duration = eject_duration
+
+    async def start(self):
+        for member in self.members:
+            await member.client.start()
+
+    async def close(self):
+        for member in self.members:
+            await member.client.close()
+
+    async def ping(self, path: str = "/models"):
+        """Succeeds as soon as one member answers; otherwise raises the last member's error."""
+        error = None
+        for member in self.members:
+            try:
+                return await member.client.ping(path)
+            except UpstreamError as e:
+                error = e
+        raise error
+
+    def select(self, exclude: frozenset = frozenset()) -> PoolMember:
+        """
+        Picks the member for the next call.
+
+        Raises:
+            UpstreamError: 503 with a `retry_after` when no member is available.
+        """
+        now = time.monotonic()
+        available = [member for member in self.members if member.available_at() <= now and member.name not in exclude]
+        if not available:
+            waiting = [member.available_at() - now for member in self.members if member.name not in exclude]
+            retry_after = max(0.0, min(waiting)) if waiting else None
+            raise UpstreamError("No upstream is available", status=503, retry_after=retry_after)
+        if self.strategy == "weighted":
+            return random.choices(available, weights=[member.weight for member in available])[0]
+        return min(available, key=lambda member: (member.outstanding / member.weight, member.latency, random.random()))
+
+    def _begin(self, member: PoolMember) -> float:
+        member.outstanding += 1
+        UPSTREAM_INFLIGHT.labels(upstream=member.name).inc()
+        return time.perf_counter()
+
+    def _end(self, member: PoolMember, started: float, error: Optional[UpstreamError] = None):
+        member.outstanding -= 1
+        UPSTREAM_INFLIGHT.labels(upstream=member.name).dec()
+        elapsed = time.perf_counter() - started
+        UPSTREAM_CALL_LATENCY.labels(upstream=member.name, outcome="error" if error else "success").observe(elapsed)
+        now = time.monotonic()
+        if error is None or (error.status not in UNHEALTHY_STATUSES and error.status != 429):
+            # A response, even a 4xx for a bad request, means the upstream is healthy
+            member.failures = 0
+            member.latency = elapsed if member.latency == 0 else (
+                LATENCY_EWMA_ALPHA * elapsed + (1 - LATENCY_EWMA_ALPHA) * member.latency
+            )
+        elif error.status == 429:
+            member.cooldown_until = now + (error.retry_after if error.retry_after is not None else self.cooldown)
+            UPSTREAM_COOLDOWNS.labels(upstream=member.name).inc()
+            logger.warning(f"Upstream {member.name} throttled; cooling down for {member.cooldown_until - now:.1f}s")
+        else:
+            member.failures += 1
+            if member.failures >= self.eject_threshold:
+                member.ejected_until = now + self.eject_duration
+                member.failures = 0
+                UPSTREAM_EJECTIONS.labels(upstream=member.name).inc()
+                logger.warning(f"Upstream {member.name} ejected for {self.eject_duration:.0f}s after repeated failures")
+
+    @staticmethod
+    def _fails_over(error: UpstreamError) -> bool:
+        return error.status == 429 or error.status in UNHEALTHY_STATUSES
+
+    def _next(self, tried: set, last_error: Optional[UpstreamError]) -> PoolMember:
+        try:
+            return self.select(frozenset(tried))
+        except UpstreamError:
+            # The remaining members are all unavailable: report what the last one tried said
+            if last_error is not None:
+                raise last_error
+            raise
+
+    async def post_json(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Sends the call to a selected member, moving on to the next one on 429s and upstream failures."""
+        tried, last_error = set(), None
+        while True:
+            member = self._next(tried, last_error)
+            started = self._begin(member)
+            try:
+                response = await member.client.post_json(path, payload)
+            except UpstreamError as e:
+                self._end(member, started, e)
+                tried.add(member.name)
+                if not self._fails_over(e) or len(tried) == len(self.members):
+                    raise
+                last_error = e
+                continue
+            except BaseException:
+                # Cancelled (e.g. a timeout) or a local error; the upstream itself is fine
+                self._end(member, started)
+                raise
+            self._end(member, started)
+            return response
+
+    async def stream_events(self, path: str, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Streams from a selected member; fails over like `post_json` until the first event arrives."""
+        tried, last_error = set(), None
+        while True:
+            member = self._next(tried, last_error)
+            started = self._begin(member)
+            relayed = False
+            try:
+                async for event in member.client.stream_events(path, payload):
+                    relayed = True
+                    yield event
+            except UpstreamError as e:
+                self._end(member, started, e)
+                tried.add(member.name)
+                if relayed or not self._fails_over(e) or len(tried) == len(self.members):
+                    raise
+                last_error = e
+                continue
+            except BaseException:
+                # The consumer stopped early (or was cancelled); the upstream itself is fine
+                self._end(member, started)
+                raise
+            self._end(member, started)
+            return
+
+def member_name(base_url: str, index: int) -> str:
+    """A metrics-safe member name (never the API key): the upstream host and the member's position."""
+    host = urlparse(base_url).netloc or base_url
+    return f"{host}#{index}"
+
+def parse_upstreams(raw: Optional[str], api_keys: Optional[str], base_url: str, default_api_key: Optional[str]) -> List[dict]:
+    """
+    Resolves the pool members from `UPSTREAMS` or `OPENAI_API_KEYS`.
+
+    `UPSTREAMS` is a JSON list of `{"base_url", "api_key" or "api_key_env", "weight", "name"}`
+    objects (base URL and key default to OPENAI_BASE_URL and OPENAI_API_KEY); `OPENAI_API_KEYS`
+    is a comma-separated list of keys used against OPENAI_BASE_URL.
+    """
+    if raw:
+        entries = json.loads(raw)
+    elif api_keys:
+        entries = [{"api_key": key.strip()} for key in api_keys.split(",") if key.strip()]
+    else:
+        return []
+    members = []
+    for index, entry in enumerate(entries):
+        url = entry.get("base_url") or base_url
+        key = os.getenv(entry["api_key_env"]) if entry.get("api_key_env") else entry.get("api_key", default_api_key)
+        members.append({
+            "name": entry.get("name") or member_name(url, index),
+            "base_url": url,
+            "api_key": key,
+            "weight": float(entry.get("weight", 1)),
+        })
+    return members
+
+def make_client(base_url: str, api_key: Optional[str]) -> UpstreamClient:
+    """Creates a pooled upstream client with the connection settings from Settings."""
+    return UpstreamClient(
+        base_url=base_url,
+        api_key=api_key,
+        pool_size=settings.UPSTREAM_POOL_SIZE,
+        keepalive_timeout=settings.UPSTREAM_KEEPALIVE_TIMEOUT,
+        connect_timeout=settings.UPSTREAM_CONNECT_TIMEOUT,
+        read_timeout=settings.UPSTREAM_READ_TIMEOUT,
+    )
+
+def build_upstream(base_url: str, api_key: Optional[str]):
+    """
+    Returns the default upstream: an `UpstreamPool` when UPSTREAMS or OPENAI_API_KEYS lists
+    members, otherwise a single `UpstreamClient` for `base_url` and `api_key`.
+    """
+    members = parse_upstreams(settings.UPSTREAMS, settings.OPENAI_API_KEYS, base_url, api_key)
+    if not members:
+        return make_client(base_url, api_key)
+    return UpstreamPool(
+        [PoolMember(member["name"], make_client(member["base_url"], member["api_key"]), member["weight"]) for member in members],
+        strategy=settings.UPSTREAM_BALANCING,
+        cooldown=settings.UPSTREAM_COOLDOWN,
+        eject_threshold=settings.UPSTREAM_EJECT_THRESHOLD,
+        eject_duration=settings.UPSTREAM_EJECT_DURATION,
+    )